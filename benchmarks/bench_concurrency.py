@@ -0,0 +1,135 @@
+"""
+Benchmark: job throughput of the sync handler vs the async handler.
+
+Each job fetches a reference image from a slow local HTTP server (standing
+in for a remote URL), renders on the fake ComfyUI server and returns an
+inlined video. The sync handler runs jobs back to back, as RunPod does
+with a plain handler; the async handler runs up to --concurrency jobs at
+once, as RunPod does with a concurrency_modifier, with ComfyUI's queue
+bounded by QueueDepthGate.
+
+Usage:
+    python benchmarks/bench_concurrency.py [--jobs 8] [--render 0.5] [--fetch 0.3]
+"""
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, ROOT)
+
+import handler  # noqa: E402
+from comfy_bridge import ComfyClient, QueueDepthGate  # noqa: E402
+from tests.fake_comfy import FakeComfyServer  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+WORKFLOW = {
+    "1": {"class_type": "LoadImage", "inputs": {"image": "ref"}},
+    "75": {"class_type": "SaveVideo", "inputs": {"images": ["1", 0]}},
+}
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def make_jobs(count: int, base_url: str) -> list[dict]:
+    return [
+        {"id": f"job-{i}", "input": {"workflow": WORKFLOW, "images": {"ref": f"{base_url}/ref_{i}.png"}}}
+        for i in range(count)
+    ]
+
+
+def run_sync(jobs: list[dict]) -> float:
+    start = time.perf_counter()
+    for job in jobs:
+        assert handler.handler(job)["status"] == "success"
+    return time.perf_counter() - start
+
+
+def run_async(jobs: list[dict], concurrency: int, client: ComfyClient, max_depth: int) -> float:
+    async def main():
+        handler.queue_gate = QueueDepthGate(client, max_depth=max_depth, poll_interval=0.02)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run(job):
+            async with slots:
+                result = await handler.async_handler(job)
+            assert result["status"] == "success", result
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run(job) for job in jobs))
+        return time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--render", type=float, default=0.5, help="Seconds per render")
+    parser.add_argument("--fetch", type=float, default=0.3, help="Seconds per input fetch")
+    parser.add_argument("--output-mb", type=int, default=16)
+    parser.add_argument("--max-depth", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        served = tmp / "served"
+        served.mkdir()
+        for i in range(args.jobs):
+            (served / f"ref_{i}.png").write_bytes(b"\x89PNG\r\n\x1a\n" + os.urandom(256 * 1024))
+        (tmp / "output" / "video").mkdir(parents=True)
+        (tmp / "output" / "video" / "LTX-2_00001_.mp4").write_bytes(os.urandom(args.output_mb * 1024 * 1024))
+
+        SlowHandler.delay = args.fetch
+        http = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(SlowHandler, directory=str(served)))
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{http.server_address[1]}"
+
+        with FakeComfyServer(render_time=args.render) as server, \
+                patch("handler.COMFY_INPUT_DIR", str(tmp / "input")), \
+                patch("handler.COMFY_OUTPUT_DIR", str(tmp / "output")), \
+                patch("handler.progress_update"):
+            client = ComfyClient(port=server.port)
+            handler.comfy_client = client
+
+            print(f"{args.jobs} jobs, {args.render}s render, {args.fetch}s input fetch, {args.output_mb} MB output")
+            print(f"{'mode':<16}{'total (s)':>10}{'jobs/min':>10}{'speedup':>10}{'max depth':>11}")
+
+            baseline = run_sync(make_jobs(args.jobs, base_url))
+            print(f"{'sync':<16}{baseline:>10.2f}{args.jobs / baseline * 60:>10.1f}{1:>9.2f}x{server.max_queue_depth:>11}")
+
+            for concurrency in (2, 3, 4):
+                server.max_queue_depth = 0
+                elapsed = run_async(make_jobs(args.jobs, base_url), concurrency, client, args.max_depth)
+                print(
+                    f"{f'async x{concurrency}':<16}{elapsed:>10.2f}{args.jobs / elapsed * 60:>10.1f}"
+                    f"{baseline / elapsed:>9.2f}x{server.max_queue_depth:>11}"
+                )
+
+            client.close()
+        http.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark: per-call overhead of ComfyClient's poll-heavy endpoints.
+
+Compares a fresh connection per call (bare requests.get, the old behaviour)
+against the client's pooled keep-alive session, using the fake ComfyUI
+server from the test suite as a local stub.
+
+Usage:
+    python benchmarks/bench_http_session.py [--calls 500]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, ROOT)
+
+from comfy_bridge import ComfyClient  # noqa: E402
+from tests.fake_comfy import FakeComfyServer  # noqa: E402
+
+
+def time_calls(fn, calls: int) -> float:
+    """Return mean microseconds per call."""
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+
+    with FakeComfyServer() as server:
+        client = ComfyClient(port=server.port)
+        base = client.base_url
+
+        paths = {
+            "is_ready": "/system_stats",
+            "get_history": "/history/missing",
+            "get_queue": "/queue",
+        }
+        pooled = {
+            "is_ready": client.is_ready,
+            "get_history": lambda: client.get_history("missing"),
+            "get_queue": client.get_queue,
+        }
+
+        print(f"{'endpoint':<14}{'new conn (us)':>16}{'pooled (us)':>14}{'speedup':>10}")
+        for name, path in paths.items():
+            before = time_calls(lambda: requests.get(f"{base}{path}", timeout=5), args.calls)
+            after = time_calls(pooled[name], args.calls)
+            print(f"{name:<14}{before:>16.1f}{after:>14.1f}{before / after:>9.2f}x")
+
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
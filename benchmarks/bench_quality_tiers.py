@@ -0,0 +1,63 @@
+"""
+Benchmark: graph size and estimated render cost per quality tier.
+
+Builds every template at each quality tier (as build_workflow does for a
+job, pruning included) and reports the nodes queued, the render size,
+total sampling steps and admission's prior cost estimate: latent tokens,
+seconds and VRAM, with the speedup over the standard tier. Estimates come
+from the untrained cost model, so compare tiers rather than read the
+seconds as a real GPU's.
+
+Usage:
+    python benchmarks/bench_quality_tiers.py [--resolution 720p] [--templates t2v,i2v]
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import handler  # noqa: E402
+from admission import CostModel, workflow_family, workflow_shape  # noqa: E402
+from quality import QUALITY_TIERS  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+GIB = 1024 ** 3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resolution", default="720p", help="Resolution preset each job asks for")
+    parser.add_argument("--templates", default=",".join(handler.WORKFLOW_TEMPLATES))
+    args = parser.parse_args()
+
+    handler.WORKFLOW_DIR = os.path.join(ROOT, "workflows")
+    model = CostModel()
+
+    print(f"Jobs at resolution {args.resolution}; cost from the cost model's priors")
+    print(f"{'template':<10}{'tier':<10}{'nodes':>7}{'size':>14}{'steps':>7}"
+          f"{'tokens':>9}{'est (s)':>9}{'VRAM (GiB)':>12}{'speedup':>9}")
+    for template in args.templates.split(","):
+        rows = {}
+        for tier in QUALITY_TIERS:
+            job_input = {"template": template, "resolution": args.resolution, "quality": tier}
+            workflow = handler.build_workflow(job_input, {})
+            shape = workflow_shape(workflow)
+            rows[tier] = (workflow, shape, model.estimate(workflow_family(workflow), shape))
+
+        baseline = rows["standard"][2]["seconds"]
+        for tier, (workflow, shape, estimate) in rows.items():
+            size = f"{shape['width']}x{shape['height']}x{shape['frames']}"
+            print(
+                f"{template:<10}{tier:<10}{len(workflow):>7}{size:>14}{shape['steps']:>7}"
+                f"{estimate['tokens']:>9}{estimate['seconds']:>9.1f}"
+                f"{estimate['vram_bytes'] / GIB:>12.1f}{baseline / estimate['seconds']:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
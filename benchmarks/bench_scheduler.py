@@ -0,0 +1,138 @@
+"""
+Benchmark: job latency under each scheduling policy, simulated.
+
+Jobs from a mix of templates and resolutions arrive at random (Poisson)
+on one worker whose GPU renders one prompt at a time. Each job's render
+takes its true duration, plus a model reload when it follows a job from
+another group (template and model set); the scheduler only sees a noisy
+estimate of the duration, as it would from admission's cost model. When
+the GPU frees up the policy picks the next job among those waiting.
+
+Reports latency (arrival to finished render) percentiles over all jobs,
+the p95 of the longest jobs (to show whether they starve), the number
+of model reloads per policy and the reloads it avoids relative to FIFO.
+
+Usage:
+    python benchmarks/bench_scheduler.py [--jobs 2000] [--load 0.85] [--reload 25]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from scheduler import Scheduler, Ticket  # noqa: E402
+
+# (name, group, render seconds, share of jobs)
+JOB_MIX = [
+    ("i2v 512p", "i2v", 35.0, 0.35),
+    ("i2v 720p", "i2v", 80.0, 0.25),
+    ("t2v 720p", "t2v", 140.0, 0.25),
+    ("t2v 1080p", "t2v", 380.0, 0.15),
+]
+
+
+def make_jobs(count: int, load: float, reload: float, noise: float, rng: random.Random) -> list[dict]:
+    """Jobs arriving so the GPU is busy load of the time, reloads included."""
+    mean_render = sum(seconds * share for _, _, seconds, share in JOB_MIX)
+    # FIFO over two interleaved groups reloads on about half the jobs
+    mean_service = mean_render + reload / 2
+    rate = load / mean_service
+
+    jobs = []
+    clock = 0.0
+    for _ in range(count):
+        clock += rng.expovariate(rate)
+        name, group, seconds, _ = rng.choices(JOB_MIX, weights=[share for *_, share in JOB_MIX])[0]
+        duration = seconds * rng.uniform(0.9, 1.1)
+        jobs.append({
+            "name": name,
+            "group": group,
+            "arrived": clock,
+            "duration": duration,
+            "estimate": duration * rng.lognormvariate(0, noise),
+        })
+    return jobs
+
+
+def simulate(jobs: list[dict], scheduler: Scheduler, reload: float) -> dict:
+    clock = 0.0
+    last_group = None
+    reloads = 0
+    waiting: list[Ticket] = []
+    by_ticket: dict[Ticket, dict] = {}
+    latencies: dict[str, list[float]] = {}
+    arrivals = iter(jobs)
+    upcoming = next(arrivals, None)
+
+    while upcoming is not None or waiting:
+        if not waiting:
+            clock = max(clock, upcoming["arrived"])
+        while upcoming is not None and upcoming["arrived"] <= clock:
+            ticket = Ticket(upcoming["estimate"], upcoming["group"], upcoming["name"], arrived=upcoming["arrived"])
+            by_ticket[ticket] = upcoming
+            waiting.append(ticket)
+            upcoming = next(arrivals, None)
+
+        ticket = scheduler.pick(waiting, now=clock, last_group=last_group)
+        waiting.remove(ticket)
+        job = by_ticket.pop(ticket)
+        if last_group is not None and job["group"] != last_group:
+            clock += reload
+            reloads += 1
+        clock += job["duration"]
+        last_group = job["group"]
+        latencies.setdefault(job["name"], []).append(clock - job["arrived"])
+
+    return {"latencies": latencies, "reloads": reloads}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--load", type=float, default=0.85, help="Share of time the GPU is busy")
+    parser.add_argument("--reload", type=float, default=25.0, help="Seconds to switch model sets")
+    parser.add_argument("--noise", type=float, default=0.2, help="Log-normal sigma of estimate error")
+    parser.add_argument("--aging", type=float, default=0.2)
+    parser.add_argument("--group-bonus", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs, args.load, args.reload, args.noise, random.Random(args.seed))
+    longest = JOB_MIX[-1][0]
+    policies = [
+        ("fifo", Scheduler("fifo")),
+        ("sjf", Scheduler("sjf", aging=0, group_bonus=0)),
+        ("sjf+aging", Scheduler("sjf", aging=args.aging, group_bonus=0)),
+        ("sjf+aging+group", Scheduler("sjf", aging=args.aging, group_bonus=args.group_bonus)),
+    ]
+
+    print(f"{args.jobs} jobs at {args.load:.0%} load, {args.reload}s model reload, "
+          f"estimates within x{math.exp(args.noise):.2f}")
+    print(f"{'policy':<18}{'p50 (s)':>9}{'p95 (s)':>9}{'p99 (s)':>9}{'mean (s)':>10}"
+          f"{f'{longest} p95':>16}{'reloads':>9}{'avoided':>9}")
+    baseline_reloads = None
+    for name, scheduler in policies:
+        result = simulate(jobs, scheduler, args.reload)
+        if baseline_reloads is None:
+            baseline_reloads = result["reloads"]
+        everything = [value for values in result["latencies"].values() for value in values]
+        print(
+            f"{name:<18}{percentile(everything, 0.5):>9.0f}{percentile(everything, 0.95):>9.0f}"
+            f"{percentile(everything, 0.99):>9.0f}{sum(everything) / len(everything):>10.0f}"
+            f"{percentile(result['latencies'][longest], 0.95):>16.0f}{result['reloads']:>9}"
+            f"{baseline_reloads - result['reloads']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
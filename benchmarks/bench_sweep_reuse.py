@@ -0,0 +1,81 @@
+"""
+Benchmark: ComfyUI node cache reuse of a sweep, by queue order.
+
+Expands a sweep of prompts x resolutions x seeds over a template and
+predicts, from each node's cache key, which nodes ComfyUI serves from
+the prompt it ran before (its default cache keeps only that one) when
+the items are queued in sweep order (prompts back to back, seeds
+innermost), shortest first (as the scheduler orders other batches) or
+in random order. Reports the share of nodes reused and how many times
+the text encoder runs.
+
+Usage:
+    python benchmarks/bench_sweep_reuse.py [--prompts 4] [--resolutions 480p,720p] [--seeds 4]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import handler  # noqa: E402
+from admission import CostModel, workflow_family, workflow_shape  # noqa: E402
+from comfy_bridge import cache_reuse, prune_workflow  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+TEXT_ENCODERS = ("CLIPTextEncode",)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--template", default="t2v")
+    parser.add_argument("--prompts", type=int, default=4)
+    parser.add_argument("--resolutions", default="480p,720p")
+    parser.add_argument("--seeds", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random order")
+    args = parser.parse_args()
+
+    handler.WORKFLOW_DIR = os.path.join(ROOT, "workflows")
+    job_input = {"template": args.template, "sweep": {
+        "prompt": [f"Prompt {index}" for index in range(args.prompts)],
+        "resolution": args.resolutions.split(","),
+        "seed": list(range(args.seeds)),
+    }}
+    items = handler.expand_variants(job_input)
+    workflows = [
+        prune_workflow(handler.build_workflow({"template": args.template, **item}, {}))[0]
+        for item in items
+    ]
+
+    model = CostModel()
+    costs = [model.estimate(workflow_family(workflow), workflow_shape(workflow))["seconds"] for workflow in workflows]
+    orders = [
+        ("sweep", list(range(len(items)))),
+        ("shortest first", sorted(range(len(items)), key=lambda index: costs[index])),
+        ("random", random.Random(args.seed).sample(range(len(items)), len(items))),
+    ]
+
+    print(f"{len(items)} items of {args.template}: {args.prompts} prompts x "
+          f"{len(job_input['sweep']['resolution'])} resolutions x {args.seeds} seeds")
+    print(f"{'order':<16}{'nodes':>7}{'reused':>8}{'rate':>8}{'text encodes':>14}")
+    for name, order in orders:
+        queued = [workflows[index] for index in order]
+        reused = cache_reuse(queued)
+        nodes = sum(len(workflow) for workflow in queued)
+        hits = sum(len(nodes) for nodes in reused)
+        encodes = sum(
+            1
+            for workflow, cached in zip(queued, reused)
+            for node_id, node in workflow.items()
+            if node["class_type"] in TEXT_ENCODERS and node_id not in cached
+        )
+        print(f"{name:<16}{nodes:>7}{hits:>8}{hits / nodes:>8.1%}{encodes:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark: per-job template preparation time.
+
+Compares re-parsing each workflow template from disk (load_workflow, the old
+per-job behaviour) against cloning it from the process-wide WorkflowCache.
+
+Usage:
+    python benchmarks/bench_template_prep.py [--runs 200]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from comfy_bridge import WorkflowCache, load_workflow  # noqa: E402
+from handler import WORKFLOW_TEMPLATES  # noqa: E402
+
+logging.disable(logging.INFO)
+
+WORKFLOW_DIR = os.path.join(ROOT, "workflows")
+
+
+def time_runs(fn, runs: int) -> float:
+    """Return mean microseconds per call."""
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    cache = WorkflowCache()
+    print(f"{'template':<10}{'file (KB)':>10}{'parse (us)':>14}{'cached (us)':>14}{'speedup':>10}")
+    for name, filename in WORKFLOW_TEMPLATES.items():
+        path = os.path.join(WORKFLOW_DIR, filename)
+        size_kb = os.path.getsize(path) / 1024
+        parse = time_runs(lambda: load_workflow(path), args.runs)
+        cached = time_runs(lambda: cache.load(path), args.runs)
+        print(f"{name:<10}{size_kb:>10.0f}{parse:>14.1f}{cached:>14.1f}{parse / cached:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
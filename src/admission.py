@@ -0,0 +1,358 @@
+"""
+Admission Control
+
+Estimates what a render will cost before it is queued, so jobs that can't
+fit in VRAM are rejected (or downscaled) up front instead of failing deep
+inside ComfyUI after minutes of work.
+
+Cost is modelled per workflow family (graph structure) from the latent
+size, width/32 x height/32 x ((frames - 1)/8 + 1) tokens for LTX-Video,
+and the sampling step count:
+
+    peak VRAM  = base_bytes + bytes_per_token * tokens
+    exec time  = overhead_seconds + seconds_per_token_step * tokens * steps
+
+The runtime coefficients are fitted from recorded history. bytes_per_token
+starts from a permissive prior and is bounded by what happened on this
+GPU: an out-of-memory failure raises it so that shape no longer fits,
+a success caps it so that shape still does.
+
+The prior alone never turns a render away: a rejected shape would never
+run, so nothing could correct an estimate that's too high. Admission
+decisions only use the bytes per token proven by recorded out-of-memory
+failures; until a family has one, its renders are admitted and their
+estimates recorded.
+"""
+
+import json
+import math
+import hashlib
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# LTX-Video VAE compression: 32x32 pixels and 8 frames per latent token
+LATENT_SPATIAL = 32
+LATENT_TEMPORAL = 8
+
+# Downscaled sizes stay multiples of this (the t2v template samples at half
+# resolution, which must still be a multiple of 32) and no smaller than
+# MIN_DIMENSION
+DIMENSION_MULTIPLE = 64
+MIN_DIMENSION = 256
+
+DEFAULT_PRIORS = {
+    "base_bytes": 8 * 1024 ** 3,
+    "bytes_per_token": 512 * 1024,
+    "overhead_seconds": 5.0,
+    "seconds_per_token_step": 2.5e-4,
+}
+
+# Runtime samples kept per family for fitting
+MAX_SAMPLES = 200
+
+# Node classes whose inputs give the render size and step count
+LATENT_VIDEO_NODES = ("EmptyLTXVLatentVideo",)
+IMAGE_SIZE_NODES = ("EmptyImage", "EmptyLatentImage", "EmptySD3LatentImage")
+SCHEDULER_STEP_INPUTS = {
+    "LTXVScheduler": "steps",
+    "BasicScheduler": "steps",
+    "KSampler": "steps",
+    "KSamplerAdvanced": "steps",
+}
+
+OOM_MARKERS = ("out of memory", "outofmemoryerror", "allocation on device")
+
+
+def latent_tokens(width: int, height: int, frames: int) -> int:
+    """Number of latent tokens LTX-Video samples for a render size."""
+    return (
+        math.ceil(width / LATENT_SPATIAL)
+        * math.ceil(height / LATENT_SPATIAL)
+        * ((max(frames, 1) - 1) // LATENT_TEMPORAL + 1)
+    )
+
+
+def workflow_family(workflow: dict[str, Any]) -> str:
+    """
+    Identify a workflow's graph structure, independent of its values.
+
+    Jobs from the same template (or the same direct workflow with other
+    prompts and sizes) share a family and so a cost model.
+    """
+    structure = sorted((node_id, node.get("class_type", "")) for node_id, node in workflow.items())
+    return hashlib.sha256(json.dumps(structure).encode()).hexdigest()[:16]
+
+
+def _int_input(workflow: dict[str, Any], node_id: str, input_name: str) -> tuple[int, tuple[str, str]] | None:
+    """
+    Read an integer input, following a link to a constant node.
+
+    Returns:
+        Tuple of (value, (node_id, input_name) holding the literal), or None
+    """
+    value = workflow[node_id].get("inputs", {}).get(input_name)
+    if isinstance(value, list) and len(value) == 2 and value[0] in workflow:
+        node_id, input_name = value[0], "value"
+        value = workflow[node_id].get("inputs", {}).get(input_name)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value), (node_id, input_name)
+    return None
+
+
+def workflow_shape(workflow: dict[str, Any]) -> dict[str, Any] | None:
+    """
+    Find a workflow's render size and step count.
+
+    Width and height come from a latent video node if they're literal (or
+    constants), otherwise from an empty image node; frames from the latent
+    video node's length; steps add up over every scheduler and manual
+    sigma list.
+
+    Returns:
+        Dict with width, height, frames, steps and sources (the
+        (node_id, input_name) holding width, height and, if found,
+        frames), or None if the size can't be determined
+    """
+    size = frames = None
+    for node_id, node in workflow.items():
+        if node.get("class_type") in LATENT_VIDEO_NODES:
+            width = _int_input(workflow, node_id, "width")
+            height = _int_input(workflow, node_id, "height")
+            length = _int_input(workflow, node_id, "length")
+            if length:
+                frames = length
+            if width and height:
+                size = (width, height)
+    if size is None:
+        for node_id, node in workflow.items():
+            if node.get("class_type") in IMAGE_SIZE_NODES:
+                width = _int_input(workflow, node_id, "width")
+                height = _int_input(workflow, node_id, "height")
+                if width and height:
+                    size = (width, height)
+                    break
+    if size is None:
+        return None
+
+    steps = 0
+    for node_id, node in workflow.items():
+        class_type = node.get("class_type")
+        if class_type in SCHEDULER_STEP_INPUTS:
+            found = _int_input(workflow, node_id, SCHEDULER_STEP_INPUTS[class_type])
+            steps += found[0] if found else 0
+        elif class_type == "ManualSigmas":
+            sigmas = node.get("inputs", {}).get("sigmas")
+            if isinstance(sigmas, str):
+                steps += max(len([s for s in sigmas.split(",") if s.strip()]) - 1, 0)
+
+    (width, width_source), (height, height_source) = size
+    sources = {"width": width_source, "height": height_source}
+    if frames:
+        sources["frames"] = frames[1]
+    return {
+        "width": width,
+        "height": height,
+        "frames": frames[0] if frames else 1,
+        "steps": steps or 1,
+        "sources": sources,
+    }
+
+
+def is_oom_error(message: str) -> bool:
+    """Check whether a ComfyUI error message reports running out of VRAM."""
+    message = message.lower()
+    return any(marker in message for marker in OOM_MARKERS)
+
+
+class CostModel:
+    """
+    Per-family VRAM and runtime estimates, calibrated from job history.
+
+    Args:
+        history_path: JSON lines file observations are appended to and
+            replayed from on startup; None keeps history in memory only
+        priors: Coefficients used before a family has history
+    """
+
+    def __init__(self, history_path: str | Path | None = None, priors: dict[str, float] | None = None):
+        self.priors = {**DEFAULT_PRIORS, **(priors or {})}
+        self.history_path = Path(history_path) if history_path else None
+        self._samples: dict[str, deque] = {}
+        self._oom_floor: dict[str, float] = {}
+        self._ok_ceiling: dict[str, float] = {}
+        self._fits: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def estimate(self, family: str, shape: dict[str, Any]) -> dict[str, Any]:
+        """
+        Estimate a render's cost.
+
+        Returns:
+            Dict with tokens, vram_bytes and seconds
+        """
+        tokens = latent_tokens(shape["width"], shape["height"], shape["frames"])
+        with self._lock:
+            bytes_per_token = self._bytes_per_token(family)
+            overhead, per_token_step = self._fit(family)
+        return {
+            "tokens": tokens,
+            "vram_bytes": int(self.priors["base_bytes"] + bytes_per_token * tokens),
+            "seconds": round(overhead + per_token_step * tokens * shape["steps"], 2),
+        }
+
+    def decide(self, family: str, shape: dict[str, Any], budget: int, policy: str = "reject") -> dict[str, Any]:
+        """
+        Decide whether a render fits a VRAM budget.
+
+        Only a recorded out-of-memory failure of the family can show that
+        a render won't fit; without one every render is admitted, even if
+        its estimate is over budget.
+
+        Args:
+            budget: Usable VRAM in bytes
+            policy: "reject" or "downscale" renders that don't fit
+
+        Returns:
+            Dict with action ("admit", "downscale" or "reject"), estimate
+            and, when downscaling, the width and height that fit
+        """
+        estimate = self.estimate(family, shape)
+        with self._lock:
+            floor = self._oom_floor.get(family, 0.0)
+        if self.priors["base_bytes"] + floor * estimate["tokens"] <= budget:
+            return {"action": "admit", "estimate": estimate}
+        if policy != "downscale":
+            return {"action": "reject", "estimate": estimate}
+
+        max_tokens = (budget - self.priors["base_bytes"]) / floor
+        scale = math.sqrt(max(max_tokens, 0) / estimate["tokens"])
+        width = _round_down(shape["width"] * scale)
+        height = _round_down(shape["height"] * scale)
+        while width >= MIN_DIMENSION and height >= MIN_DIMENSION:
+            smaller = {**shape, "width": width, "height": height}
+            downscaled = self.estimate(family, smaller)
+            if self.priors["base_bytes"] + floor * downscaled["tokens"] <= budget:
+                return {"action": "downscale", "estimate": downscaled, "width": width, "height": height}
+            # Shrink the longer side first to keep the aspect ratio close
+            if width >= height:
+                width -= DIMENSION_MULTIPLE
+            else:
+                height -= DIMENSION_MULTIPLE
+        return {"action": "reject", "estimate": estimate}
+
+    def observe(self, family: str, shape: dict[str, Any], seconds: float, budget: int = 0) -> None:
+        """Record a render that finished in seconds within budget bytes of VRAM."""
+        self._record({"family": family, **_shape_fields(shape), "seconds": round(seconds, 3), "budget": budget})
+
+    def observe_oom(self, family: str, shape: dict[str, Any], budget: int) -> None:
+        """Record a render that ran out of VRAM with budget bytes usable."""
+        self._record({"family": family, **_shape_fields(shape), "oom": True, "budget": budget})
+
+    def stats(self) -> dict[str, Any]:
+        """Sample counts and current coefficients per family."""
+        with self._lock:
+            return {
+                family: {
+                    "samples": len(self._samples.get(family, ())),
+                    "bytes_per_token": self._bytes_per_token(family),
+                    "fit": self._fit(family),
+                }
+                for family in set(self._samples) | set(self._oom_floor) | set(self._ok_ceiling)
+            }
+
+    def _record(self, sample: dict[str, Any]) -> None:
+        self._apply(sample)
+        if self.history_path is None:
+            return
+        try:
+            self.history_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.history_path, "a") as f:
+                f.write(json.dumps(sample) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to record admission history: {e}")
+
+    def _apply(self, sample: dict[str, Any]) -> None:
+        family = sample["family"]
+        tokens = latent_tokens(sample["width"], sample["height"], sample["frames"])
+        budget = sample.get("budget", 0)
+        with self._lock:
+            if sample.get("oom"):
+                # This shape must not fit next time
+                floor = (budget - self.priors["base_bytes"]) / tokens * 1.1
+                self._oom_floor[family] = max(self._oom_floor.get(family, 0.0), floor)
+                return
+
+            self._samples.setdefault(family, deque(maxlen=MAX_SAMPLES)).append(
+                (tokens * sample["steps"], sample["seconds"])
+            )
+            self._fits.pop(family, None)
+            if budget > self.priors["base_bytes"]:
+                # This shape fit, so it must keep fitting
+                ceiling = (budget - self.priors["base_bytes"]) / tokens
+                self._ok_ceiling[family] = min(self._ok_ceiling.get(family, math.inf), ceiling)
+
+    def _bytes_per_token(self, family: str) -> float:
+        value = min(self.priors["bytes_per_token"], self._ok_ceiling.get(family, math.inf))
+        return max(value, self._oom_floor.get(family, 0.0))
+
+    def _fit(self, family: str) -> tuple[float, float]:
+        """Least squares fit of (overhead, seconds per token-step)."""
+        if family in self._fits:
+            return self._fits[family]
+
+        overhead = self.priors["overhead_seconds"]
+        slope = self.priors["seconds_per_token_step"]
+        samples = self._samples.get(family)
+        if samples:
+            mean_x = sum(x for x, _ in samples) / len(samples)
+            mean_y = sum(y for _, y in samples) / len(samples)
+            var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+            fitted = False
+            if len(samples) >= 3 and var_x > 0:
+                fit_slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+                fit_overhead = mean_y - fit_slope * mean_x
+                if fit_slope > 0 and fit_overhead >= 0:
+                    overhead, slope = fit_overhead, fit_slope
+                    fitted = True
+            if not fitted and mean_x > 0:
+                # Too few samples or too little spread to fit both; keep the
+                # prior overhead and scale the slope to the observed mean
+                overhead = min(overhead, mean_y)
+                slope = max((mean_y - overhead) / mean_x, 1e-9)
+
+        self._fits[family] = (overhead, slope)
+        return overhead, slope
+
+    def _load(self) -> None:
+        if self.history_path is None or not self.history_path.exists():
+            return
+        loaded = 0
+        with open(self.history_path) as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                    loaded += 1
+                except (ValueError, KeyError, TypeError):
+                    continue
+        logger.info(f"Loaded {loaded} admission history samples")
+
+
+def apply_shape(workflow: dict[str, Any], shape: dict[str, Any], width: int, height: int) -> None:
+    """Set a workflow's render size where workflow_shape found it."""
+    for name, value in (("width", width), ("height", height)):
+        node_id, input_name = shape["sources"][name]
+        workflow[node_id]["inputs"][input_name] = value
+
+
+def _shape_fields(shape: dict[str, Any]) -> dict[str, int]:
+    return {key: shape[key] for key in ("width", "height", "frames", "steps")}
+
+
+def _round_down(value: float) -> int:
+    return int(value // DIMENSION_MULTIPLE) * DIMENSION_MULTIPLE
@@ -5,15 +5,55 @@ Provides a clean interface to interact with ComfyUI's HTTP API.
 Used by the serverless handler to queue workflows and retrieve outputs.
 """
 
+import os
 import json
 import time
+import struct
+import asyncio
+import uuid
+import hashlib
+import threading
 import requests
 import logging
-from typing import Any
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scheduler import ModelResidency, Scheduler, Ticket
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - optional, falls back to history polling
+    websocket = None
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on a single blocking socket read, so timeouts are still honoured
+# while ComfyUI is silent (e.g. during a long sampler step)
+WS_RECV_TIMEOUT = 1.0
+
+# Prompts whose events are held for a wait that hasn't started yet (e.g.
+# batch items queued up front); beyond this the oldest are dropped
+MAX_BUFFERED_PROMPTS = 256
+
+# Binary websocket frames: a big-endian event type, then its payload.
+# PREVIEW_IMAGE carries an image format code and the image;
+# PREVIEW_IMAGE_WITH_METADATA a metadata length, JSON metadata and the image
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+PREVIEW_IMAGE_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+# Per-endpoint timeout overrides (seconds); anything not listed uses the
+# client's default timeout
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    "ready": 5,
+    "history": 10,
+    "queue": 10,
+}
+
 
 class ComfyAPIError(Exception):
     """Exception raised for ComfyUI API errors."""
@@ -23,26 +63,115 @@ class ComfyAPIError(Exception):
 class ComfyClient:
     """Client for interacting with ComfyUI's HTTP API."""
 
-    def __init__(self, host: str = "127.0.0.1", port: int = 8188, timeout: int = 30):
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8188,
+        timeout: int = 30,
+        use_websocket: bool = True,
+        pool_size: int = 4,
+        retries: int = 3,
+        backoff_factor: float = 0.1,
+        endpoint_timeouts: dict[str, float] | None = None
+    ):
         self.base_url = f"http://{host}:{port}"
         self.timeout = timeout
+        self.endpoint_timeouts = {**DEFAULT_ENDPOINT_TIMEOUTS, **(endpoint_timeouts or {})}
+        self.session = self._create_session(pool_size, retries, backoff_factor)
+        # ComfyUI only routes execution events to the client that queued the
+        # prompt, and keeps one socket per client id; every prompt shares
+        # this client's one event stream, which routes events by prompt_id
+        self.client_id = uuid.uuid4().hex
+        self.ws_base_url = f"ws://{host}:{port}/ws"
+        self.use_websocket = use_websocket and websocket is not None
+        self._events: EventStream | None = None
+        self._events_lock = threading.Lock()
+
+    @staticmethod
+    def _create_session(pool_size: int, retries: int, backoff_factor: float) -> requests.Session:
+        """
+        Create a keep-alive session so calls reuse pooled connections.
+
+        Only idempotent GETs are retried on read errors and 5xx responses;
+        POSTs are retried only if the connection couldn't be established.
+        """
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        return session
+
+    def _timeout(self, endpoint: str) -> float:
+        """Get the timeout for an endpoint."""
+        return self.endpoint_timeouts.get(endpoint, self.timeout)
+
+    def close(self) -> None:
+        """Close pooled connections and the event stream."""
+        self.session.close()
+        with self._events_lock:
+            if self._events is not None:
+                self._events.close()
+                self._events = None
+
+    def event_stream(self) -> "EventStream":
+        """
+        Get the client's event stream, connecting (again) if it isn't open.
+
+        Raises:
+            websocket.WebSocketException: If the socket can't be opened
+            OSError: If ComfyUI can't be reached
+        """
+        with self._events_lock:
+            if self._events is None or not self._events.connected:
+                self._events = EventStream(f"{self.ws_base_url}?clientId={self.client_id}", self.timeout)
+            return self._events
 
     def is_ready(self) -> bool:
         """Check if ComfyUI server is ready to accept requests."""
         try:
-            r = requests.get(f"{self.base_url}/system_stats", timeout=5)
+            r = self.session.get(f"{self.base_url}/system_stats", timeout=self._timeout("ready"))
             return r.status_code == 200
         except requests.RequestException:
             return False
 
-    def wait_for_ready(self, timeout: int = 300) -> bool:
-        """Wait for ComfyUI server to be ready."""
+    def wait_for_ready(
+        self,
+        timeout: int = 300,
+        initial_interval: float = 0.05,
+        max_interval: float = 0.5,
+        should_abort: callable = None
+    ) -> bool:
+        """
+        Wait for ComfyUI server to be ready.
+
+        Polls with exponential backoff from initial_interval up to
+        max_interval, so a server that comes up quickly is noticed within
+        tens of milliseconds.
+
+        Args:
+            timeout: Maximum wait time in seconds
+            initial_interval: First delay between checks
+            max_interval: Upper bound on the delay between checks
+            should_abort: Optional callable; waiting stops early (returning
+                False) once it returns True, e.g. when the process died
+        """
         start = time.time()
+        interval = initial_interval
         while time.time() - start < timeout:
             if self.is_ready():
-                logger.info("ComfyUI server is ready")
+                logger.info(f"ComfyUI server is ready after {time.time() - start:.2f}s")
                 return True
-            time.sleep(1)
+            if should_abort and should_abort():
+                logger.error("Stopped waiting for ComfyUI server")
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
         logger.error(f"ComfyUI server not ready after {timeout}s")
         return False
 
@@ -59,12 +188,21 @@ class ComfyClient:
         Raises:
             ComfyAPIError: If the request fails
         """
-        payload = {"prompt": workflow}
+        payload = {"prompt": workflow, "client_id": self.client_id}
+
+        # Subscribe first: an idle ComfyUI starts executing before the POST
+        # returns, and events sent before a socket exists are dropped
+        if self.use_websocket:
+            try:
+                self.event_stream()
+            except (websocket.WebSocketException, OSError) as e:
+                logger.warning(f"WebSocket unavailable ({e}), will poll for this prompt")
+
         try:
-            r = requests.post(
+            r = self.session.post(
                 f"{self.base_url}/prompt",
                 json=payload,
-                timeout=self.timeout
+                timeout=self._timeout("prompt")
             )
             r.raise_for_status()
             result = r.json()
@@ -87,9 +225,9 @@ class ComfyClient:
             History dict if available, None if not yet complete
         """
         try:
-            r = requests.get(
+            r = self.session.get(
                 f"{self.base_url}/history/{prompt_id}",
-                timeout=self.timeout
+                timeout=self._timeout("history")
             )
             r.raise_for_status()
             history = r.json()
@@ -101,24 +239,102 @@ class ComfyClient:
     def get_queue(self) -> dict[str, Any]:
         """Get current queue status."""
         try:
-            r = requests.get(f"{self.base_url}/queue", timeout=self.timeout)
+            r = self.session.get(f"{self.base_url}/queue", timeout=self._timeout("queue"))
             r.raise_for_status()
             return r.json()
         except requests.RequestException as e:
             raise ComfyAPIError(f"Failed to get queue: {e}")
 
-    def interrupt(self) -> bool:
-        """Interrupt current execution."""
+    def queue_depth(self) -> int:
+        """Number of prompts running or pending in ComfyUI's queue."""
+        queue = self.get_queue()
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+    def interrupt(self, prompt_id: str | None = None) -> bool:
+        """
+        Interrupt current execution.
+
+        With a prompt_id, ComfyUI only interrupts that prompt if it is the
+        one running (versions without targeted interrupts stop whatever
+        runs, so check the queue first).
+        """
+        payload = {"prompt_id": prompt_id} if prompt_id else None
         try:
-            r = requests.post(f"{self.base_url}/interrupt", timeout=self.timeout)
+            r = self.session.post(f"{self.base_url}/interrupt", json=payload, timeout=self._timeout("interrupt"))
+            return r.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def delete_queued(self, prompt_ids: list[str]) -> bool:
+        """Remove pending prompts from the queue; a running prompt is unaffected."""
+        try:
+            r = self.session.post(
+                f"{self.base_url}/queue",
+                json={"delete": list(prompt_ids)},
+                timeout=self._timeout("queue")
+            )
             return r.status_code == 200
         except requests.RequestException:
             return False
 
+    def cancel_prompt(
+        self,
+        prompt_id: str,
+        timeout: float = 30.0,
+        initial_interval: float = 0.05,
+        max_interval: float = 0.5
+    ) -> str:
+        """
+        Take a prompt out of ComfyUI: delete it if pending, interrupt it if running.
+
+        Returns only once the prompt is neither running nor pending, so
+        ComfyUI is free for the next one. ComfyUI checks for interrupts
+        between sampler steps, so a running prompt usually lets go within
+        a step; the queue is polled with exponential backoff until then.
+
+        Args:
+            prompt_id: The prompt to cancel
+            timeout: Maximum seconds to wait for the prompt to leave the queue
+            initial_interval: First delay between queue checks
+            max_interval: Upper bound on the delay between checks
+
+        Returns:
+            "deleted", "interrupted", or "finished" if it had already left
+            the queue
+
+        Raises:
+            ComfyAPIError: If the queue can't be read or the prompt is still
+                there after timeout
+        """
+        deadline = time.monotonic() + timeout
+        interval = initial_interval
+        outcome = "finished"
+        try:
+            while True:
+                queue = self.get_queue()
+                if prompt_id in {entry[1] for entry in queue.get("queue_pending", [])}:
+                    self.delete_queued([prompt_id])
+                    outcome = "deleted"
+                elif prompt_id in {entry[1] for entry in queue.get("queue_running", [])}:
+                    if outcome != "interrupted":
+                        self.interrupt(prompt_id)
+                        outcome = "interrupted"
+                else:
+                    return outcome
+
+                if time.monotonic() >= deadline:
+                    raise ComfyAPIError(f"Prompt {prompt_id} still in the queue {timeout}s after cancelling it")
+                time.sleep(interval)
+                interval = min(interval * 2, max_interval)
+        finally:
+            # Nobody will wait on it now, whether or not it let go
+            if self._events is not None:
+                self._events.release(prompt_id)
+
     def get_system_stats(self) -> dict[str, Any]:
         """Get system statistics (GPU memory, etc.)."""
         try:
-            r = requests.get(f"{self.base_url}/system_stats", timeout=self.timeout)
+            r = self.session.get(f"{self.base_url}/system_stats", timeout=self._timeout("system_stats"))
             r.raise_for_status()
             return r.json()
         except requests.RequestException as e:
@@ -139,11 +355,11 @@ class ComfyClient:
         try:
             files = {"image": (filename, image_data)}
             data = {"subfolder": subfolder, "type": "input"}
-            r = requests.post(
+            r = self.session.post(
                 f"{self.base_url}/upload/image",
                 files=files,
                 data=data,
-                timeout=self.timeout
+                timeout=self._timeout("upload")
             )
             r.raise_for_status()
             return r.json()
@@ -155,54 +371,589 @@ class ComfyClient:
         prompt_id: str,
         timeout: int = 600,
         poll_interval: float = 2.0,
-        progress_callback: callable = None
+        progress_callback: callable = None,
+        profile: "ExecutionProfile | None" = None,
+        preview_callback: callable = None,
+        should_abort: callable = None
     ) -> dict[str, Any]:
         """
         Wait for a prompt to complete execution.
 
+        Subscribes to ComfyUI's websocket event stream and returns as soon as
+        the terminal event for the prompt arrives. If the socket can't be
+        opened or drops mid-run, falls back to polling the history endpoint.
+
+        Progress is reported per node and sampler step from the event
+        stream; while no events have arrived (or when polling) it is
+        estimated from elapsed time.
+
         Args:
             prompt_id: The prompt ID to wait for
             timeout: Maximum wait time in seconds
-            poll_interval: Time between status checks
+            poll_interval: Time between status checks when polling
             progress_callback: Optional callback for progress updates
+            profile: Optional ExecutionProfile to fill with per-node timings
+            preview_callback: Optional callback for intermediate results
+                from the event stream, called with a dict of kind
+                ("latent" for a sampler preview image, with mime and
+                image bytes; "output" for an output node that finished,
+                with its output), node_id, progress and message. Not
+                called when polling
+            should_abort: Optional callable checked at least every
+                WS_RECV_TIMEOUT (or poll_interval); once it returns True
+                the wait is given up. The prompt is left as it is; see
+                cancel_prompt
 
         Returns:
             History dict with outputs
 
         Raises:
-            ComfyAPIError: If execution fails or times out
+            ComfyAPIError: If execution fails, times out or is aborted
         """
         start = time.time()
+        deadline = start + timeout
         last_progress = 0
 
-        while time.time() - start < timeout:
-            history = self.get_history(prompt_id)
+        profile = profile if profile is not None else ExecutionProfile()
 
-            if history is not None:
-                # Check for errors
-                if "status" in history:
-                    status = history["status"]
-                    if status.get("status_str") == "error":
-                        messages = status.get("messages", [])
-                        raise ComfyAPIError(f"Execution failed: {messages}")
-
-                # Check for outputs (indicates completion)
-                if "outputs" in history and history["outputs"]:
-                    logger.info(f"Prompt {prompt_id} completed")
+        def report_elapsed():
+            # Time-based estimate between status checks
+            nonlocal last_progress
+            if not progress_callback or profile.nodes:
+                return
+            elapsed = int(time.time() - start)
+            progress = min(int((elapsed / timeout) * 100), 99)
+            if progress > last_progress:
+                progress_callback(progress, f"Processing... ({elapsed}s)")
+                last_progress = progress
+
+        def check_abort():
+            if should_abort is not None and should_abort():
+                raise ComfyAPIError(f"Stopped waiting for prompt {prompt_id}: cancelled")
+
+        if self.use_websocket:
+            try:
+                history = self._wait_for_completion_ws(
+                    prompt_id, timeout, deadline, report_elapsed,
+                    profile, progress_callback, preview_callback, check_abort
+                )
+                if history is not None:
                     return history
+                logger.warning(f"No history for {prompt_id} after completion event, polling")
+            except (websocket.WebSocketException, OSError) as e:
+                logger.warning(f"WebSocket unavailable ({e}), falling back to history polling")
 
-            # Send progress update if callback provided
-            if progress_callback:
-                elapsed = int(time.time() - start)
-                progress = min(int((elapsed / timeout) * 100), 99)
-                if progress > last_progress:
-                    progress_callback(progress, f"Processing... ({elapsed}s)")
-                    last_progress = progress
+        while time.time() < deadline:
+            check_abort()
+            history = self.get_history(prompt_id)
 
+            if history is not None and self._is_complete(history):
+                logger.info(f"Prompt {prompt_id} completed")
+                return history
+
+            report_elapsed()
             time.sleep(poll_interval)
 
         raise ComfyAPIError(f"Timeout after {timeout}s waiting for prompt {prompt_id}")
 
+    def _wait_for_completion_ws(
+        self,
+        prompt_id: str,
+        timeout: float,
+        deadline: float,
+        on_idle: callable,
+        profile: "ExecutionProfile",
+        progress_callback: callable = None,
+        preview_callback: callable = None,
+        check_abort: callable = None
+    ) -> dict[str, Any] | None:
+        """
+        Block on the event stream until the prompt's terminal event arrives.
+
+        Returns:
+            History dict, or None if ComfyUI reported completion but the
+            history entry couldn't be fetched
+
+        Raises:
+            ComfyAPIError: If execution fails, is interrupted, times out
+                or check_abort raises
+            websocket.WebSocketException: If the socket drops
+        """
+        events = self.event_stream()
+        try:
+            # The prompt may have finished before we subscribed
+            history = self.get_history(prompt_id)
+            if history is not None and self._is_complete(history):
+                logger.info(f"Prompt {prompt_id} completed")
+                return history
+
+            while True:
+                if check_abort is not None:
+                    check_abort()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ComfyAPIError(
+                        f"Timeout after {timeout}s waiting for prompt {prompt_id}"
+                    )
+                message = events.next(prompt_id, min(remaining, WS_RECV_TIMEOUT))
+                if message is None:
+                    on_idle()
+                    continue
+
+                if isinstance(message, bytes):
+                    # Binary frames are latent previews of this prompt
+                    preview = parse_preview_frame(message) if preview_callback else None
+                    if preview is not None:
+                        preview_callback({
+                            "kind": "latent",
+                            "node_id": profile.current,
+                            "mime": preview[0],
+                            "image": preview[1],
+                            **self._progress_fields(profile),
+                        })
+                    continue
+
+                event = message
+                data = event.get("data") or {}
+                event_type = event.get("type")
+                if profile.handle(event_type, data) and progress_callback:
+                    progress_callback(*profile.progress())
+                if event_type == "executed" and preview_callback and data.get("output"):
+                    preview_callback({
+                        "kind": "output",
+                        "node_id": str(data.get("node")),
+                        "output": data["output"],
+                        **self._progress_fields(profile),
+                    })
+                if event_type == "execution_error":
+                    raise ComfyAPIError(
+                        f"Execution failed: {data.get('node_type')} "
+                        f"(node {data.get('node_id')}): {data.get('exception_message')}"
+                    )
+                if event_type == "execution_interrupted":
+                    raise ComfyAPIError(f"Execution interrupted at node {data.get('node_id')}")
+                if event_type == "executing" and data.get("node") is None:
+                    # Sent after ComfyUI has written the history entry
+                    break
+        finally:
+            events.release(prompt_id)
+
+        logger.info(f"Prompt {prompt_id} completed")
+        return self.get_history(prompt_id)
+
+    @staticmethod
+    def _progress_fields(profile: "ExecutionProfile") -> dict[str, Any]:
+        progress, message = profile.progress()
+        return {"progress": progress, "message": message}
+
+    @staticmethod
+    def _is_complete(history: dict[str, Any]) -> bool:
+        """
+        Check a history entry for completion.
+
+        Raises:
+            ComfyAPIError: If the history records an execution error
+        """
+        status = history.get("status", {})
+        if status.get("status_str") == "error":
+            messages = status.get("messages", [])
+            raise ComfyAPIError(f"Execution failed: {messages}")
+
+        # Outputs indicate completion
+        return bool(history.get("outputs"))
+
+
+class EventStream:
+    """
+    ComfyUI's websocket event stream for one client id.
+
+    ComfyUI sends a client's events on its one socket, so every prompt the
+    client queues shares it. A reader thread routes each event to the
+    prompt it names, buffering it until the prompt is waited on. Binary
+    frames (latent previews) name no prompt: they go to the prompt that
+    is executing, and only while something waits on it.
+
+    Args:
+        url: Websocket URL, including the clientId
+        timeout: Connect timeout in seconds
+
+    Raises:
+        websocket.WebSocketException: If the socket can't be opened
+        OSError: If ComfyUI can't be reached
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self._ws = websocket.create_connection(url, timeout=timeout)
+        self._ws.settimeout(WS_RECV_TIMEOUT)
+        self._buffers: OrderedDict[str, deque] = OrderedDict()
+        self._waiting: set[str] = set()
+        # Late events of released prompts (e.g. after a cancel) are dropped
+        self._released: OrderedDict[str, None] = OrderedDict()
+        self._executing: str | None = None
+        self._error: Exception | None = None
+        self._changed = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._read, name="comfy-events", daemon=True)
+        self._thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._error is None
+
+    def next(self, prompt_id: str, timeout: float) -> dict[str, Any] | bytes | None:
+        """
+        Get a prompt's next event.
+
+        Returns:
+            Event dict, binary frame, or None if nothing arrived in timeout
+
+        Raises:
+            websocket.WebSocketException: Once the socket is gone and the
+                prompt's buffered events are used up
+        """
+        with self._changed:
+            self._waiting.add(prompt_id)
+            self._released.pop(prompt_id, None)
+            buffer = self._buffer(prompt_id)
+            self._changed.wait_for(lambda: buffer or self._error is not None, timeout)
+            if buffer:
+                return buffer.popleft()
+            if self._error is not None:
+                raise self._error
+            return None
+
+    def release(self, prompt_id: str) -> None:
+        """Stop routing a prompt's events, once nothing will wait on it."""
+        with self._changed:
+            self._waiting.discard(prompt_id)
+            self._buffers.pop(prompt_id, None)
+            self._released[prompt_id] = None
+            if len(self._released) > MAX_BUFFERED_PROMPTS:
+                self._released.popitem(last=False)
+
+    def buffered(self) -> int:
+        """Number of prompts with events held."""
+        with self._changed:
+            return len(self._buffers)
+
+    def close(self) -> None:
+        self._closing = True
+        self._ws.close()
+
+    def _buffer(self, prompt_id: str) -> deque:
+        buffer = self._buffers.get(prompt_id)
+        if buffer is None:
+            buffer = self._buffers[prompt_id] = deque()
+            # Forget the oldest prompts nobody is waiting on
+            stale = [key for key in self._buffers if key not in self._waiting]
+            for key in stale[:len(self._buffers) - MAX_BUFFERED_PROMPTS]:
+                del self._buffers[key]
+        return buffer
+
+    def _read(self) -> None:
+        while True:
+            try:
+                message = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            except (websocket.WebSocketException, OSError) as e:
+                self._fail(e)
+                return
+            if not message:
+                if not self._ws.connected:
+                    self._fail(websocket.WebSocketConnectionClosedException("Connection closed by ComfyUI"))
+                    return
+                continue
+            self._route(message)
+
+    def _route(self, message: str | bytes) -> None:
+        with self._changed:
+            if isinstance(message, str):
+                try:
+                    event = json.loads(message)
+                except ValueError:
+                    return
+                data = event.get("data") or {}
+                prompt_id = data.get("prompt_id")
+                if not prompt_id:
+                    return
+                event_type = event.get("type")
+                if event_type == "execution_start" or (event_type == "executing" and data.get("node") is not None):
+                    self._executing = prompt_id
+                elif event_type in ("executing", "execution_error", "execution_interrupted"):
+                    self._executing = None
+                if prompt_id in self._released:
+                    return
+                self._buffer(prompt_id).append(event)
+            else:
+                prompt_id = self._executing
+                if prompt_id not in self._waiting:
+                    return
+                self._buffer(prompt_id).append(message)
+            self._changed.notify_all()
+
+    def _fail(self, error: Exception) -> None:
+        if not self._closing:
+            logger.warning(f"ComfyUI event stream closed: {error}")
+        with self._changed:
+            self._error = websocket.WebSocketConnectionClosedException(str(error) or "Connection closed")
+            self._changed.notify_all()
+        self._ws.close()
+
+
+class QueueDepthGate:
+    """
+    Async gate that holds back new prompts while ComfyUI's queue is full.
+
+    Entering waits until fewer than max_depth prompts are running or
+    pending; the check and the queue_prompt call made inside the block are
+    serialized, so concurrent jobs can't overshoot the bound together.
+
+    Waiting prompts go through in arrival order, or in the order a
+    scheduler picks when entered with turn(): a prompt waiting for room
+    hands the gate over if a better one arrives in the meantime. The
+    scheduler favours the model set in residency, which whoever queues
+    the prompts keeps up to date; picks that keep it loaded where arrival
+    order would have swapped it are counted as avoided swaps.
+
+    Usage:
+        async with gate:
+            prompt_id = await asyncio.to_thread(client.queue_prompt, workflow)
+
+        async with gate.turn(Ticket(cost=estimate, group=group)):
+            ...
+    """
+
+    def __init__(
+        self,
+        client: ComfyClient,
+        max_depth: int = 2,
+        poll_interval: float = 0.1,
+        scheduler: Scheduler | None = None,
+        residency: ModelResidency | None = None
+    ):
+        self.client = client
+        self.max_depth = max_depth
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler or Scheduler("fifo")
+        self.residency = residency or ModelResidency()
+        self._waiting: list[Ticket] = []
+        self._holder: Ticket | None = None
+        self._changed = asyncio.Condition()
+
+    async def __aenter__(self) -> "QueueDepthGate":
+        await self.acquire(Ticket())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.release()
+
+    @asynccontextmanager
+    async def turn(self, ticket: Ticket) -> AsyncIterator["QueueDepthGate"]:
+        """Hold the gate for one prompt, ordered by the scheduler."""
+        await self.acquire(ticket)
+        try:
+            yield self
+        finally:
+            await self.release()
+
+    async def acquire(self, ticket: Ticket) -> None:
+        self._waiting.append(ticket)
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self._holder is None and self._next() is ticket)
+                    self._holder = ticket
+                if await self._wait_for_room(ticket):
+                    break
+                # A better prompt arrived while this one waited for room
+                await self.release()
+        except BaseException:
+            # Whoever is next now may have been waiting behind this ticket
+            async with self._changed:
+                self._waiting.remove(ticket)
+                if self._holder is ticket:
+                    self._holder = None
+                self._changed.notify_all()
+            raise
+        first = min(self._waiting, key=lambda waiting: waiting.seq)
+        if self.residency.keeps_resident(ticket.group) and not self.residency.keeps_resident(first.group):
+            self.residency.record_avoided()
+        self._waiting.remove(ticket)
+
+    async def release(self) -> None:
+        async with self._changed:
+            self._holder = None
+            self._changed.notify_all()
+
+    def _next(self) -> Ticket | None:
+        return self.scheduler.pick(self._waiting, last_group=self.residency.resident)
+
+    async def _wait_for_room(self, ticket: Ticket) -> bool:
+        """Wait until the queue has room; False if ticket should yield first."""
+        while await asyncio.to_thread(self.client.queue_depth) >= self.max_depth:
+            await asyncio.sleep(self.poll_interval)
+            if self._next() is not ticket:
+                return False
+        return True
+
+
+class ExecutionProfile:
+    """
+    Per-node timing of one prompt, built from ComfyUI's websocket events.
+
+    ComfyUI sends executing when a node starts (node=None once the prompt
+    is done), progress for each sampler step, executed when an output node
+    finishes and execution_cached for nodes reused from an earlier prompt.
+    A node runs from its executing event until the next one, timed on
+    receipt.
+
+    Args:
+        workflow: The queued workflow, used to label nodes and to count the
+            nodes left to run for overall progress
+    """
+
+    def __init__(self, workflow: dict[str, Any] | None = None):
+        self.workflow = workflow or {}
+        self.nodes: dict[str, dict[str, Any]] = {}
+        self.cached: set[str] = set()
+        self.current: str | None = None
+        self.step: tuple[int, int] | None = None
+        self._node_started = 0.0
+        self._step_times: list[float] = []
+        self._percent = 0
+
+    def handle(self, event_type: str, data: dict[str, Any], now: float | None = None) -> bool:
+        """
+        Feed one event for this prompt.
+
+        Returns:
+            True if progress moved (a node started or a step finished)
+        """
+        now = time.perf_counter() if now is None else now
+        if event_type == "execution_cached":
+            self.cached.update(str(node_id) for node_id in data.get("nodes") or [])
+            return False
+        if event_type == "executing":
+            self._finish_node(now)
+            node_id = data.get("node")
+            if node_id is None:
+                return False
+            self.current = str(node_id)
+            self._node_started = now
+            self._entry(self.current)
+            return True
+        if event_type == "progress" and self.current is not None:
+            self.step = (int(data.get("value", 0)), int(data.get("max", 0)))
+            self._step_times.append(now)
+            entry = self._entry(self.current)
+            entry["steps"] = max(entry.get("steps", 0), self.step[1])
+            return True
+        if event_type == "executed":
+            self._entry(str(data.get("node")))["output"] = True
+        elif event_type in ("execution_success", "execution_error", "execution_interrupted"):
+            self._finish_node(now)
+        return False
+
+    def progress(self) -> tuple[int, str]:
+        """Overall percent done and a message for the current node or step."""
+        if self.current is None:
+            return 0, "Waiting to start..."
+        label = self._label(self.current)
+        step_fraction = 0.0
+        message = f"Running {label}"
+        if self.step and self.step[1]:
+            value, total = self.step
+            step_fraction = value / total
+            message = f"{label} step {value}/{total}"
+
+        to_run = len(set(self.workflow) - self.cached)
+        if to_run:
+            done = sum(1 for node_id in self.nodes if node_id != self.current)
+            percent = (done + step_fraction) / max(to_run, done + 1)
+        else:
+            percent = step_fraction
+        # Step progress restarts for each sampler; never report going back
+        # unless no node count is known
+        percent = min(int(percent * 100), 99)
+        if to_run:
+            percent = self._percent = max(self._percent, percent)
+        return percent, message
+
+    def summary(self) -> list[dict[str, Any]]:
+        """
+        Timing per executed node, in execution order.
+
+        Each entry has node_id, class_type, title and seconds; sampling
+        nodes add steps and seconds_per_step, output nodes output=True.
+        Cached nodes are listed with cached=True and no time.
+        """
+        nodes = []
+        for node_id, entry in self.nodes.items():
+            node = self.workflow.get(node_id, {})
+            nodes.append({
+                "node_id": node_id,
+                "class_type": node.get("class_type", "unknown"),
+                "title": node.get("_meta", {}).get("title"),
+                **{key: value for key, value in entry.items() if not key.startswith("_")},
+                "seconds": round(entry["seconds"], 4),
+            })
+        for node_id in sorted(self.cached - set(self.nodes)):
+            node = self.workflow.get(node_id, {})
+            nodes.append({
+                "node_id": node_id,
+                "class_type": node.get("class_type", "unknown"),
+                "title": node.get("_meta", {}).get("title"),
+                "seconds": 0.0,
+                "cached": True,
+            })
+        return nodes
+
+    def _entry(self, node_id: str) -> dict[str, Any]:
+        return self.nodes.setdefault(node_id, {"seconds": 0.0})
+
+    def _label(self, node_id: str) -> str:
+        return self.workflow.get(node_id, {}).get("class_type", f"node {node_id}")
+
+    def _finish_node(self, now: float) -> None:
+        if self.current is None:
+            return
+        entry = self._entry(self.current)
+        entry["seconds"] += now - self._node_started
+        if len(self._step_times) > 1:
+            # Ticks after the first are whole steps; the first also
+            # includes the node's setup
+            intervals = len(self._step_times) - 1
+            entry["seconds_per_step"] = round((self._step_times[-1] - self._step_times[0]) / intervals, 4)
+        self.current = None
+        self.step = None
+        self._step_times = []
+
+
+def parse_preview_frame(message: bytes) -> tuple[str, bytes] | None:
+    """
+    Decode a binary websocket frame from ComfyUI.
+
+    Returns:
+        Tuple of (MIME type, image bytes) for a preview image, or None
+        for other or malformed frames
+    """
+    if len(message) < 8:
+        return None
+    event, value = struct.unpack(">II", message[:8])
+    if event == PREVIEW_IMAGE:
+        mime = PREVIEW_IMAGE_FORMATS.get(value)
+        return (mime, message[8:]) if mime else None
+    if event == PREVIEW_IMAGE_WITH_METADATA:
+        try:
+            metadata = json.loads(message[8:8 + value])
+        except ValueError:
+            return None
+        image = message[8 + value:]
+        mime = metadata.get("image_type", "image/jpeg") if isinstance(metadata, dict) else "image/jpeg"
+        return (mime, image) if image else None
+    return None
+
 
 def extract_output_files(history: dict[str, Any]) -> list[dict[str, str]]:
     """
@@ -241,6 +992,35 @@ def extract_output_files(history: dict[str, Any]) -> list[dict[str, str]]:
     return files
 
 
+def execution_timestamps(history: dict[str, Any]) -> tuple[float, float] | None:
+    """
+    Get when a prompt started and finished executing from its history.
+
+    ComfyUI records execution_start and execution_success (or _error /
+    _interrupted) in the entry's status messages with millisecond
+    timestamps.
+
+    Returns:
+        Tuple of (started, finished) as Unix times, or None if not recorded
+    """
+    started = finished = None
+    for message in history.get("status", {}).get("messages", []):
+        if not isinstance(message, (list, tuple)) or len(message) != 2:
+            continue
+        event, data = message
+        timestamp = data.get("timestamp") if isinstance(data, dict) else None
+        if timestamp is None:
+            continue
+        if event == "execution_start":
+            started = timestamp / 1000
+        elif event in ("execution_success", "execution_error", "execution_interrupted"):
+            finished = timestamp / 1000
+
+    if started is None or finished is None:
+        return None
+    return started, finished
+
+
 def load_workflow(path: str | Path) -> dict[str, Any]:
     """
     Load a workflow from a JSON file.
@@ -263,6 +1043,225 @@ def load_workflow(path: str | Path) -> dict[str, Any]:
     return data
 
 
+def clone_workflow(workflow: dict[str, Any]) -> dict[str, Any]:
+    """
+    Structurally clone an API-format workflow.
+
+    Copies the node map, each node dict and its inputs dict, so params can be
+    assigned, nodes added or removed without touching the source. Input values
+    (including [node_id, slot] links) and _meta are shared, so replace them
+    rather than mutating them in place.
+    """
+    cloned = {}
+    for node_id, node in workflow.items():
+        node = dict(node)
+        if "inputs" in node:
+            node["inputs"] = dict(node["inputs"])
+        cloned[node_id] = node
+    return cloned
+
+
+class WorkflowCache:
+    """
+    Process-wide cache of parsed workflow files.
+
+    Each file is parsed once and re-parsed only when its mtime or size
+    changes. Callers get a structural clone, so per-job edits never leak
+    into the cached copy. Artifacts derived from a workflow (see compile)
+    are cached alongside it and dropped when the file changes.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, tuple[tuple[int, int], dict[str, Any], dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str | Path) -> dict[str, Any]:
+        """
+        Get an isolated copy of the workflow at path.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+            ValueError: If the file is UI format without an embedded API prompt
+        """
+        return clone_workflow(self._get(path)[1])
+
+    def compile(self, path: str | Path, name: str, builder: callable) -> Any:
+        """
+        Get an artifact built from the cached workflow at path.
+
+        builder(workflow) is called once per file version and must not
+        modify the workflow it's given.
+        """
+        _, workflow, compiled = self._get(path)
+        if name not in compiled:
+            compiled[name] = builder(workflow)
+        return compiled[name]
+
+    def _get(self, path: str | Path) -> tuple[tuple[int, int], dict[str, Any], dict[str, Any]]:
+        key = str(path)
+        st = os.stat(key)
+        version = (st.st_mtime_ns, st.st_size)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry
+
+        entry = (version, load_workflow(key), {})
+        with self._lock:
+            self._entries[key] = entry
+        logger.info(f"Cached workflow: {key} ({len(entry[1])} nodes)")
+        return entry
+
+
+# Loader nodes that read a file from ComfyUI's input directory, and the
+# input holding the filename
+MEDIA_LOADER_INPUTS = {
+    "LoadImage": "image",
+    "LoadImageMask": "image",
+    "LoadVideo": "file",
+    "VHS_LoadVideo": "video",
+    "LoadAudio": "audio",
+}
+
+
+def index_media_loaders(workflow: dict[str, Any]) -> dict[str, list[tuple[str, str]]]:
+    """
+    Index media loader nodes by the filename they currently reference.
+
+    Returns:
+        Dict mapping filename -> [(node_id, input_name), ...]
+    """
+    index = {}
+    for node_id, node in workflow.items():
+        input_name = MEDIA_LOADER_INPUTS.get(node.get("class_type"))
+        if input_name is None:
+            continue
+        value = node.get("inputs", {}).get(input_name)
+        if isinstance(value, str):
+            index.setdefault(value, []).append((node_id, input_name))
+    return index
+
+
+# File extensions of model weights named by *Loader nodes
+MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf", ".sft")
+
+
+def model_set(workflow: dict[str, Any]) -> dict[str, list[str]]:
+    """
+    Find the model files a workflow's *Loader nodes load.
+
+    LoRA loaders whose strengths are all zero are skipped, as ComfyUI
+    doesn't apply them.
+
+    Returns:
+        Dict with sorted "models" (checkpoints, text encoders, VAEs,
+        upscalers) and "loras"
+    """
+    models = set()
+    loras = set()
+    for node in workflow.values():
+        class_type = node.get("class_type", "")
+        if "Loader" not in class_type:
+            continue
+        inputs = node.get("inputs", {})
+        is_lora = "lora" in class_type.lower()
+        if is_lora:
+            strengths = [v for k, v in inputs.items() if k.startswith("strength") and isinstance(v, (int, float))]
+            if strengths and not any(strengths):
+                continue
+        for value in inputs.values():
+            if isinstance(value, str) and value.lower().endswith(MODEL_EXTENSIONS):
+                (loras if is_lora else models).add(value)
+    return {"models": sorted(models), "loras": sorted(loras)}
+
+
+def model_set_key(models: dict[str, list[str]]) -> str | None:
+    """Short key of a model set (see model_set), or None if it loads nothing."""
+    if not models["models"] and not models["loras"]:
+        return None
+    return hashlib.sha256(json.dumps(models, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class InjectionPlan:
+    """
+    Parameter injection plan compiled once per workflow template.
+
+    Resolves a {param: (node_id, input_name)} mapping against the workflow,
+    setting aside (and logging once) entries whose node or input doesn't
+    exist in invalid, and
+    indexes media loader nodes so input files can be bound without scanning
+    the graph. Applying a plan costs O(number of params). The template's
+    model and LoRA set is extracted once as well.
+    """
+
+    def __init__(self, workflow: dict[str, Any], mapping: dict[str, tuple[str, str]]):
+        self.targets: dict[str, tuple[str, str]] = {}
+        self.invalid: dict[str, tuple[str, str]] = {}
+
+        for param_name, (node_id, input_name) in mapping.items():
+            if input_name in workflow.get(node_id, {}).get("inputs", {}):
+                self.targets[param_name] = (node_id, input_name)
+            else:
+                self.invalid[param_name] = (node_id, input_name)
+
+        if self.invalid:
+            logger.warning(
+                "Template mapping references missing node inputs, ignoring: "
+                + ", ".join(f"{p} -> {n}.{i}" for p, (n, i) in self.invalid.items())
+            )
+
+        self.media_loaders = index_media_loaders(workflow)
+        self.models = model_set(workflow)
+        self.media_loader_nodes = {
+            node_id for refs in self.media_loaders.values() for node_id, _ in refs
+        }
+
+    def apply(self, workflow: dict[str, Any], values: dict[str, Any]) -> list[str]:
+        """
+        Assign mapped values onto a copy of the compiled workflow.
+
+        Args:
+            workflow: Per-job copy of the workflow the plan was compiled from
+            values: Simplified params (e.g. job input); unmapped keys are ignored
+
+        Returns:
+            Names of the params that were applied
+        """
+        applied = []
+        for param_name, (node_id, input_name) in self.targets.items():
+            if param_name in values:
+                workflow[node_id].setdefault("inputs", {})[input_name] = values[param_name]
+                applied.append(param_name)
+        return applied
+
+    def bind_media(
+        self,
+        workflow: dict[str, Any],
+        files: dict[str, str],
+        touched_nodes: set[str] | None = None
+    ) -> None:
+        """
+        Point media loader nodes at saved input files.
+
+        Args:
+            workflow: Per-job copy of the workflow the plan was compiled from
+            files: Mapping of input name (the placeholder a loader references)
+                to the saved filename
+            touched_nodes: Node IDs whose inputs were changed after compiling
+                (e.g. by raw params), re-checked in addition to the index
+        """
+        for name, filename in files.items():
+            for node_id, input_name in self.media_loaders.get(name, ()):
+                if workflow[node_id]["inputs"].get(input_name) == name:
+                    workflow[node_id]["inputs"][input_name] = filename
+
+        for node_id in (touched_nodes or set()) & self.media_loader_nodes:
+            inputs = workflow[node_id]["inputs"]
+            input_name = MEDIA_LOADER_INPUTS[workflow[node_id]["class_type"]]
+            if inputs.get(input_name) in files:
+                inputs[input_name] = files[inputs[input_name]]
+
+
 def inject_params(workflow: dict[str, Any], params: dict[str, dict]) -> dict[str, Any]:
     """
     Inject parameters into workflow nodes.
@@ -289,3 +1288,339 @@ def inject_params(workflow: dict[str, Any], params: dict[str, dict]) -> dict[str
             logger.warning(f"Node {node_id} not found in workflow")
 
     return workflow
+
+
+# Node classes ComfyUI runs as outputs (OUTPUT_NODE = True); a prompt only
+# executes what these depend on
+OUTPUT_NODE_TYPES = frozenset({
+    "SaveImage",
+    "PreviewImage",
+    "SaveAnimatedWEBP",
+    "SaveAnimatedPNG",
+    "SaveVideo",
+    "SaveWEBM",
+    "SaveAudio",
+    "SaveAudioMP3",
+    "SaveAudioOpus",
+    "PreviewAudio",
+    "SaveLatent",
+    "VHS_VideoCombine",
+})
+
+# Node classes known not to be outputs, so one nothing consumes is dead
+# and can be pruned; a dead end of any other class may be a custom output
+# node (a custom save, PreviewAny) and is kept
+INTERMEDIATE_NODE_TYPES = frozenset({
+    # Loaders
+    "CheckpointLoaderSimple",
+    "CLIPLoader",
+    "DualCLIPLoader",
+    "UNETLoader",
+    "VAELoader",
+    "LoraLoader",
+    "LoraLoaderModelOnly",
+    "LatentUpscaleModelLoader",
+    "LTXAVTextEncoderLoader",
+    "LTXVAudioVAELoader",
+    "LTXVGemmaCLIPModelLoader",
+    "LoadImage",
+    # Conditioning, sampling and latents
+    "CLIPTextEncode",
+    "ConditioningZeroOut",
+    "CFGGuider",
+    "GuiderParameters",
+    "MultimodalGuider",
+    "KSampler",
+    "KSamplerAdvanced",
+    "KSamplerSelect",
+    "SamplerCustomAdvanced",
+    "RandomNoise",
+    "ManualSigmas",
+    "LTXVScheduler",
+    "LTXVConditioning",
+    "LTXVAddGuide",
+    "LTXVCropGuides",
+    "LTXVImgToVideo",
+    "LTXVConcatAVLatent",
+    "LTXVSeparateAVLatent",
+    "LTXVLatentUpsampler",
+    "LTXVSequenceParallelMultiGPUPatcher",
+    "EmptyLatentImage",
+    "EmptyLTXVLatentVideo",
+    "LTXVEmptyLatentAudio",
+    "VAEEncode",
+    "VAEDecode",
+    "VAEDecodeTiled",
+    "LTXVAudioVAEDecode",
+    # Images, video and values
+    "CreateVideo",
+    "EmptyImage",
+    "GetImageSize",
+    "ImageScale",
+    "ImageScaleBy",
+    "PrimitiveInt",
+    "PrimitiveFloat",
+    "PrimitiveString",
+    "INTConstant",
+    "FloatConstant",
+    "CM_FloatToInt",
+})
+
+
+class WorkflowGraphError(Exception):
+    """Exception raised for workflow graphs ComfyUI would reject."""
+    pass
+
+
+def is_link(value: Any) -> bool:
+    """Check whether an input value is a [node_id, output_slot] link."""
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+        and not isinstance(value[1], bool)
+    )
+
+
+def prune_workflow(
+    workflow: dict[str, Any],
+    output_types: frozenset[str] = OUTPUT_NODE_TYPES,
+    intermediate_types: frozenset[str] = INTERMEDIATE_NODE_TYPES
+) -> tuple[dict[str, Any], list[str]]:
+    """
+    Check an API-format workflow's graph and drop nodes no output needs.
+
+    Catches what ComfyUI would otherwise only report after the POST:
+    malformed nodes, links to missing nodes or negative slots, and cycles.
+    Nodes that no output node depends on are removed, as ComfyUI would
+    never run them. Nodes nothing consumes count as outputs unless their
+    class is a known intermediate, so custom output nodes and what they
+    need are kept. If the graph has no known output node, nothing is
+    pruned and only links are checked.
+
+    Args:
+        workflow: API format workflow; not modified
+        output_types: Node classes to treat as outputs
+        intermediate_types: Node classes known not to be outputs
+
+    Returns:
+        Tuple of (workflow without unreachable nodes, removed node IDs);
+        the workflow is returned as is when nothing was removed
+
+    Raises:
+        WorkflowGraphError: Listing every problem found
+    """
+    if not isinstance(workflow, dict) or not workflow:
+        raise WorkflowGraphError("Workflow must be a non-empty object of nodes")
+
+    errors = []
+    dependencies: dict[str, list[str]] = {}
+    outputs = []
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or not isinstance(node.get("class_type"), str):
+            errors.append(f"node {node_id} has no class_type")
+            continue
+        inputs = node.get("inputs", {})
+        if not isinstance(inputs, dict):
+            errors.append(f"node {node_id} inputs must be an object")
+            continue
+
+        upstream = []
+        for input_name, value in inputs.items():
+            if not is_link(value):
+                continue
+            source, slot = value
+            if source not in workflow:
+                errors.append(f"node {node_id} input {input_name} links to missing node {source}")
+            elif slot < 0:
+                errors.append(f"node {node_id} input {input_name} links to invalid slot {slot}")
+            else:
+                upstream.append(source)
+        dependencies[node_id] = upstream
+        if node["class_type"] in output_types:
+            outputs.append(node_id)
+
+    if errors:
+        raise WorkflowGraphError("; ".join(errors))
+
+    # Dead ends of unknown classes may be outputs ComfyUI knows of
+    consumed = {source for upstream in dependencies.values() for source in upstream}
+    custom_outputs = [
+        node_id for node_id, node in workflow.items()
+        if node_id not in consumed
+        and node["class_type"] not in output_types
+        and node["class_type"] not in intermediate_types
+    ]
+    if outputs:
+        outputs.extend(custom_outputs)
+
+    # Everything the outputs depend on, or the whole graph without outputs
+    keep = set(outputs)
+    stack = list(outputs)
+    while stack:
+        for source in dependencies[stack.pop()]:
+            if source not in keep:
+                keep.add(source)
+                stack.append(source)
+    if not outputs:
+        keep = set(workflow)
+
+    # Kahn's algorithm over the kept nodes; leftovers sit on a cycle
+    pending = {node_id: len(dependencies[node_id]) for node_id in keep}
+    dependents: dict[str, list[str]] = {}
+    for node_id in keep:
+        for source in dependencies[node_id]:
+            dependents.setdefault(source, []).append(node_id)
+    ready = [node_id for node_id, count in pending.items() if count == 0]
+    while ready:
+        for dependent in dependents.get(ready.pop(), ()):
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+    blocked = {node_id for node_id, count in pending.items() if count > 0}
+    if blocked:
+        # Drop nodes that are only downstream of a cycle
+        trimmed = True
+        while trimmed:
+            trimmed = False
+            for node_id in list(blocked):
+                if not any(dependent in blocked for dependent in dependents.get(node_id, ())):
+                    blocked.discard(node_id)
+                    trimmed = True
+        raise WorkflowGraphError(f"Workflow has a cycle through nodes {sorted(blocked)}")
+
+    removed = [node_id for node_id in workflow if node_id not in keep]
+    if not removed:
+        return workflow, []
+    return {node_id: node for node_id, node in workflow.items() if node_id in keep}, removed
+
+
+def node_signatures(workflow: dict[str, Any]) -> dict[str, str]:
+    """
+    Key each node's output the way ComfyUI's node cache does.
+
+    A node's key covers its class, its literal inputs and, for linked
+    inputs, the key of the source node and the slot, but not its ID, so
+    the same subgraph gets the same keys in two prompts whatever their
+    node IDs. ComfyUI reuses a node's output from the previous prompt
+    when its key matches instead of running it again.
+
+    Args:
+        workflow: API format workflow, as checked by prune_workflow
+
+    Returns:
+        Dict of node ID to key
+    """
+    signatures: dict[str, str] = {}
+
+    def signature(node_id: str, visiting: frozenset[str]) -> str:
+        if node_id in signatures:
+            return signatures[node_id]
+        node = workflow.get(node_id)
+        if node is None or node_id in visiting:
+            # Missing nodes and cycles never match anything
+            return f"unresolved:{node_id}"
+        inputs = {}
+        for input_name, value in node.get("inputs", {}).items():
+            if is_link(value):
+                value = [signature(value[0], visiting | {node_id}), value[1]]
+            inputs[input_name] = value
+        key = json.dumps([node["class_type"], inputs], sort_keys=True, default=str)
+        signatures[node_id] = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return signatures[node_id]
+
+    for node_id in workflow:
+        signature(node_id, frozenset())
+    return signatures
+
+
+def cache_reuse(workflows: list[dict[str, Any]]) -> list[set[str]]:
+    """
+    Predict which nodes ComfyUI serves from its cache for prompts run in order.
+
+    ComfyUI's default cache keeps the outputs of the prompt it ran last,
+    so a node is reused when a node with its key was in the prompt
+    before. Nothing is assumed about what ran before the first prompt.
+
+    Returns:
+        Per workflow, the IDs of nodes expected to be reused
+    """
+    reused = []
+    previous: set[str] = set()
+    for workflow in workflows:
+        signatures = node_signatures(workflow)
+        reused.append({node_id for node_id, key in signatures.items() if key in previous})
+        previous = set(signatures.values())
+    return reused
+
+
+# Latent upscalers whose input is a finished low-res first pass, with the
+# inputs holding that latent and the VAE to decode it with
+UPSCALER_PREVIEW_INPUTS = {
+    "LTXVLatentUpsampler": ("samples", "vae"),
+}
+
+# IDs of added preview nodes start with this; their outputs are previews
+PREVIEW_NODE_PREFIX = "preview:"
+
+
+def is_preview_node(node_id: str) -> bool:
+    return str(node_id).startswith(PREVIEW_NODE_PREFIX)
+
+
+def add_preview_branch(workflow: dict[str, Any], quality: int = 70) -> tuple[dict[str, Any], list[str]]:
+    """
+    Decode each latent upscaler's input into a low-res animated preview.
+
+    Multi-pass workflows sample at reduced size, upscale the latent and
+    refine it; the first pass is already the whole clip at low
+    resolution. The added branch decodes it with the workflow's VAE and
+    saves it as an animated WebP at the fps the video is created with.
+    ComfyUI runs branches ending in an output node as soon as their
+    inputs are ready, so the preview is written before the second pass
+    starts.
+
+    Args:
+        workflow: API format workflow; not modified
+        quality: WebP quality of the preview
+
+    Returns:
+        Tuple of (workflow with the preview nodes, IDs of the preview
+        save nodes); the workflow is returned as is when it has no
+        latent upscaler
+    """
+    fps = next(
+        (node["inputs"]["fps"] for node in workflow.values()
+         if node.get("class_type") == "CreateVideo" and "fps" in node.get("inputs", {})),
+        24.0,
+    )
+    branches = {}
+    for node_id, node in workflow.items():
+        inputs = UPSCALER_PREVIEW_INPUTS.get(node.get("class_type"))
+        if not inputs:
+            continue
+        samples, vae = (node.get("inputs", {}).get(name) for name in inputs)
+        if not (is_link(samples) and is_link(vae)):
+            continue
+        decode_id = f"{PREVIEW_NODE_PREFIX}{node_id}:decode"
+        branches[decode_id] = {
+            "class_type": "VAEDecode",
+            "inputs": {"samples": samples, "vae": vae},
+            "_meta": {"title": "Preview Decode"},
+        }
+        branches[f"{PREVIEW_NODE_PREFIX}{node_id}"] = {
+            "class_type": "SaveAnimatedWEBP",
+            "inputs": {
+                "images": [decode_id, 0],
+                "filename_prefix": "preview/LTX-2",
+                "fps": fps,
+                "lossless": False,
+                "quality": quality,
+                "method": "default",
+            },
+            "_meta": {"title": "First Pass Preview"},
+        }
+    if not branches:
+        return workflow, []
+    return {**workflow, **branches}, [node_id for node_id in branches if not node_id.endswith(":decode")]
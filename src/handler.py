@@ -15,22 +15,60 @@ Usage:
 import os
 import sys
 import json
+import asyncio
 import base64
+import hashlib
 import logging
+import itertools
+import queue
 import subprocess
+import threading
 import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, suppress
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Generator, Iterator
 
 import runpod
 
+from admission import CostModel, apply_shape, is_oom_error, workflow_family, workflow_shape
 from comfy_bridge import (
     ComfyClient,
     ComfyAPIError,
+    InjectionPlan,
+    ExecutionProfile,
+    QueueDepthGate,
+    WorkflowCache,
+    WorkflowGraphError,
+    add_preview_branch,
+    cache_reuse,
+    clone_workflow,
+    execution_timestamps,
     extract_output_files,
-    load_workflow,
+    index_media_loaders,
     inject_params,
+    is_preview_node,
+    model_set,
+    model_set_key,
+    prune_workflow,
 )
+from input_media import STORE_PREFIX, InputMediaError, MediaFetcher
+from metrics import (
+    MetricsRegistry,
+    expect_reuse,
+    record_estimate,
+    record_nodes,
+    record_stage,
+    serve_metrics,
+    stage,
+    start_job_timer,
+)
+from output_storage import OutputIndex, OutputStorage, StorageError, file_sha256, storage_from_env
+from quality import QUALITY_TIERS, QualityError, check_profile, limit_shape, rewrite_graph
+from renditions import KIND_OUTPUT_TYPES, VIDEO_EXTENSIONS, RenditionError, parse_ladder, render_ladder
+from result_cache import Flight, InflightTable, ResultCache, ResultCacheError, result_key, shared_store_from_url
+from scheduler import ModelResidency, Scheduler, SchedulerError, Ticket, count_swaps
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +85,125 @@ COMFY_INPUT_DIR = os.getenv("COMFY_INPUT_DIR", "/workspace/input")
 WORKFLOW_DIR = os.getenv("WORKFLOW_DIR", "/workflows")
 STARTUP_TIMEOUT = int(os.getenv("STARTUP_TIMEOUT", "300"))
 
+# Port for the OpenMetrics /metrics endpoint; served when set, and always
+# in local test server mode (--rp_serve_api)
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+
+# Templates to run a tiny warm-up render of at startup, so model weights
+# are loaded before the first job ("all", or comma-separated names)
+PREWARM_TEMPLATES = os.getenv("PREWARM_TEMPLATES", "")
+PREWARM_INPUT = {
+    "prompt": "warm-up",
+    "width": 256,
+    "height": 256,
+    "frames": 9,
+    "steps": 1,
+}
+
+# Output delivery: "inline" returns base64 outputs in one response,
+# "stream" yields fixed-size chunks through the generator handler,
+# "upload" stores outputs in a bucket (see output_storage) and returns URLs
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "inline")
+OUTPUT_CHUNK_SIZE = int(os.getenv("OUTPUT_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Output files are deleted once delivered; anything left behind is evicted
+# oldest first beyond the byte budget or age (0 = no limit)
+DELETE_DELIVERED_OUTPUTS = os.getenv("DELETE_DELIVERED_OUTPUTS", "true").lower() == "true"
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(20 * 1024 ** 3)))
+OUTPUT_MAX_AGE_HOURS = float(os.getenv("OUTPUT_MAX_AGE_HOURS", "24"))
+# The output index is saved here so a restarted worker still evicts what
+# it left behind; one file per pod, since only files this worker indexed
+# are ever deleted (empty keeps the index in memory)
+OUTPUT_INDEX_PATH = os.getenv(
+    "OUTPUT_INDEX_PATH",
+    os.path.join(COMFY_OUTPUT_DIR, f".output-index-{os.getenv('RUNPOD_POD_ID', 'local')}.json")
+)
+
+# Renditions encoded with ffmpeg from each video output before delivery
+# (per job: "renditions" input), e.g. "1080p,720p,480p,poster,preview";
+# empty delivers the master only. RENDITION_WORKERS ffmpeg processes run
+# at once (0: up to one per CPU core)
+RENDITIONS = os.getenv("RENDITIONS", "")
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", "0"))
+RENDITION_TIMEOUT = float(os.getenv("RENDITION_TIMEOUT", "600"))
+
+# Progressive previews while a job renders (per job: "previews" input):
+# sampler previews from ComfyUI (PREVIEW_METHOD: auto, latent2rgb, taesd
+# or none) at most every PREVIEW_INTERVAL seconds, and a low-res decode of
+# the first pass of workflows with a latent upscaler. Sent as progress
+# updates, or as preview messages when streaming; without output storage
+# a preview larger than PREVIEW_MAX_BYTES is dropped
+PREVIEWS = os.getenv("PREVIEWS", "false").lower() == "true"
+PREVIEW_METHOD = os.getenv("PREVIEW_METHOD", "latent2rgb")
+PREVIEW_INTERVAL = float(os.getenv("PREVIEW_INTERVAL", "5"))
+PREVIEW_MAX_BYTES = int(os.getenv("PREVIEW_MAX_BYTES", str(2 * 1024 ** 2)))
+
+# Input media fetching; file:// inputs are only read from these roots
+INPUT_FILE_ROOTS = os.getenv("INPUT_FILE_ROOTS", "/runpod-volume").split(":")
+INPUT_FETCH_WORKERS = int(os.getenv("INPUT_FETCH_WORKERS", "8"))
+INPUT_FETCH_TIMEOUT = int(os.getenv("INPUT_FETCH_TIMEOUT", "60"))
+# Hosts http(s) inputs may come from, comma separated (".example.com" also
+# matches subdomains); empty allows any host with only public addresses.
+# Inputs over INPUT_MAX_BYTES are refused (0 = no limit)
+INPUT_ALLOWED_HOSTS = [host.strip() for host in os.getenv("INPUT_ALLOWED_HOSTS", "").split(",") if host.strip()]
+INPUT_MAX_BYTES = int(os.getenv("INPUT_MAX_BYTES", str(2 * 1024 ** 3)))
+# Byte budget for COMFY_INPUT_DIR, least recently used inputs are evicted
+# beyond it (0 = unbounded)
+INPUT_CACHE_MAX_BYTES = int(os.getenv("INPUT_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+# Result cache for identical workflows, off unless RESULT_CACHE_DIR is set,
+# e.g. /workspace/result-cache; it takes up to RESULT_CACHE_MAX_BYTES of
+# disk on top of OUTPUT_MAX_BYTES. RESULT_CACHE_SHARED is an
+# s3://bucket/prefix or a directory on a network volume shared with other
+# workers
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+RESULT_CACHE_SHARED = os.getenv("RESULT_CACHE_SHARED", "")
+# Jobs identical to one still rendering join its prompt instead of
+# queueing their own ("cache": false opts a job out)
+COALESCE_JOBS = os.getenv("COALESCE_JOBS", "true").lower() == "true"
+
+# Jobs run at once on a worker; above 1 the async handler is used, which
+# overlaps one job's input fetching and output delivery with another's render
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+# Prompts allowed in ComfyUI's queue (running + pending) before new ones
+# wait; 2 keeps the next prompt ready without hoarding jobs in the queue
+COMFY_MAX_QUEUE_DEPTH = int(os.getenv("COMFY_MAX_QUEUE_DEPTH", "2"))
+# Prompts of jobs that time out or are cancelled are interrupted (or
+# deleted if still pending); the job ends once ComfyUI has let go of the
+# prompt, waiting at most this many seconds
+CANCEL_TIMEOUT = float(os.getenv("CANCEL_TIMEOUT", "30"))
+
+# Admission control: renders that a recorded out-of-memory failure shows
+# won't fit in this share of VRAM are rejected, or downscaled with
+# "downscale" (per job: "admission" input); until a workflow family has
+# run out of memory its renders are admitted and their estimates recorded
+ADMISSION_POLICY = os.getenv("ADMISSION_POLICY", "reject")
+ADMISSION_VRAM_FRACTION = float(os.getenv("ADMISSION_VRAM_FRACTION", "0.9"))
+# Where render costs are recorded for calibration across restarts
+ADMISSION_HISTORY = os.getenv("ADMISSION_HISTORY", "/workspace/admission-history.jsonl")
+
+# Order of renders waiting for ComfyUI (concurrent jobs and batch items):
+# "sjf" runs the shortest estimated render first, crediting each waiting
+# render SCHEDULER_AGING seconds per second waited and renders needing the
+# models already loaded SCHEDULER_GROUP_BONUS seconds; "fifo"
+# keeps arrival order
+SCHEDULER_POLICY = os.getenv("SCHEDULER_POLICY", "sjf")
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", "0.2"))
+SCHEDULER_GROUP_BONUS = float(os.getenv("SCHEDULER_GROUP_BONUS", "60"))
+
+# Batch jobs: input keys that describe variants, and the most items one
+# job may expand to
+BATCH_KEYS = ("variants", "grid", "sweep")
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+# Parameters a sweep may vary, from the one entering the graph earliest
+# (varied slowest) to the latest (varied fastest): consecutive items then
+# differ as far downstream as possible, and ComfyUI reuses everything
+# upstream of the difference from the prompt it ran before, e.g. the
+# text encoding of all seeds of a prompt
+SWEEP_KEYS = ("prompt", "negative_prompt", "resolution", "seed")
+
 # Workflow templates mapping (API format files)
 WORKFLOW_TEMPLATES = {
     "t2v": "LTX-2_00041_.json",
@@ -69,22 +226,45 @@ TEMPLATE_PARAM_MAPPING = {
         "steps": ("92:9", "steps"),  # LTXVScheduler
         "cfg": ("92:47", "cfg"),  # CFGGuider
     },
-    "i2v": {
-        "width": ("92:89", "width"),
-        "height": ("92:89", "height"),
-        "frames": ("92:62", "value"),
-        "prompt": ("92:3", "text"),
-        "seed": ("92:11", "noise_seed"),
+    # The i2v, canny and depth templates share one single-pass graph
+    **{
+        template: {
+            "width": ("43", "width"),  # EmptyLTXVLatentVideo
+            "height": ("43", "height"),
+            "frames": ("27", "value"),  # INTConstant frame count
+            "prompt": ("3", "text"),  # CLIPTextEncode positive
+            "negative_prompt": ("4", "text"),  # CLIPTextEncode negative
+            "seed": ("11", "noise_seed"),  # RandomNoise
+            "steps": ("9", "steps"),  # LTXVScheduler
+            "cfg": ("18", "cfg"),  # GuiderParameters (video)
+        }
+        for template in ("i2v", "canny", "depth")
     },
-    "canny": {
-        "width": ("92:89", "width"),
-        "height": ("92:89", "height"),
-        "prompt": ("92:3", "text"),
+}
+
+# Quality tiers ("quality" input: draft, standard or final; see quality.py
+# for the profile format). "standard" is each template as shipped. Draft
+# samples fewer steps at half the size, with at most 49 frames; t2v's draft
+# also decodes its first pass directly, skipping the latent upscaler and
+# the second pass. Final samples more steps.
+DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "standard")
+QUALITY_PROFILES = {
+    "t2v": {
+        "draft": {
+            # Sample at the draft size rather than half of it
+            "inputs": {"92:9": {"steps": 8}, "92:90": {"scale_by": 1.0}},
+            "relink": {"92:98": {"samples": ["92:81", 2]}, "92:96": {"samples": ["92:80", 1]}},
+            "scale": 0.5,
+            "max_frames": 49,
+        },
+        "final": {"inputs": {"92:9": {"steps": 40}}},
     },
-    "depth": {
-        "width": ("92:89", "width"),
-        "height": ("92:89", "height"),
-        "prompt": ("92:3", "text"),
+    **{
+        template: {
+            "draft": {"inputs": {"9": {"steps": 8}}, "scale": 0.5, "max_frames": 49},
+            "final": {"inputs": {"9": {"steps": 40}}},
+        }
+        for template in ("i2v", "canny", "depth")
     },
 }
 
@@ -107,15 +287,82 @@ RESOLUTION_PRESETS = {
 # Global ComfyUI client
 comfy_client: ComfyClient = None
 
+# ComfyUI process when started by this worker
+comfy_process: subprocess.Popen = None
 
-def start_comfyui() -> bool:
+# Seconds spent in each cold start stage, filled in as stages finish
+startup_timings: dict[str, float] = {}
+
+# Process start, the reference for worker-level timings
+worker_started = time.perf_counter()
+
+# Aggregated job metrics, exported at /metrics
+metrics_registry = MetricsRegistry()
+
+# Parsed workflow templates, shared across jobs
+template_cache = WorkflowCache()
+
+# Output storage backend, set on startup when OUTPUT_MODE=upload
+output_storage: OutputStorage = None
+
+# Output files of this worker's prompts, set on startup
+output_index: OutputIndex = None
+
+# Bounds ComfyUI's queue for the async handler, set on startup
+queue_gate: QueueDepthGate = None
+
+# Result cache, set on startup unless disabled
+result_cache: ResultCache = None
+
+# Renders in progress, for jobs to join identical ones
+inflight = InflightTable()
+
+# Render cost estimates for admission, set on startup unless disabled
+cost_model: CostModel = None
+
+# Usable VRAM in bytes, read from ComfyUI on first use
+vram_budget_bytes = 0
+
+# Orders renders waiting to be queued, set on startup
+scheduler: Scheduler = None
+
+# The model set ComfyUI has loaded, with swaps made and avoided
+model_residency = ModelResidency()
+
+# Streams input media into COMFY_INPUT_DIR
+media_fetcher = MediaFetcher(
+    allowed_file_roots=INPUT_FILE_ROOTS,
+    timeout=INPUT_FETCH_TIMEOUT,
+    max_workers=INPUT_FETCH_WORKERS,
+    cache_max_bytes=INPUT_CACHE_MAX_BYTES,
+    allowed_hosts=INPUT_ALLOWED_HOSTS,
+    max_input_bytes=INPUT_MAX_BYTES,
+)
+
+
+class JobError(Exception):
+    """Job can't be run as requested; the message is returned to the caller."""
+    pass
+
+
+@contextmanager
+def startup_stage(name: str) -> Iterator[None]:
+    """Time a cold start stage into startup_timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"Startup stage '{name}' took {startup_timings[name]:.2f}s")
+
+
+def launch_comfyui() -> None:
     """
-    Start ComfyUI server in background.
+    Start ComfyUI server in background without waiting for it.
 
-    Returns:
-        True if server started successfully
+    Does nothing if a server is already listening.
     """
-    global comfy_client
+    global comfy_client, comfy_process
 
     logger.info("Starting ComfyUI server...")
 
@@ -123,7 +370,7 @@ def start_comfyui() -> bool:
     comfy_client = ComfyClient(host=COMFY_HOST, port=COMFY_PORT)
     if comfy_client.is_ready():
         logger.info("ComfyUI already running")
-        return True
+        return
 
     # Build command
     comfy_cmd = [
@@ -133,6 +380,9 @@ def start_comfyui() -> bool:
         "--disable-auto-launch",
     ]
 
+    if PREVIEW_METHOD != "none":
+        comfy_cmd.extend(["--preview-method", PREVIEW_METHOD])
+
     # Add extra model paths if configured
     extra_paths = os.getenv("EXTRA_MODEL_PATHS")
     if extra_paths and os.path.exists(extra_paths):
@@ -140,113 +390,389 @@ def start_comfyui() -> bool:
 
     # Start ComfyUI process (log to stdout so RunPod captures it)
     logger.info(f"Running: {' '.join(comfy_cmd)}")
-    subprocess.Popen(
+    comfy_process = subprocess.Popen(
         comfy_cmd,
         stdout=sys.stdout,
         stderr=sys.stderr,
         start_new_session=True
     )
 
-    # Wait for server to be ready
-    if not comfy_client.wait_for_ready(timeout=STARTUP_TIMEOUT):
-        logger.error("ComfyUI failed to start within timeout")
+
+def wait_for_comfyui() -> bool:
+    """
+    Wait for the launched ComfyUI server to accept requests.
+
+    Returns:
+        True if the server is ready, False on timeout or if the process exited
+    """
+    def process_exited() -> bool:
+        return comfy_process is not None and comfy_process.poll() is not None
+
+    if not comfy_client.wait_for_ready(timeout=STARTUP_TIMEOUT, should_abort=process_exited):
+        if process_exited():
+            logger.error(f"ComfyUI exited with code {comfy_process.returncode} during startup")
+        else:
+            logger.error("ComfyUI failed to start within timeout")
         return False
 
     logger.info("ComfyUI server started successfully")
     return True
 
 
+def start_comfyui() -> bool:
+    """
+    Start ComfyUI server in background and wait until it's ready.
+
+    Returns:
+        True if server started successfully
+    """
+    launch_comfyui()
+    return wait_for_comfyui()
+
+
+def prewarm_templates(names: list[str]) -> list[str]:
+    """
+    Queue a tiny render of each template so its models get loaded.
+
+    Uses PREWARM_INPUT (low resolution, few frames, one step). Templates
+    that can't be built or are rejected by ComfyUI (e.g. because they need
+    input images) are skipped with a warning.
+
+    Returns:
+        Prompt IDs of the queued warm-up renders
+    """
+    prompt_ids = []
+    for name in names:
+        try:
+            workflow = build_workflow({"template": name, **PREWARM_INPUT}, {})
+            prompt_ids.append(comfy_client.queue_prompt(workflow))
+            model_residency.queued(workflow_group(workflow))
+            logger.info(f"Queued warm-up render for template {name}")
+        except (JobError, ComfyAPIError) as e:
+            logger.warning(f"Skipping warm-up for template {name}: {e}")
+    return prompt_ids
+
+
+def await_prewarm(prompt_ids: list[str]) -> None:
+    """Wait for warm-up renders to finish, timing them as the prewarm stage."""
+    with startup_stage("prewarm"):
+        for prompt_id in prompt_ids:
+            try:
+                history = comfy_client.wait_for_completion(prompt_id, timeout=STARTUP_TIMEOUT)
+            except ComfyAPIError as e:
+                logger.warning(f"Warm-up render {prompt_id} failed: {e}")
+                continue
+            # Nobody asked for the warm-up videos
+            output_files = extract_output_files(history)
+            index_outputs(output_files)
+            release_outputs(output_files)
+    log_startup_timings()
+
+
+def prewarm_template_names() -> list[str]:
+    """Parse PREWARM_TEMPLATES into template names."""
+    if PREWARM_TEMPLATES.strip() == "all":
+        return list(WORKFLOW_TEMPLATES)
+    names = [name.strip() for name in PREWARM_TEMPLATES.split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORKFLOW_TEMPLATES]
+    if unknown:
+        logger.warning(f"Unknown templates in PREWARM_TEMPLATES: {unknown}")
+    return [name for name in names if name in WORKFLOW_TEMPLATES]
+
+
+def log_startup_timings() -> None:
+    """Log all stage timings as one line, for tracking cold start over releases."""
+    metrics_registry.set_worker_timings(startup_timings)
+    logger.info(f"Cold start timings: {json.dumps(startup_timings, sort_keys=True)}")
+
+
+def finish_job_metrics(timer, result: dict[str, Any]) -> dict[str, Any]:
+    """
+    Attach a job's metrics record to its result and aggregate it.
+
+    The record holds the job's stage timings, its total time, the time
+    ComfyUI spent in each node, how many nodes it reused from its cache,
+    the admission estimate if any and the worker's cold start timings
+    (first_job is set by the first job).
+    """
+    total = timer.total()
+    stages = timer.as_dict()
+    nodes = timer.node_list()
+    estimate = timer.estimate
+
+    if "first_job" not in startup_timings:
+        startup_timings["first_job"] = round(time.perf_counter() - worker_started, 3)
+        log_startup_timings()
+
+    metrics_registry.observe_job(result.get("status", "unknown"), stages, total, nodes)
+    metrics_registry.set_counters(model_residency.counters())
+    result["metrics"] = {
+        "stages": stages,
+        "total_seconds": round(total, 4),
+        "nodes": nodes,
+        "worker": dict(startup_timings),
+    }
+    if estimate is not None:
+        result["metrics"]["estimate"] = estimate
+    reuse = timer.reuse()
+    if reuse is not None:
+        result["metrics"]["node_reuse"] = reuse
+    return result
+
+
 def encode_file_base64(filepath: str | Path) -> str:
     """Read a file and return base64 encoded string."""
     with open(filepath, "rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
 
-def decode_base64_to_file(b64_data: str, filepath: str | Path) -> None:
-    """Decode base64 string and write to file."""
-    with open(filepath, "wb") as f:
-        f.write(base64.b64decode(b64_data))
-
-
 def process_input_images(job_input: dict[str, Any]) -> dict[str, str]:
     """
-    Process any base64 encoded images in the input and save them.
+    Save input media from the job input to ComfyUI's input directory.
+
+    Each value in job_input["images"] may be base64 data, a data URI or an
+    http(s)://, s3:// or file:// URL. Inputs are fetched concurrently and
+    streamed to disk under content-addressed names; files already in the
+    input store are reused. Saved files stay pinned until
+    release_input_images is called.
 
     Args:
         job_input: The job input dict
 
     Returns:
         Mapping of input names to saved filenames
-    """
-    saved_files = {}
 
-    # Check for images dict
+    Raises:
+        JobError: If an input can't be fetched or decoded
+    """
     images = job_input.get("images", {})
-    for name, b64_data in images.items():
-        if b64_data:
-            # Generate unique filename
-            timestamp = int(time.time() * 1000)
-            filename = f"input_{name}_{timestamp}.png"
-            filepath = Path(COMFY_INPUT_DIR) / filename
+    try:
+        with stage("input_decode"):
+            saved = media_fetcher.fetch_all(images, COMFY_INPUT_DIR)
+    except InputMediaError as e:
+        raise JobError(str(e))
+
+    if saved:
+        stats = media_fetcher.store(COMFY_INPUT_DIR).stats()
+        logger.info(
+            f"Input cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['bytes'] / (1024 * 1024):.1f} MB in {stats['files']} files"
+        )
+    return saved
 
-            # Ensure directory exists
-            filepath.parent.mkdir(parents=True, exist_ok=True)
 
-            # Save the image
-            decode_base64_to_file(b64_data, filepath)
-            saved_files[name] = filename
-            logger.info(f"Saved input image: {filename}")
+def release_input_images(saved_images: dict[str, str]) -> None:
+    """Unpin a job's input files so they can be evicted."""
+    if saved_images:
+        media_fetcher.release(saved_images.values(), COMFY_INPUT_DIR)
 
-    return saved_files
 
+def resolve_output_path(output: dict) -> Path | None:
+    """
+    Resolve an output file info dict to a path in the output directory.
+
+    Outputs served from the result cache carry their own path.
 
-def collect_outputs(output_files: list[dict]) -> list[dict[str, Any]]:
+    Returns:
+        Path to the file, or None if it has no filename or doesn't exist
     """
-    Collect output files and encode them as base64.
+    filename = output.get("filename")
+
+    if not filename:
+        return None
+
+    with stage("output_collection"):
+        filepath = output_file_path(output)
+        if not filepath.exists():
+            logger.warning(f"Output file not found: {filepath}")
+            return None
+        return filepath
+
+
+def output_file_path(output: dict) -> Path:
+    """Where an output file lives: the output directory or its own path."""
+    if output.get("path"):
+        return Path(output["path"])
+    return Path(COMFY_OUTPUT_DIR) / output.get("subfolder", "") / output["filename"]
+
+
+def index_outputs(output_files: list[dict]) -> None:
+    """Record a finished prompt's output files in the output index."""
+    if output_index is not None:
+        output_index.add(output_file_path(output) for output in output_files if output.get("filename"))
+
+
+def retain_outputs(output_files: list[dict], count: int) -> None:
+    """Keep output files until count more jobs have delivered them."""
+    if output_index is not None:
+        output_index.retain(
+            (output_file_path(output) for output in output_files if output.get("filename")), count
+        )
+
+
+def release_outputs(output_files: list[dict]) -> None:
+    """
+    Delete output files once delivered.
+
+    Only indexed files are deleted, so result cache copies stay.
+    """
+    if output_index is not None and DELETE_DELIVERED_OUTPUTS:
+        output_index.remove(output_file_path(output) for output in output_files if output.get("filename"))
+
+
+def rendition_ladder(job_input: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Get a job's rendition ladder.
+
+    Raises:
+        JobError: If the ladder is invalid
+    """
+    try:
+        return parse_ladder(job_input.get("renditions", RENDITIONS))
+    except RenditionError as e:
+        raise JobError(f"Invalid renditions: {e}")
+
+
+def add_renditions(job: dict[str, Any], output_files: list[dict], item: int | None = None) -> list[dict]:
+    """
+    Encode the job's rendition ladder from each video output.
+
+    Renditions are written under renditions/<job id>/ in the output
+    directory and indexed, so they're deleted after delivery like the
+    outputs they came from.
+
+    Returns:
+        output_files followed by the renditions, each carrying its
+        rendition name and source filename, or an error if it failed
+    """
+    ladder = rendition_ladder(job.get("input", {}))
+    if not ladder:
+        return output_files
+
+    out_dir = Path(COMFY_OUTPUT_DIR) / "renditions" / str(job.get("id", "unknown"))
+    if item is not None:
+        out_dir = out_dir / str(item)
+    renditions = []
+    with stage("renditions"):
+        for output in output_files:
+            filepath = resolve_output_path(output)
+            if filepath is None or filepath.suffix.lower() not in VIDEO_EXTENSIONS:
+                continue
+            for result in render_ladder(filepath, out_dir, ladder, RENDITION_WORKERS, timeout=RENDITION_TIMEOUT):
+                entry = {"type": KIND_OUTPUT_TYPES[result["kind"]], "rendition": result["name"], "source": filepath.name}
+                if "error" in result:
+                    entry["error"] = result["error"]
+                else:
+                    entry.update(filename=Path(result["path"]).name, path=result["path"])
+                renditions.append(entry)
+
+    index_outputs(renditions)
+    return output_files + renditions
+
+
+def output_summary(output: dict, filepath: Path | None = None) -> dict[str, Any]:
+    """Type and filename of a delivered output, plus its rendition, source and error if any."""
+    summary = {"type": output.get("type", "unknown")}
+    if filepath is not None:
+        summary["filename"] = filepath.name
+    for key in ("rendition", "source", "error"):
+        if key in output:
+            summary[key] = output[key]
+    return summary
+
+
+def iter_file_chunks(filepath: str | Path, chunk_size: int) -> Iterator[bytes]:
+    """Read a file in chunks of at most chunk_size bytes."""
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def collect_outputs(
+    output_files: list[dict],
+    storage: OutputStorage | None = None,
+    key_prefix: str = ""
+) -> list[dict[str, Any]]:
+    """
+    Collect output files and encode them as base64, or upload them.
+
+    With a storage backend, each file is handed to an upload pool as soon
+    as it's resolved, so uploads of several outputs run concurrently
+    instead of back to back.
 
     Args:
         output_files: List of output file info dicts
+        storage: Optional backend to upload outputs to instead of inlining
+        key_prefix: Object key prefix for uploads (e.g. the job ID)
 
     Returns:
-        List of output dicts with base64 encoded data
+        List of output dicts with base64 encoded data, or with url,
+        key and sha256 when uploaded
     """
+    if storage is not None:
+        with stage("upload"):
+            return _upload_outputs(output_files, storage, key_prefix)
+
     results = []
 
     for output in output_files:
-        filename = output.get("filename")
-        subfolder = output.get("subfolder", "")
-
-        if not filename:
+        if "error" in output:
+            results.append(output_summary(output))
             continue
-
-        # Build full path
-        if subfolder:
-            filepath = Path(COMFY_OUTPUT_DIR) / subfolder / filename
-        else:
-            filepath = Path(COMFY_OUTPUT_DIR) / filename
-
-        if not filepath.exists():
-            logger.warning(f"Output file not found: {filepath}")
+        filepath = resolve_output_path(output)
+        if filepath is None:
             continue
 
         # Get file size for logging
-        size_mb = filepath.stat().st_size / (1024 * 1024)
-        logger.info(f"Encoding output: {filename} ({size_mb:.2f} MB)")
+        size_bytes = filepath.stat().st_size
+        logger.info(f"Encoding output: {filepath.name} ({size_bytes / (1024 * 1024):.2f} MB)")
 
         results.append({
-            "type": output.get("type", "unknown"),
-            "filename": filename,
-            "data": encode_file_base64(filepath),
-            "size_bytes": filepath.stat().st_size,
+            **output_summary(output, filepath),
+            "data": _encode_output(filepath),
+            "size_bytes": size_bytes,
         })
 
     return results
 
 
+def _encode_output(filepath: Path) -> str:
+    with stage("encoding"):
+        return encode_file_base64(filepath)
+
+
+def _upload_outputs(
+    output_files: list[dict],
+    storage: OutputStorage,
+    key_prefix: str
+) -> list[dict[str, Any]]:
+    """Upload outputs concurrently, returning results in output order."""
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        pending = []
+        for output in output_files:
+            if "error" in output:
+                pending.append((output, None, None))
+                continue
+            filepath = resolve_output_path(output)
+            if filepath is None:
+                continue
+            future = pool.submit(storage.upload, filepath, f"{key_prefix}{filepath.name}")
+            pending.append((output, filepath, future))
+
+        return [
+            {
+                **output_summary(output, filepath),
+                **(future.result() if future is not None else {}),
+            }
+            for output, filepath, future in pending
+        ]
+
+
 def apply_template_params(
     workflow: dict[str, Any],
     template_name: str,
-    job_input: dict[str, Any]
+    job_input: dict[str, Any],
+    plan: InjectionPlan | None = None
 ) -> dict[str, Any]:
     """
     Apply simplified parameters to a workflow using template mappings.
@@ -258,11 +784,17 @@ def apply_template_params(
         workflow: The workflow dict to modify
         template_name: Name of the template (e.g., 't2v', 'i2v')
         job_input: The job input containing simplified params
+        plan: Precompiled plan for the template (see get_template_plan);
+            compiled from the workflow if not given
 
     Returns:
         Modified workflow with injected parameters
+
+    Raises:
+        JobError: If the job sets a param the template's mapping can't resolve
     """
-    mapping = TEMPLATE_PARAM_MAPPING.get(template_name, {})
+    if plan is None:
+        plan = InjectionPlan(workflow, TEMPLATE_PARAM_MAPPING.get(template_name, {}))
 
     # Handle resolution preset
     resolution = job_input.get("resolution")
@@ -272,32 +804,846 @@ def apply_template_params(
         job_input["height"] = height
         logger.info(f"Applied resolution preset '{resolution}': {width}x{height}")
 
-    # Apply each simplified param
-    for param_name, (node_id, input_name) in mapping.items():
-        if param_name in job_input:
-            value = job_input[param_name]
-            if node_id in workflow:
-                if "inputs" not in workflow[node_id]:
-                    workflow[node_id]["inputs"] = {}
-                workflow[node_id]["inputs"][input_name] = value
-                logger.info(f"Set {param_name}={value} on node {node_id}.{input_name}")
-            else:
-                logger.warning(f"Node {node_id} not found for param {param_name}")
+    unmapped = [param for param in plan.invalid if param in job_input]
+    if unmapped:
+        raise JobError(f"Template {template_name} can't set {', '.join(unmapped)}")
+
+    applied = plan.apply(workflow, job_input)
+    if applied:
+        logger.info(f"Applied template params: {', '.join(applied)}")
 
     return workflow
 
 
-def progress_update(job: dict, progress: int, message: str) -> None:
-    """Send progress update to RunPod."""
+def get_template_plan(template_name: str, workflow_path: str | Path) -> InjectionPlan:
+    """Get the compiled injection plan for a template, built once per file version."""
+    return template_cache.compile(
+        workflow_path,
+        "injection_plan",
+        lambda workflow: InjectionPlan(workflow, TEMPLATE_PARAM_MAPPING.get(template_name, {}))
+    )
+
+
+def input_file_hashes(workflow: dict[str, Any]) -> dict[str, str]:
+    """
+    Get the content hash of every input file a workflow's loaders read.
+
+    Files from the input store are named by their hash; anything else is
+    hashed from disk.
+    """
+    hashes = {}
+    for filename in index_media_loaders(workflow):
+        stem = Path(filename).stem
+        if stem.startswith(STORE_PREFIX):
+            hashes[filename] = stem[len(STORE_PREFIX):]
+            continue
+        path = Path(COMFY_INPUT_DIR) / filename
+        hashes[filename] = file_sha256(path) if path.is_file() else "missing"
+    return hashes
+
+
+def store_result(cache_key: str, prompt_id: str, output_files: list[dict]) -> None:
+    """Save a finished workflow's outputs in the result cache."""
+    outputs = []
+    for output in output_files:
+        filepath = resolve_output_path(output)
+        if filepath is None:
+            return
+        outputs.append((output, filepath))
+
     try:
-        runpod.serverless.progress_update(
-            job,
-            {"progress": progress, "message": message}
-        )
+        result_cache.put(cache_key, prompt_id, outputs)
+    except ResultCacheError as e:
+        logger.warning(str(e))
+
+
+def progress_update(job: dict, progress: int, message: str, preview: dict[str, Any] | None = None) -> None:
+    """Send progress update to RunPod, with a preview if given."""
+    update = {"progress": progress, "message": message}
+    if preview is not None:
+        update["preview"] = preview
+    try:
+        runpod.serverless.progress_update(job, update)
     except Exception as e:
         logger.warning(f"Failed to send progress update: {e}")
 
 
+def preview_relay(job: dict[str, Any], sink=None):
+    """
+    Build the preview callback for a job's render, or None if it has previews off.
+
+    Sampler previews are sent at most every PREVIEW_INTERVAL seconds;
+    the first-pass preview once its node has saved it. Each is sent as a
+    progress update whose preview has kind ("latent" or "first_pass"),
+    node_id, mime and data (base64) or url, or passed to sink as a
+    {"type": "preview", "progress", "message", ...} message.
+    """
+    if not job.get("input", {}).get("previews", PREVIEWS):
+        return None
+    last_latent = None
+
+    def on_preview(event: dict[str, Any]) -> None:
+        nonlocal last_latent
+        if event["kind"] == "latent":
+            now = time.monotonic()
+            if last_latent is not None and now - last_latent < PREVIEW_INTERVAL:
+                return
+            last_latent = now
+            preview = {
+                "kind": "latent",
+                "node_id": event["node_id"],
+                "mime": event["mime"],
+                "data": base64.b64encode(event["image"]).decode("utf-8"),
+            }
+            message = event["message"]
+        elif event["kind"] == "output" and is_preview_node(event["node_id"]):
+            preview = first_pass_preview(job, event)
+            if preview is None:
+                return
+            message = "First pass preview"
+        else:
+            return
+
+        # Same 10-90% range as execution progress
+        progress = 10 + int(event["progress"] * 0.8)
+        if sink is not None:
+            sink({"type": "preview", "progress": progress, "message": message, **preview})
+        else:
+            progress_update(job, progress, message, preview)
+
+    return on_preview
+
+
+def first_pass_preview(job: dict[str, Any], event: dict[str, Any]) -> dict[str, Any] | None:
+    """Inline or upload the file a preview node saved; None if it can't be delivered."""
+    images = event["output"].get("images") or []
+    if not images:
+        return None
+    filepath = output_file_path(images[0])
+    try:
+        size_bytes = filepath.stat().st_size
+        preview = {
+            "kind": "first_pass",
+            "node_id": event["node_id"],
+            "mime": "image/webp",
+            "filename": filepath.name,
+            "size_bytes": size_bytes,
+        }
+        if output_storage is not None:
+            key = f"{job.get('id', 'unknown')}/previews/{filepath.name}"
+            with stage("upload"):
+                return {**preview, **output_storage.upload(filepath, key)}
+        if size_bytes > PREVIEW_MAX_BYTES:
+            logger.info(f"Preview {filepath.name} is {size_bytes} bytes, over PREVIEW_MAX_BYTES; not sent")
+            return None
+        return {**preview, "data": encode_file_base64(filepath)}
+    except (OSError, StorageError) as e:
+        logger.warning(f"Could not send preview {filepath.name}: {e}")
+        return None
+
+
+def run_workflow(job: dict[str, Any], preview_sink=None, should_abort=None) -> tuple[str, list[dict], bool]:
+    """
+    Prepare a job's workflow, queue it and wait for it to finish.
+
+    If an identical workflow (same inputs) has run before, its stored
+    outputs are returned instead. Set "cache": false in the input to
+    force a new render.
+
+    Args:
+        job: RunPod job dict (see handler for input formats)
+        preview_sink: Where to send the job's previews (see
+            preview_relay) instead of progress updates
+        should_abort: Checked while rendering; once True the prompt is
+            cancelled and ComfyAPIError raised
+
+    Returns:
+        Tuple of (prompt_id, output file info dicts, whether the outputs
+        came from the result cache)
+
+    Raises:
+        JobError: If the input is invalid or the workflow produced nothing
+        ComfyAPIError: If ComfyUI rejects or fails the workflow
+    """
+    job_input = job.get("input", {})
+    rendition_ladder(job_input)
+
+    # Validate ComfyUI is running
+    if not comfy_client or not comfy_client.is_ready():
+        raise JobError("ComfyUI server not available")
+
+    # Process input images
+    saved_images = process_input_images(job_input)
+    try:
+        return _execute_workflow(job, saved_images, preview_sink, should_abort)
+    finally:
+        # ComfyUI has read its inputs once the prompt is done
+        release_input_images(saved_images)
+
+
+def _execute_workflow(
+    job: dict[str, Any],
+    saved_images: dict[str, str],
+    preview_sink=None,
+    should_abort=None
+) -> tuple[str, list[dict], bool]:
+    """Build, queue and await a job's workflow once its inputs are saved."""
+    job_input = job.get("input", {})
+    workflow = admit_workflow(build_workflow(job_input, saved_images), job_input)
+
+    # Reuse the outputs of an identical earlier run
+    cache_key, cached = find_cached_result(workflow, job_input)
+    if cached:
+        logger.info(f"Result cache hit {cache_key[:16]} (prompt {cached['prompt_id']})")
+        progress_update(job, 95, "Using cached result...")
+        return cached["prompt_id"], cached["outputs"], True
+
+    timeout = job_input.get("timeout", 600)
+
+    # Share the render of an identical job still in progress
+    flight, owner = join_inflight(cache_key, job_input)
+    if not owner:
+        progress_update(job, 10, "Joining an identical render in progress...")
+        prompt_id, output_files = await_inflight(flight, timeout)
+        progress_update(job, 95, "Collecting outputs...")
+        return prompt_id, output_files, False
+
+    # Previews are added after the cache key is taken, so jobs with and
+    # without them share results
+    on_preview = preview_relay(job, preview_sink)
+    if on_preview is not None:
+        workflow, _ = add_preview_branch(workflow)
+
+    try:
+        # Queue the workflow
+        progress_update(job, 5, "Queuing workflow...")
+        prompt_id, queued_at = queue_workflow(workflow)
+
+        # Wait for completion with progress updates
+        def on_progress(progress: int, message: str):
+            # Map to 10-90% range (5% for queue, 95-100% for output)
+            scaled = 10 + int(progress * 0.8)
+            progress_update(job, scaled, message)
+
+        progress_update(job, 10, "Executing workflow...")
+        output_files = await_outputs(prompt_id, timeout, on_progress, queued_at, workflow, on_preview, should_abort)
+    except BaseException as e:
+        fail_inflight(cache_key, flight, e)
+        raise
+    finish_inflight(cache_key, flight, prompt_id, output_files)
+    progress_update(job, 95, "Collecting outputs...")
+
+    if cache_key and result_cache is not None:
+        store_result(cache_key, prompt_id, output_files)
+
+    return prompt_id, output_files, False
+
+
+def build_workflow(job_input: dict[str, Any], saved_images: dict[str, str]) -> dict[str, Any]:
+    """
+    Build the final workflow for a job input.
+
+    Loads the template (or takes the direct workflow), applies simplified
+    and per-node params, points media loaders at the saved inputs and
+    checks the graph, dropping nodes no output needs.
+
+    Raises:
+        JobError: If the input names no usable workflow or its graph is
+            broken (missing link targets, cycles)
+    """
+    workflow = None
+    plan = None
+
+    if "workflow" in job_input:
+        # Direct workflow mode
+        if job_input.get("quality", "standard") != "standard":
+            raise JobError("Quality tiers only apply to templates; set steps and size in the workflow")
+        workflow = job_input["workflow"]
+        logger.info("Using direct workflow from input")
+
+    elif "template" in job_input:
+        # Template mode
+        template_name = job_input["template"]
+        if template_name not in WORKFLOW_TEMPLATES:
+            raise JobError(
+                f"Unknown template: {template_name}. Available: {list(WORKFLOW_TEMPLATES.keys())}"
+            )
+
+        workflow_path = Path(WORKFLOW_DIR) / WORKFLOW_TEMPLATES[template_name]
+        if not workflow_path.exists():
+            raise JobError(f"Workflow file not found: {workflow_path}")
+
+        with stage("template_load"):
+            workflow = template_cache.load(workflow_path)
+            plan = get_template_plan(template_name, workflow_path)
+        logger.info(f"Loaded template: {template_name}")
+
+        tier = quality_tier(job_input)
+        profile = QUALITY_PROFILES.get(template_name, {}).get(tier, {})
+
+        # Apply the quality tier around the simplified parameters (width,
+        # height, prompt, etc.): its inputs are defaults the job's params
+        # override, its size limits apply to the size the job asked for
+        with stage("param_injection"):
+            try:
+                workflow = rewrite_graph(workflow, profile)
+            except QualityError as e:
+                raise JobError(f"Quality '{tier}' doesn't fit template {template_name}: {e}")
+            workflow = apply_template_params(workflow, template_name, job_input, plan)
+            limited = limit_shape(workflow, profile)
+        if limited:
+            logger.info(f"Quality '{tier}': rendering {limited['width']}x{limited['height']}x{limited['frames']}")
+
+    else:
+        raise JobError("Must provide 'workflow' or 'template' in input")
+
+    with stage("param_injection"):
+        # Inject custom parameters
+        params = job_input.get("params", {})
+        if params:
+            workflow = inject_params(workflow, params)
+            logger.info(f"Injected params for nodes: {list(params.keys())}")
+
+        # Inject saved input images into workflow
+        if saved_images:
+            if plan is None:
+                # Direct workflows aren't cached, index their loaders once
+                plan = InjectionPlan(workflow, {})
+            plan.bind_media(workflow, saved_images, touched_nodes=set(params))
+
+    # Reject broken graphs here rather than after a round trip to ComfyUI
+    with stage("graph_check"):
+        try:
+            workflow, pruned = prune_workflow(workflow)
+        except WorkflowGraphError as e:
+            raise JobError(f"Invalid workflow: {e}")
+    if pruned:
+        logger.info(f"Pruned {len(pruned)} nodes no output depends on: {pruned}")
+
+    return workflow
+
+
+def quality_tier(job_input: dict[str, Any]) -> str:
+    """
+    Get a job's quality tier.
+
+    Raises:
+        JobError: If the tier is unknown
+    """
+    tier = job_input.get("quality", DEFAULT_QUALITY)
+    if tier not in QUALITY_TIERS:
+        raise JobError(f"Unknown quality '{tier}', expected one of {', '.join(QUALITY_TIERS)}")
+    return tier
+
+
+def vram_budget() -> int:
+    """Usable VRAM in bytes for admission, or 0 if ComfyUI doesn't report it."""
+    global vram_budget_bytes
+    if not vram_budget_bytes:
+        try:
+            devices = comfy_client.get_system_stats().get("devices", [])
+        except ComfyAPIError as e:
+            logger.warning(f"Can't read VRAM for admission: {e}")
+            return 0
+        total = max((device.get("vram_total", 0) for device in devices), default=0)
+        vram_budget_bytes = int(total * ADMISSION_VRAM_FRACTION)
+    return vram_budget_bytes
+
+
+def admit_workflow(workflow: dict[str, Any], job_input: dict[str, Any]) -> dict[str, Any]:
+    """
+    Check a final workflow's estimated cost against the VRAM budget.
+
+    Renders that don't fit, going by recorded out-of-memory failures, are
+    rejected, or with the "downscale" policy rendered at the largest size
+    that fits. The estimate is added to the job's metrics.
+
+    Returns:
+        The workflow, or a downscaled copy
+
+    Raises:
+        JobError: If the render won't fit and isn't downscaled
+    """
+    policy = job_input.get("admission", ADMISSION_POLICY)
+    if cost_model is None or policy == "off":
+        return workflow
+    shape = workflow_shape(workflow)
+    budget = vram_budget() if shape else 0
+    if not budget:
+        return workflow
+
+    with stage("admission"):
+        decision = cost_model.decide(workflow_family(workflow), shape, budget, policy)
+    estimate = decision["estimate"]
+    size = f"{shape['width']}x{shape['height']}x{shape['frames']}"
+
+    if decision["action"] == "reject":
+        raise JobError(
+            f"Render {size} needs an estimated {estimate['vram_bytes'] / 1024 ** 3:.1f} GiB of VRAM, "
+            f"over the {budget / 1024 ** 3:.1f} GiB available; lower the resolution or frame count"
+        )
+    if decision["action"] == "admit" and estimate["vram_bytes"] > budget:
+        logger.info(
+            f"Admitting {size} estimated at {estimate['vram_bytes'] / 1024 ** 3:.1f} GiB of VRAM; "
+            f"no out-of-memory failure on record to go by"
+        )
+    if decision["action"] == "downscale":
+        logger.info(f"Downscaling {size} to {decision['width']}x{decision['height']} to fit in VRAM")
+        workflow = clone_workflow(workflow)
+        apply_shape(workflow, shape, decision["width"], decision["height"])
+        estimate = {**estimate, "downscaled_to": [decision["width"], decision["height"]]}
+
+    record_estimate(estimate)
+    return workflow
+
+
+def observe_render_cost(workflow: dict[str, Any] | None, seconds: float | None, error: str | None = None) -> None:
+    """Feed a finished or out-of-memory render back into the cost model."""
+    if cost_model is None or workflow is None:
+        return
+    shape = workflow_shape(workflow)
+    if shape is None:
+        return
+    if error is None:
+        cost_model.observe(workflow_family(workflow), shape, seconds, vram_budget_bytes)
+    elif is_oom_error(error) and vram_budget_bytes:
+        logger.warning(f"Render ran out of VRAM, recalibrating admission for {shape['width']}x{shape['height']}")
+        cost_model.observe_oom(workflow_family(workflow), shape, vram_budget_bytes)
+
+
+def workflow_group(workflow: dict[str, Any]) -> str | None:
+    """Scheduling group of a workflow: the key of its model set."""
+    return model_set_key(model_set(workflow))
+
+
+def render_ticket(workflow: dict[str, Any], label: str = "") -> Ticket:
+    """A scheduler ticket for a workflow: its estimated seconds and group."""
+    cost = 0.0
+    shape = workflow_shape(workflow) if cost_model is not None else None
+    if shape is not None:
+        cost = cost_model.estimate(workflow_family(workflow), shape)["seconds"]
+    return Ticket(cost, workflow_group(workflow), label)
+
+
+def find_cached_result(
+    workflow: dict[str, Any],
+    job_input: dict[str, Any]
+) -> tuple[str | None, dict[str, Any] | None]:
+    """
+    Look up a final workflow in the result cache.
+
+    The files of a hit are this job's own links to the cached ones; they
+    go into the output index so release_outputs deletes them once
+    delivered. A hit with a file missing is treated as a miss.
+
+    Returns:
+        Tuple of (cache key, cached result); the key is None when both
+        caching and coalescing are disabled, the result is None on a miss,
+        without a result cache or with "cache": false
+    """
+    if result_cache is None and not COALESCE_JOBS:
+        return None, None
+    with stage("cache_lookup"):
+        cache_key = result_key(workflow, input_file_hashes(workflow))
+        cached = None
+        if result_cache is not None and job_input.get("cache", True):
+            cached = result_cache.get(cache_key)
+        if cached:
+            index_outputs(cached["outputs"])
+            missing = [output["filename"] for output in cached["outputs"] if not output_file_path(output).exists()]
+            if missing:
+                logger.warning(f"Cached result {cache_key[:16]} is missing {missing}, rendering again")
+                release_outputs(cached["outputs"])
+                cached = None
+    return cache_key, cached
+
+
+def join_inflight(cache_key: str | None, job_input: dict[str, Any]) -> tuple[Flight | None, bool]:
+    """
+    Join the render of an identical job still in progress.
+
+    Returns:
+        Tuple of (flight, whether this job renders); a job that renders
+        must pass its flight to finish_inflight or fail_inflight. The
+        flight is None when coalescing doesn't apply.
+    """
+    if cache_key is None or not COALESCE_JOBS or not job_input.get("cache", True):
+        return None, True
+    flight, owner = inflight.join(cache_key)
+    if not owner:
+        logger.info(f"Joining in-flight render {cache_key[:16]}")
+    return flight, owner
+
+
+def await_inflight(flight: Flight, timeout: float) -> tuple[str, list[dict]]:
+    """
+    Wait for a joined render.
+
+    Returns:
+        Tuple of (prompt_id, output file info dicts)
+
+    Raises:
+        ComfyAPIError: If it doesn't finish within timeout, or the error
+            the rendering job failed with
+    """
+    with stage("coalesced_wait"):
+        try:
+            return flight.wait(timeout)
+        except FutureTimeoutError:
+            raise ComfyAPIError(f"Timeout after {timeout}s waiting for an identical render")
+
+
+def finish_inflight(cache_key: str, flight: Flight | None, prompt_id: str, output_files: list[dict]) -> None:
+    """Hand a finished render to the jobs that joined it."""
+    if flight is not None:
+        inflight.finish(
+            cache_key, flight, prompt_id, output_files,
+            retain=lambda followers: retain_outputs(output_files, followers)
+        )
+
+
+def fail_inflight(cache_key: str, flight: Flight | None, error: BaseException) -> None:
+    """Fail the jobs that joined a render with its error."""
+    if flight is not None:
+        if not isinstance(error, Exception):
+            # Cancellation of the rendering job is not the followers' own
+            error = ComfyAPIError("The identical render this job joined was cancelled")
+        inflight.fail(cache_key, flight, error)
+
+
+def queue_workflow(workflow: dict[str, Any]) -> tuple[str, float]:
+    """
+    Queue a workflow with ComfyUI.
+
+    Returns:
+        Tuple of (prompt_id, wall-clock time it was queued at)
+    """
+    queued_at = time.time()
+    with stage("queue"):
+        prompt_id = comfy_client.queue_prompt(workflow)
+    if model_residency.queued(workflow_group(workflow)):
+        logger.info(f"Prompt {prompt_id} swaps the loaded models")
+    return prompt_id, queued_at
+
+
+def await_outputs(
+    prompt_id: str,
+    timeout: float,
+    progress_callback=None,
+    queued_at: float | None = None,
+    workflow: dict[str, Any] | None = None,
+    preview_callback=None,
+    should_abort=None
+) -> list[dict]:
+    """
+    Wait for a queued prompt and return its output file info dicts.
+
+    Records the wait_to_start and execution stages from the execution
+    timestamps ComfyUI writes to the history entry; if they're missing the
+    whole wait counts as execution. Per-node timings from the event
+    stream are added to the job's metrics, labelled from workflow.
+    Outputs of preview nodes were delivered as previews and are deleted
+    rather than returned. If the wait times out or should_abort returns
+    True, the prompt is cancelled before the error is raised.
+
+    Raises:
+        JobError: If the workflow finished without outputs
+        ComfyAPIError: If it failed, timed out or was aborted
+    """
+    wait_started = time.time()
+    profile = ExecutionProfile(workflow)
+    try:
+        history = comfy_client.wait_for_completion(
+            prompt_id,
+            timeout=timeout,
+            progress_callback=progress_callback,
+            profile=profile,
+            preview_callback=preview_callback,
+            should_abort=should_abort
+        )
+    except ComfyAPIError as e:
+        observe_render_cost(workflow, None, str(e))
+        cancel_render(prompt_id)
+        raise
+    record_nodes(profile.summary())
+
+    timestamps = execution_timestamps(history)
+    if timestamps and queued_at is not None:
+        started, finished = timestamps
+        # ComfyUI timestamps have millisecond resolution
+        record_stage("wait_to_start", max(0.0, started - queued_at))
+        execution = finished - started
+    else:
+        execution = time.time() - wait_started
+    record_stage("execution", execution)
+    observe_render_cost(workflow, execution)
+
+    output_files = extract_output_files(history)
+    previews = [output for output in output_files if is_preview_node(output["node_id"])]
+    if previews:
+        index_outputs(previews)
+        release_outputs(previews)
+        output_files = [output for output in output_files if not is_preview_node(output["node_id"])]
+    if not output_files:
+        raise JobError("Workflow completed but no outputs found")
+
+    index_outputs(output_files)
+    return output_files
+
+
+def cancel_render(prompt_id: str) -> None:
+    """
+    Take a prompt its job gave up on out of ComfyUI.
+
+    Blocks until ComfyUI has let go of it, so the worker doesn't take its
+    next job while the GPU is still busy with this one. Does nothing for
+    prompts that already finished; failures are only logged, as the job
+    is failing anyway.
+    """
+    started = time.perf_counter()
+    try:
+        with stage("cancel"):
+            outcome = comfy_client.cancel_prompt(prompt_id, timeout=CANCEL_TIMEOUT)
+    except ComfyAPIError as e:
+        logger.error(f"Could not cancel prompt {prompt_id}: {e}")
+        return
+    if outcome != "finished":
+        logger.info(f"Prompt {prompt_id} {outcome}, ComfyUI free after {time.perf_counter() - started:.2f}s")
+
+
+def is_batch(job_input: dict[str, Any]) -> bool:
+    """Check whether a job input describes a batch of variants."""
+    return any(key in job_input for key in BATCH_KEYS)
+
+
+def expand_variants(job_input: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Expand a batch input into per-item overrides.
+
+    "variants" is a list of override dicts and "grid" a dict of value
+    lists whose cartesian product is taken; with both, every variant is
+    combined with every grid point. "sweep" is a grid over SWEEP_KEYS
+    only, expanded in SWEEP_KEYS order (all seeds of one resolution of a
+    prompt, then the next resolution, then the next prompt) within each
+    variant and outside the grid. Each level runs back and forth, so
+    consecutive sweep points differ in one parameter: the next
+    resolution starts at the seed the last one ended on.
+
+    Raises:
+        JobError: If the batch is malformed or larger than BATCH_MAX_ITEMS
+    """
+    variants = job_input.get("variants") or [{}]
+    grid = job_input.get("grid") or {}
+    sweep = job_input.get("sweep") or {}
+
+    if not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants):
+        raise JobError("'variants' must be a list of objects")
+    if not isinstance(grid, dict) or not all(isinstance(v, list) and v for v in grid.values()):
+        raise JobError("'grid' must map parameter names to non-empty lists")
+    if not isinstance(sweep, dict) or not all(isinstance(v, list) and v for v in sweep.values()):
+        raise JobError("'sweep' must map parameter names to non-empty lists")
+    unknown = [key for key in sweep if key not in SWEEP_KEYS]
+    if unknown:
+        raise JobError(f"Can't sweep {', '.join(unknown)}; sweeps take {', '.join(SWEEP_KEYS)}")
+
+    sweep_keys = [key for key in SWEEP_KEYS if key in sweep]
+    sweep_points = [{}]
+    for key in sweep_keys:
+        sweep_points = [
+            {**point, key: value}
+            for index, point in enumerate(sweep_points)
+            for value in (sweep[key] if index % 2 == 0 else reversed(sweep[key]))
+        ]
+    points = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    items = [
+        {**variant, **sweep_point, **point}
+        for variant in variants
+        for sweep_point in sweep_points
+        for point in points
+    ]
+
+    if len(items) > BATCH_MAX_ITEMS:
+        raise JobError(f"Batch has {len(items)} items, the limit is {BATCH_MAX_ITEMS}")
+    return items
+
+
+def run_batch(
+    job: dict[str, Any],
+    enqueue: Callable[[dict[str, Any], str], tuple[str, float]] | None = None
+) -> Iterator[dict[str, Any]]:
+    """
+    Run every variant of a batch job, yielding each item as it finishes.
+
+    Each variant is merged over the shared job input and built into its
+    own workflow. Every item that isn't served from the result cache is
+    queued before waiting on any, so ComfyUI's queue never drains between
+    items, in the order the scheduler picks (shortest first, grouped by
+    model set) or, for a sweep, in expansion order; ComfyUI runs its
+    queue in order, so items are awaited (and yielded) in queue order. A
+    failing item doesn't stop the others. The nodes ComfyUI is expected
+    to reuse from the item before are added to the job's metrics.
+
+    Args:
+        job: Batch job
+        enqueue: Queues one item's workflow, given it and the item's
+            label; defaults to queue_workflow. The async handler passes
+            one that goes through queue_gate.
+
+    Yields:
+        {"index", "variant", "status", "prompt_id", "cached",
+         "output_files"} per item, or "error" instead of the last three
+         if the item failed
+
+    Raises:
+        JobError: If the batch is invalid or ComfyUI isn't available
+    """
+    job_input = job.get("input", {})
+    variants = expand_variants(job_input)
+    rendition_ladder(job_input)
+
+    if not comfy_client or not comfy_client.is_ready():
+        raise JobError("ComfyUI server not available")
+
+    saved_images = process_input_images(job_input)
+    try:
+        yield from _run_batch_items(job, variants, saved_images, enqueue)
+    finally:
+        release_input_images(saved_images)
+
+
+def _run_batch_items(
+    job: dict[str, Any],
+    variants: list[dict[str, Any]],
+    saved_images: dict[str, str],
+    enqueue: Callable[[dict[str, Any], str], tuple[str, float]] | None = None
+) -> Iterator[dict[str, Any]]:
+    enqueue = enqueue or (lambda workflow, label: queue_workflow(workflow))
+    base_input = {key: value for key, value in job.get("input", {}).items() if key not in BATCH_KEYS}
+    total = len(variants)
+    finished = 0
+
+    def done(item: dict[str, Any]) -> dict[str, Any]:
+        nonlocal finished
+        finished += 1
+        progress_update(job, 5 + int(90 * finished / total), f"Finished {finished}/{total} items")
+        return item
+
+    # Build everything first; cached and failed items are held back so
+    # yielding them doesn't delay queueing the rest
+    ready = []
+    renders = []
+    for index, variant in enumerate(variants):
+        item_input = {**base_input, **variant}
+        if "workflow" in item_input:
+            item_input["workflow"] = clone_workflow(item_input["workflow"])
+        item = {"index": index, "variant": variant}
+
+        try:
+            workflow = admit_workflow(build_workflow(item_input, saved_images), item_input)
+            cache_key, cached = find_cached_result(workflow, item_input)
+            if cached:
+                ready.append({**item, "status": "success", "prompt_id": cached["prompt_id"],
+                              "cached": True, "output_files": cached["outputs"]})
+                continue
+            # Duplicates (within the batch or of other jobs) join the
+            # render in progress; they have no prompt of their own
+            flight, owner = join_inflight(cache_key, item_input)
+        except (JobError, ComfyAPIError) as e:
+            ready.append({**item, "status": "error", "error": str(e)})
+            continue
+
+        renders.append((item, workflow, cache_key, item_input.get("timeout", 600), flight, owner))
+
+    owned = [entry for entry in renders if entry[5]]
+    avoided = 0
+    # A sweep keeps its expansion order so items sharing a prompt run back
+    # to back; shortest first would interleave prompts across resolutions
+    # and encode each prompt once per resolution
+    sweep = "sweep" in job.get("input", {})
+    if scheduler is not None and len(owned) > 1 and not sweep:
+        resident = model_residency.resident
+        tickets = {render_ticket(entry[1], str(entry[0]["index"])): entry for entry in owned}
+        ordered = scheduler.order(list(tickets), last_group=resident)
+        avoided = max(
+            count_swaps([ticket.group for ticket in tickets], resident)
+            - count_swaps([ticket.group for ticket in ordered], resident),
+            0
+        )
+        model_residency.record_avoided(avoided)
+        owned = [tickets[ticket] for ticket in ordered]
+
+    # Queue every render in scheduler order, then wait on them in the order
+    # ComfyUI runs them; items that joined a render wait after it
+    queued = []
+    collected = set()
+    try:
+        for item, workflow, cache_key, timeout, flight, _ in owned:
+            try:
+                prompt_id, queued_at = enqueue(workflow, f"{job.get('id', '')}/{item['index']}")
+            except (JobError, ComfyAPIError) as e:
+                fail_inflight(cache_key, flight, e)
+                ready.append({**item, "status": "error", "error": str(e)})
+                continue
+            queued.append((item, workflow, prompt_id, queued_at, cache_key, timeout, flight))
+        queued.extend(
+            (item, workflow, None, None, cache_key, timeout, flight)
+            for item, workflow, cache_key, timeout, flight, owner in renders if not owner
+        )
+
+        joined = len(renders) - len(owned)
+        rendered = [workflow for _, workflow, prompt_id, *_ in queued if prompt_id is not None]
+        reused = sum(len(nodes) for nodes in cache_reuse(rendered))
+        node_count = sum(len(workflow) for workflow in rendered)
+        expect_reuse(reused, node_count)
+        logger.info(
+            f"Batch: queued {len(queued) - joined} of {total} items "
+            f"({joined} joined identical renders, {total - len(renders)} cached or invalid), "
+            f"{avoided} model swaps avoided, {reused}/{node_count} nodes expected from ComfyUI's cache"
+        )
+
+        for item in ready:
+            yield done(item)
+
+        for item, workflow, prompt_id, queued_at, cache_key, timeout, flight in queued:
+            try:
+                if prompt_id is None:
+                    prompt_id, output_files = await_inflight(flight, timeout)
+                else:
+                    try:
+                        output_files = await_outputs(prompt_id, timeout, queued_at=queued_at, workflow=workflow)
+                    except BaseException as e:
+                        fail_inflight(cache_key, flight, e)
+                        raise
+                    finish_inflight(cache_key, flight, prompt_id, output_files)
+                    if cache_key and result_cache is not None:
+                        store_result(cache_key, prompt_id, output_files)
+            except (JobError, ComfyAPIError) as e:
+                collected.add(prompt_id)
+                yield done({**item, "status": "error", "prompt_id": prompt_id, "error": str(e)})
+                continue
+
+            collected.add(prompt_id)
+            yield done({**item, "status": "success", "prompt_id": prompt_id,
+                        "cached": False, "output_files": output_files})
+    finally:
+        # An abandoned batch takes its remaining prompts out of ComfyUI,
+        # last first so none starts as the one ahead of it is cancelled
+        for _, _, prompt_id, *_ in reversed(queued):
+            if prompt_id is not None and prompt_id not in collected:
+                cancel_render(prompt_id)
+        # Don't leave jobs that joined an abandoned batch waiting
+        for _, _, cache_key, _, flight, _ in owned:
+            fail_inflight(cache_key, flight, JobError("Batch ended before the render was collected"))
+
+
+def batch_status(items: list[dict[str, Any]]) -> str:
+    """Overall status of a batch: success, partial or error."""
+    succeeded = sum(item["status"] == "success" for item in items)
+    if succeeded == len(items):
+        return "success"
+    return "partial" if succeeded else "error"
+
+
 def handler(job: dict[str, Any]) -> dict[str, Any]:
     """
     Main serverless handler for ComfyUI workflow execution.
@@ -343,6 +1689,60 @@ def handler(job: dict[str, Any]) -> dict[str, Any]:
                     "input_image": "base64_encoded_image..."
                 }
             }
+            Image values may also be URLs (https://..., s3://bucket/key,
+            file:///runpod-volume/...); keys match the filename a
+            LoadImage/LoadVideo node references.
+
+        5. Batch of variants (any of the above plus "variants"/"grid"):
+            {
+                "template": "t2v",
+                "resolution": "720p",
+                "variants": [  # Overrides merged over the shared input
+                    {"prompt": "A red sneaker on a beach"},
+                    {"prompt": "A red sneaker in the snow"}
+                ],
+                "grid": {"seed": [1, 2, 3]}  # Cartesian product per variant
+            }
+            All items are queued to ComfyUI up front on this worker.
+            "sweep" takes lists of prompt, negative_prompt, resolution and
+            seed like "grid":
+                "sweep": {"prompt": ["A red sneaker", "A blue sneaker"],
+                          "resolution": ["480p", "720p"], "seed": [1, 2, 3]}
+            Items sharing a prompt are queued back to back, seeds
+            innermost, so ComfyUI encodes each prompt once and reuses
+            the rest of the graph upstream of the noise between seeds.
+
+        6. With renditions of each video output (any of the above):
+            {
+                "template": "t2v",
+                "prompt": "A red sneaker on a beach",
+                "renditions": ["1080p", {"name": "720p", "video_bitrate": "2M"},
+                               "480p", "poster", "preview"]
+            }
+            Presets: 1080p, 720p, 480p (H.264 MP4), poster (JPEG),
+            preview (animated GIF, or "format": "webp"). Renditions are
+            returned after the outputs with rendition and source set.
+
+        7. With previews while rendering (any of the above but batches):
+            {
+                "template": "t2v",
+                "prompt": "A red sneaker on a beach",
+                "previews": true
+            }
+            Progress updates carry a "preview" (kind "latent" for a
+            sampler preview, "first_pass" for the low-res first pass of
+            a multi-pass workflow; mime and base64 data or url).
+
+        8. With a quality tier (template mode):
+            {
+                "template": "t2v",
+                "prompt": "A red sneaker on a beach",
+                "resolution": "720p",
+                "quality": "draft"  # draft, standard (default) or final
+            }
+            Draft renders fewer steps at half the size with at most 49
+            frames (t2v skips its upscale pass) for a quick look; final
+            renders more steps.
 
         Available resolution presets:
             - 480p (854x480), 720p (1280x720), 1080p (1920x1080)
@@ -353,102 +1753,248 @@ def handler(job: dict[str, Any]) -> dict[str, Any]:
         {
             "status": "success" | "error",
             "outputs": [...],  # Base64 encoded outputs
+            "cached": false,  # True if served from the result cache
             "error": "..."  # If status is error
         }
+        Batches return {"status": "success" | "partial" | "error",
+        "items": [...]} with one entry per variant, each carrying index,
+        variant, status and either prompt_id/outputs/cached or error.
+
+        Every result also carries a metrics record:
+            "metrics": {
+                "stages": {"input_decode": 0.01, "queue": 0.002, ...},
+                "total_seconds": 41.3,
+                "worker": {"comfyui_boot": 38.2, "first_ready": 39.0, ...},
+                # Nodes ComfyUI ran or served from its cache; batches add
+                # the share they were expected to reuse
+                "node_reuse": {"cached": 12, "run": 30, "rate": 0.2857,
+                               "expected_rate": 0.2857}
+            }
     """
+    timer = start_job_timer()
+    return finish_job_metrics(timer, _handle_job(job))
+
+
+def _handle_job(
+    job: dict[str, Any],
+    enqueue: Callable[[dict[str, Any], str], tuple[str, float]] | None = None
+) -> dict[str, Any]:
     job_id = job.get("id", "unknown")
-    job_input = job.get("input", {})
 
     logger.info(f"Processing job: {job_id}")
 
     try:
-        # Validate ComfyUI is running
-        if not comfy_client or not comfy_client.is_ready():
-            return {"status": "error", "error": "ComfyUI server not available"}
-
-        # Process input images
-        saved_images = process_input_images(job_input)
-
-        # Get or load workflow
-        workflow = None
-
-        if "workflow" in job_input:
-            # Direct workflow mode
-            workflow = job_input["workflow"]
-            logger.info("Using direct workflow from input")
-
-        elif "template" in job_input:
-            # Template mode
-            template_name = job_input["template"]
-            if template_name not in WORKFLOW_TEMPLATES:
-                return {
-                    "status": "error",
-                    "error": f"Unknown template: {template_name}. Available: {list(WORKFLOW_TEMPLATES.keys())}"
-                }
+        if is_batch(job.get("input", {})):
+            items = []
+            for item in run_batch(job, enqueue):
+                if item["status"] == "success":
+                    output_files = add_renditions(job, item.pop("output_files"), item["index"])
+                    item["outputs"] = collect_outputs(
+                        output_files,
+                        storage=output_storage,
+                        key_prefix=f"{job_id}/{item['index']}/"
+                    )
+                    release_outputs(output_files)
+                items.append(item)
+            items.sort(key=lambda item: item["index"])
+
+            progress_update(job, 100, "Complete")
+            logger.info(f"Job {job_id} completed a batch of {len(items)} items")
+            return {"status": batch_status(items), "items": items}
+
+        prompt_id, output_files, cached = run_workflow(job)
+        output_files = add_renditions(job, output_files)
+
+        outputs = collect_outputs(output_files, storage=output_storage, key_prefix=f"{job_id}/")
+        release_outputs(output_files)
+        progress_update(job, 100, "Complete")
 
-            workflow_path = Path(WORKFLOW_DIR) / WORKFLOW_TEMPLATES[template_name]
-            if not workflow_path.exists():
-                return {
-                    "status": "error",
-                    "error": f"Workflow file not found: {workflow_path}"
-                }
+        logger.info(f"Job {job_id} completed with {len(outputs)} outputs")
 
-            workflow = load_workflow(workflow_path)
-            logger.info(f"Loaded template: {template_name}")
+        return {
+            "status": "success",
+            "prompt_id": prompt_id,
+            "outputs": outputs,
+            "cached": cached,
+        }
 
-            # Apply simplified parameters (width, height, prompt, etc.)
-            workflow = apply_template_params(workflow, template_name, job_input)
+    except (JobError, StorageError) as e:
+        return {"status": "error", "error": str(e)}
 
-        else:
-            return {
-                "status": "error",
-                "error": "Must provide 'workflow' or 'template' in input"
+    except ComfyAPIError as e:
+        logger.error(f"ComfyUI error: {e}")
+        return {"status": "error", "error": str(e)}
+
+    except Exception as e:
+        logger.exception(f"Unexpected error: {e}")
+        return {"status": "error", "error": f"Internal error: {str(e)}"}
+
+
+def stream_handler(job: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    """
+    Streaming variant of handler, used when OUTPUT_MODE=stream.
+
+    Accepts the same input as handler. Instead of one response with every
+    output inlined, output files are read and yielded in OUTPUT_CHUNK_SIZE
+    pieces, so memory stays bounded by the chunk size regardless of video
+    size. With return_aggregate_stream, /runsync still returns every message.
+
+    For batches, each item's chunks (tagged with "item") are followed by an
+    {"type": "item", ...} summary as soon as that item finishes, and the
+    final result carries the batch status and item count.
+
+    With previews on, they are yielded while the workflow renders, ahead
+    of the chunks, as {"type": "preview", "progress", "message", "kind",
+    "node_id", "mime", "data" or "url"} (see handler).
+
+    Yields:
+        One message per chunk:
+            {
+                "type": "chunk",
+                "output_index": 0,  # Position in the final outputs list
+                "filename": "LTX-2_00001_.mp4",
+                "seq": 0,  # Chunk sequence number within the file
+                "offset": 0,  # Byte offset of the chunk within the file
+                "data": "...",  # Base64 encoded chunk bytes
+                "sha256": "..."  # Checksum of the raw chunk bytes
             }
+        Then a final summary:
+            {
+                "type": "result",
+                "status": "success" | "error",
+                "prompt_id": "...",
+                "outputs": [{"type", "filename", "size_bytes", "sha256", "chunks"}],
+                "cached": false,
+                "metrics": {...},  # See handler
+                "error": "..."  # If status is error
+            }
+    """
+    timer = start_job_timer()
+    for message in _stream_job(job):
+        if message["type"] == "result":
+            finish_job_metrics(timer, message)
+        yield message
 
-        # Inject custom parameters
-        params = job_input.get("params", {})
-        if params:
-            workflow = inject_params(workflow, params)
-            logger.info(f"Injected params for nodes: {list(params.keys())}")
 
-        # Inject saved input images into workflow
-        for name, filename in saved_images.items():
-            # Update LoadImage nodes that reference this input
-            for node_id, node in workflow.items():
-                if node.get("class_type") == "LoadImage":
-                    if node.get("inputs", {}).get("image") == name:
-                        node["inputs"]["image"] = filename
+def _stream_job(job: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    job_id = job.get("id", "unknown")
 
-        # Queue the workflow
-        progress_update(job, 5, "Queuing workflow...")
-        prompt_id = comfy_client.queue_prompt(workflow)
+    logger.info(f"Processing job (streaming): {job_id}")
 
-        # Wait for completion with progress updates
-        timeout = job_input.get("timeout", 600)
+    try:
+        if is_batch(job.get("input", {})):
+            items = []
+            for item in run_batch(job):
+                if item["status"] == "success":
+                    output_files = add_renditions(job, item.pop("output_files"), item["index"])
+                    item["outputs"] = yield from stream_outputs(output_files, item=item["index"])
+                    release_outputs(output_files)
+                items.append(item)
+                yield {"type": "item", **item}
+
+            progress_update(job, 100, "Complete")
+            logger.info(f"Job {job_id} streamed a batch of {len(items)} items")
+            yield {"type": "result", "status": batch_status(items), "items": len(items)}
+            return
+
+        prompt_id, output_files, cached = yield from stream_render(job)
+        output_files = add_renditions(job, output_files)
+        outputs = yield from stream_outputs(output_files)
+        release_outputs(output_files)
 
-        def on_progress(progress: int, message: str):
-            # Map to 10-90% range (5% for queue, 95-100% for output)
-            scaled = 10 + int(progress * 0.8)
-            progress_update(job, scaled, message)
+        progress_update(job, 100, "Complete")
+        logger.info(f"Job {job_id} streamed {len(outputs)} outputs")
 
-        progress_update(job, 10, "Executing workflow...")
-        history = comfy_client.wait_for_completion(
-            prompt_id,
-            timeout=timeout,
-            progress_callback=on_progress
-        )
+        yield {
+            "type": "result",
+            "status": "success",
+            "prompt_id": prompt_id,
+            "outputs": outputs,
+            "cached": cached,
+        }
 
-        # Extract and encode outputs
-        progress_update(job, 95, "Collecting outputs...")
-        output_files = extract_output_files(history)
+    except JobError as e:
+        yield {"type": "result", "status": "error", "error": str(e)}
+
+    except ComfyAPIError as e:
+        logger.error(f"ComfyUI error: {e}")
+        yield {"type": "result", "status": "error", "error": str(e)}
+
+    except Exception as e:
+        logger.exception(f"Unexpected error: {e}")
+        yield {"type": "result", "status": "error", "error": f"Internal error: {str(e)}"}
+
+
+async def async_handler(job: dict[str, Any]) -> dict[str, Any]:
+    """
+    Asyncio variant of handler, used when JOB_CONCURRENCY > 1.
+
+    Accepts the same input and returns the same result as handler. The
+    blocking stages run in worker threads so several jobs can be in flight
+    at once: while one job renders, the next one's inputs are fetched and
+    the previous one's outputs are encoded or uploaded. Prompts pass
+    through queue_gate, so ComfyUI's queue never holds more than
+    COMFY_MAX_QUEUE_DEPTH of them.
+    """
+    timer = start_job_timer()
+    return finish_job_metrics(timer, await _handle_job_async(job))
 
-        if not output_files:
-            return {
-                "status": "error",
-                "error": "Workflow completed but no outputs found"
-            }
 
-        outputs = collect_outputs(output_files)
+def gated_enqueue(
+    loop: asyncio.AbstractEventLoop
+) -> Callable[[dict[str, Any], str], tuple[str, float]]:
+    """
+    Build an enqueue for run_batch that queues through queue_gate.
+
+    The returned function runs on a worker thread: it holds the gate on
+    loop while queueing, so a batch item waits for room in ComfyUI's
+    queue and for its scheduler turn like a single job does.
+    """
+    def enqueue(workflow: dict[str, Any], label: str) -> tuple[str, float]:
+        gate_entered = time.perf_counter()
+        asyncio.run_coroutine_threadsafe(
+            queue_gate.acquire(render_ticket(workflow, label)), loop
+        ).result()
+        record_stage("queue_gate", time.perf_counter() - gate_entered)
+        try:
+            return queue_workflow(workflow)
+        finally:
+            asyncio.run_coroutine_threadsafe(queue_gate.release(), loop).result()
+
+    return enqueue
+
+
+async def _handle_job_async(job: dict[str, Any]) -> dict[str, Any]:
+    job_id = job.get("id", "unknown")
+    job_input = job.get("input", {})
+
+    logger.info(f"Processing job (async): {job_id}")
+
+    if is_batch(job_input):
+        # Batches keep ComfyUI's queue full on their own, but each item
+        # still takes its turn at the gate so COMFY_MAX_QUEUE_DEPTH holds
+        # and concurrent jobs aren't queued behind the whole batch
+        enqueue = gated_enqueue(asyncio.get_running_loop()) if queue_gate else None
+        return await asyncio.to_thread(_handle_job, job, enqueue)
+
+    try:
+        rendition_ladder(job_input)
+        if not comfy_client or not await asyncio.to_thread(comfy_client.is_ready):
+            raise JobError("ComfyUI server not available")
+
+        # Ingest
+        saved_images = await asyncio.to_thread(process_input_images, job_input)
+        try:
+            prompt_id, output_files, cached = await _render_async(job, saved_images)
+        finally:
+            release_input_images(saved_images)
+
+        # Deliver
+        output_files = await asyncio.to_thread(add_renditions, job, output_files)
+        outputs = await asyncio.to_thread(
+            collect_outputs, output_files, output_storage, f"{job_id}/"
+        )
+        await asyncio.to_thread(release_outputs, output_files)
         progress_update(job, 100, "Complete")
 
         logger.info(f"Job {job_id} completed with {len(outputs)} outputs")
@@ -457,8 +2003,12 @@ def handler(job: dict[str, Any]) -> dict[str, Any]:
             "status": "success",
             "prompt_id": prompt_id,
             "outputs": outputs,
+            "cached": cached,
         }
 
+    except (JobError, StorageError) as e:
+        return {"status": "error", "error": str(e)}
+
     except ComfyAPIError as e:
         logger.error(f"ComfyUI error: {e}")
         return {"status": "error", "error": str(e)}
@@ -468,42 +2018,264 @@ def handler(job: dict[str, Any]) -> dict[str, Any]:
         return {"status": "error", "error": f"Internal error: {str(e)}"}
 
 
-def cleanup_old_outputs(max_age_hours: int = 24) -> None:
-    """Clean up old output files to prevent disk space issues."""
-    output_dir = Path(COMFY_OUTPUT_DIR)
-    if not output_dir.exists():
-        return
+async def _render_async(job: dict[str, Any], saved_images: dict[str, str]) -> tuple[str, list[dict], bool]:
+    """Async counterpart of _execute_workflow, queueing through queue_gate."""
+    job_input = job.get("input", {})
+    workflow = await asyncio.to_thread(build_workflow, job_input, saved_images)
+    workflow = await asyncio.to_thread(admit_workflow, workflow, job_input)
+
+    cache_key, cached = await asyncio.to_thread(find_cached_result, workflow, job_input)
+    if cached:
+        logger.info(f"Result cache hit {cache_key[:16]} (prompt {cached['prompt_id']})")
+        return cached["prompt_id"], cached["outputs"], True
+
+    timeout = job_input.get("timeout", 600)
+
+    flight, owner = join_inflight(cache_key, job_input)
+    if not owner:
+        progress_update(job, 10, "Joining an identical render in progress...")
+        prompt_id, output_files = await asyncio.to_thread(await_inflight, flight, timeout)
+        progress_update(job, 95, "Collecting outputs...")
+        return prompt_id, output_files, False
 
-    cutoff = time.time() - (max_age_hours * 3600)
-    cleaned = 0
+    on_preview = preview_relay(job)
+    if on_preview is not None:
+        workflow, _ = add_preview_branch(workflow)
 
-    for filepath in output_dir.glob("**/*"):
-        if filepath.is_file() and filepath.stat().st_mtime < cutoff:
+    try:
+        progress_update(job, 5, "Waiting for a ComfyUI queue slot...")
+        gate_entered = time.perf_counter()
+        async with queue_gate.turn(render_ticket(workflow, job.get("id", ""))):
+            record_stage("queue_gate", time.perf_counter() - gate_entered)
+            queueing = asyncio.ensure_future(asyncio.to_thread(queue_workflow, workflow))
             try:
-                filepath.unlink()
-                cleaned += 1
-            except Exception as e:
-                logger.warning(f"Failed to delete {filepath}: {e}")
+                prompt_id, queued_at = await asyncio.shield(queueing)
+            except asyncio.CancelledError:
+                # The POST goes through regardless; take the prompt back
+                # out rather than leave it rendering for nobody
+                with suppress(Exception):
+                    prompt_id, _ = await queueing
+                    await asyncio.to_thread(cancel_render, prompt_id)
+                raise
 
-    if cleaned:
-        logger.info(f"Cleaned up {cleaned} old output files")
+        def on_progress(progress: int, message: str):
+            progress_update(job, 10 + int(progress * 0.8), message)
+
+        progress_update(job, 10, "Executing workflow...")
+        cancelled = threading.Event()
+        render = asyncio.ensure_future(asyncio.to_thread(
+            await_outputs, prompt_id, timeout, on_progress, queued_at, workflow, on_preview, cancelled.is_set
+        ))
+        try:
+            output_files = await asyncio.shield(render)
+        except asyncio.CancelledError:
+            # The wait notices within a second and cancels the prompt; the
+            # job only ends once ComfyUI is free for the next one
+            cancelled.set()
+            with suppress(Exception):
+                await render
+            raise
+    except BaseException as e:
+        fail_inflight(cache_key, flight, e)
+        raise
+    finish_inflight(cache_key, flight, prompt_id, output_files)
+    progress_update(job, 95, "Collecting outputs...")
+
+    if cache_key and result_cache is not None:
+        await asyncio.to_thread(store_result, cache_key, prompt_id, output_files)
+
+    return prompt_id, output_files, False
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Tell RunPod how many jobs this worker takes at once."""
+    return JOB_CONCURRENCY
+
+
+def stream_render(job: dict[str, Any]) -> Generator[dict, None, tuple[str, list[dict], bool]]:
+    """
+    Run a job's workflow, yielding its previews as they arrive.
+
+    The render runs in a worker thread (in this job's context, so its
+    stages are timed) while the generator relays previews; returns what
+    run_workflow returns. If the generator is closed early (the job was
+    cancelled), the prompt is cancelled and closing waits until ComfyUI
+    has let go of it.
+    """
+    previews = queue.Queue()
+    cancelled = threading.Event()
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="render") as pool:
+        render = pool.submit(context.run, run_workflow, job, previews.put, cancelled.is_set)
+        try:
+            while not (render.done() and previews.empty()):
+                try:
+                    yield previews.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+        except GeneratorExit:
+            cancelled.set()
+            raise
+        return render.result()
+
+
+def stream_outputs(output_files: list[dict], item: int | None = None) -> Generator[dict, None, list[dict]]:
+    """
+    Yield chunk messages for each output file.
+
+    Args:
+        output_files: List of output file info dicts
+        item: Batch item index to tag chunks with
+
+    Returns:
+        Per-output summaries (type, filename, size_bytes, sha256, chunks)
+    """
+    outputs = []
+    for output in output_files:
+        if "error" in output:
+            outputs.append(output_summary(output))
+            continue
+        filepath = resolve_output_path(output)
+        if filepath is None:
+            continue
+
+        output_index = len(outputs)
+        file_digest = hashlib.sha256()
+        size = 0
+        seq = 0
+        for seq, chunk in enumerate(iter_file_chunks(filepath, OUTPUT_CHUNK_SIZE)):
+            file_digest.update(chunk)
+            message = {
+                "type": "chunk",
+                "output_index": output_index,
+                "filename": filepath.name,
+                "seq": seq,
+                "offset": size,
+            }
+            with stage("encoding"):
+                message["data"] = base64.b64encode(chunk).decode("utf-8")
+                message["sha256"] = hashlib.sha256(chunk).hexdigest()
+            if item is not None:
+                message["item"] = item
+            yield message
+            size += len(chunk)
+
+        outputs.append({
+            **output_summary(output, filepath),
+            "size_bytes": size,
+            "sha256": file_digest.hexdigest(),
+            "chunks": seq + 1 if size else 0,
+        })
+
+    return outputs
+
+
+def preload_templates() -> None:
+    """
+    Parse and compile all workflow templates before the first job.
+
+    Logs each template's model set, and any quality profile that names
+    nodes or inputs its template doesn't have.
+    """
+    for template_name, filename in WORKFLOW_TEMPLATES.items():
+        workflow_path = Path(WORKFLOW_DIR) / filename
+        try:
+            models = get_template_plan(template_name, workflow_path).models
+            logger.info(f"Template {template_name} loads {models['models']} with LoRAs {models['loras']}")
+            workflow = template_cache.load(workflow_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not preload template {template_name}: {e}")
+            continue
+        for tier, profile in QUALITY_PROFILES.get(template_name, {}).items():
+            problems = check_profile(workflow, profile)
+            if problems:
+                logger.warning(f"Quality '{tier}' doesn't fit template {template_name}: {'; '.join(problems)}")
 
 
 # Initialize on cold start
 if __name__ == "__main__":
     logger.info("Initializing serverless worker...")
 
-    # Clean up old outputs
-    cleanup_old_outputs()
-
-    # Start ComfyUI
-    if not start_comfyui():
+    # Export metrics in local test server mode, or when asked to
+    if METRICS_PORT or "--rp_serve_api" in sys.argv:
+        serve_metrics(metrics_registry, port=int(METRICS_PORT or "9400"))
+
+    # ComfyUI takes longest to come up, so launch it first and prepare
+    # everything else while it boots
+    comfyui_launched = time.perf_counter()
+    with startup_stage("launch_comfyui"):
+        launch_comfyui()
+
+    # Parse workflow templates once, up front
+    with startup_stage("preload_templates"):
+        preload_templates()
+
+    with startup_stage("configure_storage"):
+        # Configure output uploads
+        if OUTPUT_MODE == "upload":
+            output_storage = storage_from_env()
+            if output_storage is None:
+                logger.error("OUTPUT_MODE=upload requires BUCKET_NAME, exiting")
+                sys.exit(1)
+
+        # Track outputs for removal after delivery and budgeted eviction
+        output_index = OutputIndex(
+            max_bytes=OUTPUT_MAX_BYTES,
+            max_age=OUTPUT_MAX_AGE_HOURS * 3600,
+            state_path=OUTPUT_INDEX_PATH or None
+        )
+        output_index.start()
+
+        # Render cost model for admission and scheduling, calibrated by
+        # earlier renders
+        if ADMISSION_POLICY != "off" or SCHEDULER_POLICY != "fifo":
+            cost_model = CostModel(ADMISSION_HISTORY)
+        try:
+            scheduler = Scheduler(SCHEDULER_POLICY, aging=SCHEDULER_AGING, group_bonus=SCHEDULER_GROUP_BONUS)
+        except SchedulerError as e:
+            logger.error(f"{e}, exiting")
+            sys.exit(1)
+
+        # Result cache for identical workflows
+        if RESULT_CACHE_DIR:
+            result_cache = ResultCache(
+                RESULT_CACHE_DIR,
+                max_bytes=RESULT_CACHE_MAX_BYTES,
+                shared=shared_store_from_url(RESULT_CACHE_SHARED) if RESULT_CACHE_SHARED else None,
+            )
+
+    # Wait for ComfyUI
+    with startup_stage("comfyui_ready"):
+        ready = wait_for_comfyui()
+    startup_timings["comfyui_boot"] = round(time.perf_counter() - comfyui_launched, 3)
+    if not ready:
         logger.error("Failed to start ComfyUI, exiting")
         sys.exit(1)
 
+    # Load models with warm-up renders; jobs queue behind them in ComfyUI
+    prewarm_ids = prewarm_templates(prewarm_template_names())
+    if prewarm_ids:
+        threading.Thread(target=await_prewarm, args=(prewarm_ids,), name="prewarm", daemon=True).start()
+
     # Start the serverless worker
-    logger.info("Starting RunPod serverless handler...")
-    runpod.serverless.start({
-        "handler": handler,
-        "return_aggregate_stream": True,
-    })
+    if OUTPUT_MODE == "stream":
+        job_handler = stream_handler
+    elif JOB_CONCURRENCY > 1:
+        job_handler = async_handler
+        queue_gate = QueueDepthGate(
+            comfy_client, max_depth=COMFY_MAX_QUEUE_DEPTH, scheduler=scheduler, residency=model_residency
+        )
+    else:
+        job_handler = handler
+
+    startup_timings["first_ready"] = round(time.perf_counter() - worker_started, 3)
+    log_startup_timings()
+
+    logger.info(
+        f"Starting RunPod serverless handler (output mode: {OUTPUT_MODE}, "
+        f"concurrency: {JOB_CONCURRENCY if job_handler is async_handler else 1})..."
+    )
+    config = {"handler": job_handler, "return_aggregate_stream": True}
+    if job_handler is async_handler:
+        config["concurrency_modifier"] = concurrency_modifier
+    runpod.serverless.start(config)
@@ -0,0 +1,493 @@
+"""
+Input Media Ingestion
+
+Writes job input media into ComfyUI's input directory. Inputs can be given
+as base64 strings (optionally data URIs) or as http(s)://, s3:// or file://
+URLs; either way the data is streamed to disk in fixed-size chunks, so peak
+memory doesn't grow with file size. Files are named by content hash, so
+names can't collide and identical inputs map to the same file.
+
+URL inputs are untrusted: http(s) fetches only go to the hosts in an
+allow list, or without one to hosts with public addresses (never
+ComfyUI's own API or a cloud metadata endpoint), and every input is cut
+off once it passes a byte limit.
+
+The input directory is managed as a content-addressed store: a file that's
+already present is reused rather than rewritten (so ComfyUI's node cache
+sees an unchanged LoadImage input), and least recently used files are
+evicted once the directory exceeds its byte budget.
+"""
+
+import os
+import base64
+import socket
+import hashlib
+import ipaddress
+import logging
+import mimetypes
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+from urllib.parse import urljoin, urlparse, unquote
+
+import requests
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover - only needed for s3:// inputs
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes read per chunk when streaming from URLs and files
+CHUNK_SIZE = 1024 * 1024
+
+# Base64 characters decoded per chunk; a multiple of 4 so each slice
+# decodes on its own
+BASE64_CHUNK_CHARS = 4 * 256 * 1024
+
+URL_SCHEMES = ("http://", "https://", "s3://", "file://")
+
+# Redirects followed per http(s) input, each checked like the first URL
+MAX_REDIRECTS = 5
+
+# Leading bytes of common media containers, checked in order
+MAGIC_EXTENSIONS = [
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (8, b"WEBP", ".webp"),
+    (4, b"ftyp", ".mp4"),
+    (0, b"\x1a\x45\xdf\xa3", ".webm"),
+    (8, b"WAVE", ".wav"),
+    (0, b"ID3", ".mp3"),
+    (0, b"fLaC", ".flac"),
+]
+
+# Used when neither the content nor the source hints at a type
+DEFAULT_EXTENSION = ".png"
+
+# Prefix of files the input store owns; anything else in the directory is
+# left alone
+STORE_PREFIX = "input_"
+
+
+class InputMediaError(Exception):
+    """Exception raised when an input can't be fetched or decoded."""
+    pass
+
+
+def sniff_extension(head: bytes) -> str | None:
+    """Guess a file extension from its first bytes."""
+    for offset, magic, extension in MAGIC_EXTENSIONS:
+        if head[offset:offset + len(magic)] == magic:
+            return extension
+    return None
+
+
+def is_url(source: str) -> bool:
+    """Check whether an input value is a URL rather than base64 data."""
+    return source.startswith(URL_SCHEMES)
+
+
+def iter_base64(data: str) -> Iterator[bytes]:
+    """Decode a base64 string (or data URI) slice by slice."""
+    if data.startswith("data:"):
+        data = data.partition(",")[2]
+    if "\n" in data:
+        # MIME-style line breaks would misalign the fixed-size slices
+        data = "".join(data.split())
+
+    try:
+        for start in range(0, len(data), BASE64_CHUNK_CHARS):
+            yield base64.b64decode(data[start:start + BASE64_CHUNK_CHARS], validate=True)
+    except ValueError as e:
+        raise InputMediaError(f"Invalid base64 data: {e}")
+
+
+def base64_source_key(data: str) -> str:
+    """Hash a base64 input as given, so a repeat can be found without decoding it."""
+    digest = hashlib.sha256()
+    for start in range(0, len(data), BASE64_CHUNK_CHARS):
+        digest.update(data[start:start + BASE64_CHUNK_CHARS].encode())
+    return digest.hexdigest()
+
+
+class InputStore:
+    """
+    Content-addressed files in one directory, evicted LRU under a byte budget.
+
+    Files in use by a job are pinned and never evicted; the budget can be
+    exceeded while everything over it is pinned.
+
+    Args:
+        directory: Directory holding the files (ComfyUI's input dir)
+        max_bytes: Byte budget, 0 for unbounded
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int = 0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._sources: dict[str, str] = {}
+        self._pins: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self) -> None:
+        """Adopt files left by a previous run, oldest first."""
+        if not self.directory.is_dir():
+            return
+        found = []
+        for path in self.directory.glob(f"{STORE_PREFIX}*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.total_bytes += size
+
+    def lookup_source(self, source_key: str) -> str | None:
+        """
+        Find the file a previously seen input was saved as.
+
+        Returns:
+            Pinned filename, or None if the input isn't stored
+        """
+        with self._lock:
+            filename = self._sources.get(source_key)
+            if filename is None or not self._present(filename):
+                return None
+            self._use(filename)
+            self.hits += 1
+            return filename
+
+    def commit(self, tmp_path: Path, filename: str, size: int, source_key: str | None = None) -> bool:
+        """
+        Move a fully written temp file into the store under its content name.
+
+        The temp file is discarded if the content is already stored.
+
+        Returns:
+            True if the file was already stored (a hit)
+        """
+        with self._lock:
+            hit = self._present(filename)
+            if hit:
+                tmp_path.unlink(missing_ok=True)
+                self.hits += 1
+            else:
+                os.replace(tmp_path, self.directory / filename)
+                self._entries[filename] = size
+                self.total_bytes += size
+                self.misses += 1
+            if source_key:
+                self._sources[source_key] = filename
+            self._use(filename)
+            self._evict()
+        return hit
+
+    def release(self, filenames: Iterable[str]) -> None:
+        """Unpin files once the job using them is done."""
+        with self._lock:
+            for filename in filenames:
+                count = self._pins.get(filename, 0) - 1
+                if count > 0:
+                    self._pins[filename] = count
+                else:
+                    self._pins.pop(filename, None)
+            self._evict()
+
+    def stats(self) -> dict[str, Any]:
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "files": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _present(self, filename: str) -> bool:
+        if filename not in self._entries:
+            return False
+        if (self.directory / filename).exists():
+            return True
+        # Removed behind our back
+        self._forget(filename)
+        return False
+
+    def _use(self, filename: str) -> None:
+        self._entries.move_to_end(filename)
+        self._pins[filename] = self._pins.get(filename, 0) + 1
+
+    def _forget(self, filename: str) -> None:
+        self.total_bytes -= self._entries.pop(filename, 0)
+        self._sources = {key: name for key, name in self._sources.items() if name != filename}
+
+    def _evict(self) -> None:
+        if self.max_bytes <= 0 or self.total_bytes <= self.max_bytes:
+            return
+        for filename in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if filename in self._pins:
+                continue
+            (self.directory / filename).unlink(missing_ok=True)
+            self._forget(filename)
+            self.evictions += 1
+            logger.info(f"Evicted input: {filename}")
+
+
+class MediaFetcher:
+    """
+    Streams input media into a directory under content-addressed names.
+
+    Each destination directory is managed by an InputStore. Filenames
+    returned by fetch and fetch_all are pinned in the store until passed to
+    release.
+
+    Args:
+        allowed_file_roots: Directories file:// inputs may be read from
+        timeout: Connect/read timeout for http(s) fetches
+        max_workers: Inputs fetched concurrently by fetch_all
+        cache_max_bytes: Byte budget per input directory, 0 for unbounded
+        allowed_hosts: Hosts http(s) inputs may be fetched from (".example.com"
+            also matches subdomains); None or empty allows any host with
+            only public addresses
+        max_input_bytes: Largest input accepted, 0 for unbounded
+    """
+
+    def __init__(
+        self,
+        allowed_file_roots: list[str | Path] | None = None,
+        timeout: float = 60,
+        max_workers: int = 8,
+        cache_max_bytes: int = 0,
+        allowed_hosts: list[str] | None = None,
+        max_input_bytes: int = 0
+    ):
+        self.allowed_file_roots = [Path(root).resolve() for root in (allowed_file_roots or [])]
+        self.allowed_hosts = [host.lower() for host in (allowed_hosts or [])]
+        self.max_input_bytes = max_input_bytes
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.cache_max_bytes = cache_max_bytes
+        self._session = requests.Session()
+        self._s3 = None
+        self._s3_lock = threading.Lock()
+        self._stores: dict[Path, InputStore] = {}
+        self._stores_lock = threading.Lock()
+
+    def store(self, dest_dir: str | Path) -> InputStore:
+        """Get the store managing a directory, creating it on first use."""
+        dest_dir = Path(dest_dir)
+        with self._stores_lock:
+            if dest_dir not in self._stores:
+                dest_dir.mkdir(parents=True, exist_ok=True)
+                self._stores[dest_dir] = InputStore(dest_dir, self.cache_max_bytes)
+            return self._stores[dest_dir]
+
+    def release(self, filenames: Iterable[str], dest_dir: str | Path) -> None:
+        """Unpin files returned by fetch/fetch_all."""
+        self.store(dest_dir).release(filenames)
+
+    def fetch_all(self, sources: dict[str, str], dest_dir: str | Path) -> dict[str, str]:
+        """
+        Fetch several inputs concurrently.
+
+        Args:
+            sources: Mapping of input name to base64 data or URL
+            dest_dir: Directory to write files to (ComfyUI's input dir)
+
+        Returns:
+            Mapping of input name to saved filename
+
+        Raises:
+            InputMediaError: If any input fails
+        """
+        sources = {name: source for name, source in sources.items() if source}
+        if not sources:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(sources))) as pool:
+            futures = {
+                name: pool.submit(self.fetch, source, dest_dir)
+                for name, source in sources.items()
+            }
+            saved = {}
+            error = None
+            for name, future in futures.items():
+                try:
+                    saved[name] = future.result()
+                except InputMediaError as e:
+                    error = error or InputMediaError(f"Input '{name}': {e}")
+
+        if error:
+            self.release(saved.values(), dest_dir)
+            raise error
+        return saved
+
+    def fetch(self, source: str, dest_dir: str | Path) -> str:
+        """
+        Stream one input to disk.
+
+        Base64 inputs seen before are found by a hash of the encoded string
+        and not decoded again.
+
+        Returns:
+            Saved filename (relative to dest_dir), pinned until released
+        """
+        store = self.store(dest_dir)
+        source_key = None
+
+        if is_url(source):
+            if source.startswith("s3://"):
+                chunks = self._iter_s3(source)
+            elif source.startswith("file://"):
+                chunks = self._iter_file(source)
+            else:
+                chunks = self._iter_http(source)
+            hint = Path(unquote(urlparse(source).path)).suffix.lower() or None
+        else:
+            source_key = base64_source_key(source)
+            filename = store.lookup_source(source_key)
+            if filename:
+                logger.info(f"Reused input: {filename}")
+                return filename
+            chunks = iter_base64(source)
+            hint = None
+            if source.startswith("data:"):
+                mime = source[5:].partition(";")[0]
+                hint = mimetypes.guess_extension(mime) if mime else None
+
+        return self._write(chunks, store, hint, source_key)
+
+    def _write(
+        self,
+        chunks: Iterator[bytes],
+        store: InputStore,
+        extension_hint: str | None,
+        source_key: str | None = None
+    ) -> str:
+        """Write chunks to a temp file while hashing, then commit it by hash."""
+        tmp_path = store.directory / f".incoming-{uuid.uuid4().hex}"
+        digest = hashlib.sha256()
+        head = b""
+        size = 0
+
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                    if self.max_input_bytes and size > self.max_input_bytes:
+                        raise InputMediaError(f"Input is over the {self.max_input_bytes} byte limit")
+
+            if size == 0:
+                raise InputMediaError("Input is empty")
+
+            extension = sniff_extension(head) or extension_hint or DEFAULT_EXTENSION
+            filename = f"{STORE_PREFIX}{digest.hexdigest()[:32]}{extension}"
+            reused = store.commit(tmp_path, filename, size, source_key)
+        finally:
+            # Stops a download cut off early
+            chunks.close()
+            tmp_path.unlink(missing_ok=True)
+
+        logger.info(f"{'Reused' if reused else 'Saved'} input: {filename} ({size / (1024 * 1024):.2f} MB)")
+        return filename
+
+    def _iter_http(self, url: str) -> Iterator[bytes]:
+        try:
+            # Redirects are followed here so every hop is checked
+            for _ in range(MAX_REDIRECTS + 1):
+                self._check_host(url)
+                r = self._session.get(url, stream=True, timeout=self.timeout, allow_redirects=False)
+                if not r.is_redirect:
+                    break
+                r.close()
+                url = urljoin(url, r.headers["location"])
+            else:
+                raise InputMediaError(f"Too many redirects fetching {url}")
+
+            with r:
+                r.raise_for_status()
+                length = int(r.headers.get("content-length") or 0)
+                if self.max_input_bytes and length > self.max_input_bytes:
+                    raise InputMediaError(f"Input is over the {self.max_input_bytes} byte limit: {url}")
+                yield from r.iter_content(chunk_size=CHUNK_SIZE)
+        except (requests.RequestException, ValueError) as e:
+            raise InputMediaError(f"Failed to fetch {url}: {e}")
+
+    def _check_host(self, url: str) -> None:
+        """Refuse a host off the allow list, or without one, a host that isn't public."""
+        host = (urlparse(url).hostname or "").lower()
+        if not host:
+            raise InputMediaError(f"Input URL has no host: {url}")
+        if self.allowed_hosts:
+            if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+                       for allowed in self.allowed_hosts):
+                raise InputMediaError(f"Input host {host} isn't in the allowed hosts")
+            return
+
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+        except (OSError, UnicodeError) as e:
+            raise InputMediaError(f"Can't resolve input host {host}: {e}")
+        for address in addresses:
+            if not ipaddress.ip_address(address.partition("%")[0]).is_global:
+                raise InputMediaError(f"Input host {host} has a non-public address ({address})")
+
+    def _iter_s3(self, url: str) -> Iterator[bytes]:
+        parsed = urlparse(url)
+        try:
+            body = self._s3_client().get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))["Body"]
+            yield from body.iter_chunks(chunk_size=CHUNK_SIZE)
+        except InputMediaError:
+            raise
+        except Exception as e:
+            raise InputMediaError(f"Failed to fetch {url}: {e}")
+
+    def _iter_file(self, url: str) -> Iterator[bytes]:
+        path = Path(unquote(urlparse(url).path)).resolve()
+        if not any(path.is_relative_to(root) for root in self.allowed_file_roots):
+            raise InputMediaError(f"File inputs must be under {[str(r) for r in self.allowed_file_roots]}: {path}")
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    yield chunk
+        except OSError as e:
+            raise InputMediaError(f"Failed to read {path}: {e}")
+
+    def _s3_client(self):
+        """Create the S3 client on first use, with the output bucket's credentials."""
+        if boto3 is None:
+            raise InputMediaError("boto3 is required for s3:// inputs")
+        with self._s3_lock:
+            if self._s3 is None:
+                self._s3 = boto3.client(
+                    "s3",
+                    endpoint_url=os.getenv("BUCKET_ENDPOINT_URL"),
+                    aws_access_key_id=os.getenv("BUCKET_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("BUCKET_SECRET_ACCESS_KEY"),
+                    region_name=os.getenv("BUCKET_REGION"),
+                )
+            return self._s3
@@ -0,0 +1,318 @@
+"""
+Job and Worker Metrics
+
+Per-job stage timings are collected by a StageTimer bound to the running
+job through a context variable, so code anywhere in the job's call stack
+(including asyncio.to_thread workers) can time a stage with
+stage("name") without a timer being passed around. Finished jobs are
+aggregated into a MetricsRegistry, which renders Prometheus/OpenMetrics
+text for a /metrics endpoint.
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets for stage durations (seconds), from HTTP round trips
+# up to long renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_current_timer: ContextVar["StageTimer | None"] = ContextVar("current_timer", default=None)
+
+
+class StageTimer:
+    """Accumulates wall-clock seconds per named stage of one job."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.nodes: dict[str, dict[str, Any]] = {}
+        self.estimate: dict[str, Any] | None = None
+        self.node_reuse = {"cached": 0, "run": 0, "expected_cached": 0, "expected_total": 0}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        """Add time to a stage; repeated stages (e.g. per output) add up."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_nodes(self, nodes: list[dict[str, Any]]) -> None:
+        """
+        Add a prompt's per-node timings (ExecutionProfile.summary()).
+
+        Nodes are keyed by id, so a batch of one template adds up per node;
+        cached and run nodes are also counted per prompt.
+        """
+        with self._lock:
+            for node in nodes:
+                self.node_reuse["cached" if node.get("cached") else "run"] += 1
+                entry = self.nodes.get(node["node_id"])
+                if entry is None:
+                    self.nodes[node["node_id"]] = dict(node)
+                    continue
+                entry["seconds"] = round(entry["seconds"] + node["seconds"], 4)
+                if "steps" in node:
+                    entry["steps"] = entry.get("steps", 0) + node["steps"]
+
+    def record_estimate(self, estimate: dict[str, Any]) -> None:
+        """
+        Add a render's admission estimate.
+
+        A batch's renders add up: seconds sum, vram_bytes is the largest.
+        """
+        with self._lock:
+            if self.estimate is None:
+                self.estimate = dict(estimate)
+                return
+            self.estimate["seconds"] = round(self.estimate["seconds"] + estimate["seconds"], 2)
+            self.estimate["tokens"] += estimate["tokens"]
+            self.estimate["vram_bytes"] = max(self.estimate["vram_bytes"], estimate["vram_bytes"])
+
+    def expect_reuse(self, cached: int, total: int) -> None:
+        """Add nodes queued (total) and those expected from ComfyUI's cache."""
+        with self._lock:
+            self.node_reuse["expected_cached"] += cached
+            self.node_reuse["expected_total"] += total
+
+    def reuse(self) -> dict[str, Any] | None:
+        """
+        Share of nodes ComfyUI served from its cache, and the share expected.
+
+        Returns:
+            Dict with cached, run and rate (plus expected_rate if an
+            expectation was recorded), or None if no nodes were recorded
+        """
+        with self._lock:
+            counts = dict(self.node_reuse)
+        if not counts["cached"] + counts["run"]:
+            return None
+        reuse = {
+            "cached": counts["cached"],
+            "run": counts["run"],
+            "rate": round(counts["cached"] / (counts["cached"] + counts["run"]), 4),
+        }
+        if counts["expected_total"]:
+            reuse["expected_rate"] = round(counts["expected_cached"] / counts["expected_total"], 4)
+        return reuse
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+    def node_list(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [dict(node) for node in self.nodes.values()]
+
+
+def start_job_timer() -> StageTimer:
+    """Create a timer and make it the current job's timer."""
+    timer = StageTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer() -> StageTimer | None:
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current job; a no-op outside a job."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add a measured duration to the current job's stage."""
+    timer = _current_timer.get()
+    if timer is not None and seconds >= 0:
+        timer.record(name, seconds)
+
+
+def record_estimate(estimate: dict[str, Any]) -> None:
+    """Add a render's admission estimate to the current job."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record_estimate(estimate)
+
+
+def expect_reuse(cached: int, total: int) -> None:
+    """Add expected node cache hits to the current job."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.expect_reuse(cached, total)
+
+
+def record_nodes(nodes: list[dict[str, Any]]) -> None:
+    """Add a prompt's per-node timings to the current job."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record_nodes(nodes)
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsRegistry:
+    """
+    Aggregates finished jobs and worker timings for export.
+
+    Exposes job counts by status, a histogram per job stage plus one for
+    total job time, a histogram of node execution time per node class,
+    counters kept by other components (model swaps) and worker timings
+    (cold start stages) as gauges.
+    """
+
+    def __init__(self, namespace: str = "comfy_worker", buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self.jobs: dict[str, int] = {}
+        self.stage_seconds: dict[str, _Histogram] = {}
+        self.node_seconds: dict[str, _Histogram] = {}
+        self.job_seconds = _Histogram(buckets)
+        self.worker_timings: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe_job(
+        self,
+        status: str,
+        stages: dict[str, float],
+        total: float,
+        nodes: list[dict[str, Any]] | None = None
+    ) -> None:
+        with self._lock:
+            self.jobs[status] = self.jobs.get(status, 0) + 1
+            self.job_seconds.observe(total)
+            for name, seconds in stages.items():
+                if name not in self.stage_seconds:
+                    self.stage_seconds[name] = _Histogram(self.buckets)
+                self.stage_seconds[name].observe(seconds)
+            for node in nodes or []:
+                if node.get("cached"):
+                    continue
+                class_type = node["class_type"]
+                if class_type not in self.node_seconds:
+                    self.node_seconds[class_type] = _Histogram(self.buckets)
+                self.node_seconds[class_type].observe(node["seconds"])
+
+    def set_worker_timings(self, timings: dict[str, float]) -> None:
+        with self._lock:
+            self.worker_timings.update(timings)
+
+    def set_counters(self, counters: dict[str, int]) -> None:
+        """Set running totals kept elsewhere (e.g. model swaps)."""
+        with self._lock:
+            self.counters.update(counters)
+
+    def render(self) -> str:
+        """Render all metrics in OpenMetrics text format."""
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            lines.append(f"# TYPE {ns}_jobs counter")
+            lines.append(f"# HELP {ns}_jobs Jobs finished, by result status.")
+            for status, count in sorted(self.jobs.items()):
+                lines.append(f'{ns}_jobs_total{{status="{status}"}} {count}')
+
+            lines.append(f"# TYPE {ns}_job_seconds histogram")
+            lines.append(f"# UNIT {ns}_job_seconds seconds")
+            lines.append(f"# HELP {ns}_job_seconds End-to-end job time.")
+            lines.extend(self._histogram_lines(f"{ns}_job_seconds", "", self.job_seconds))
+
+            lines.append(f"# TYPE {ns}_job_stage_seconds histogram")
+            lines.append(f"# UNIT {ns}_job_stage_seconds seconds")
+            lines.append(f"# HELP {ns}_job_stage_seconds Time spent per job stage.")
+            for name, histogram in sorted(self.stage_seconds.items()):
+                lines.extend(self._histogram_lines(f"{ns}_job_stage_seconds", f'stage="{name}"', histogram))
+
+            lines.append(f"# TYPE {ns}_node_seconds histogram")
+            lines.append(f"# UNIT {ns}_node_seconds seconds")
+            lines.append(f"# HELP {ns}_node_seconds ComfyUI node execution time, by node class.")
+            for class_type, histogram in sorted(self.node_seconds.items()):
+                lines.extend(self._histogram_lines(f"{ns}_node_seconds", f'class_type="{class_type}"', histogram))
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {ns}_{name} counter")
+                lines.append(f"{ns}_{name}_total {value}")
+
+            lines.append(f"# TYPE {ns}_startup_seconds gauge")
+            lines.append(f"# UNIT {ns}_startup_seconds seconds")
+            lines.append(f"# HELP {ns}_startup_seconds Worker cold start timings.")
+            for name, seconds in sorted(self.worker_timings.items()):
+                lines.append(f'{ns}_startup_seconds{{stage="{name}"}} {seconds}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(name: str, labels: str, histogram: _Histogram) -> list[str]:
+        prefix = f"{labels}," if labels else ""
+        lines = [
+            f'{name}_bucket{{{prefix}le="{bound}"}} {count}'
+            for bound, count in zip(histogram.buckets, histogram.counts)
+        ]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+        lines.append(f"{name}_sum{suffix} {round(histogram.sum, 6)}")
+        return lines
+
+
+def serve_metrics(registry: MetricsRegistry, host: str = "0.0.0.0", port: int = 9400) -> ThreadingHTTPServer:
+    """Serve registry.render() at /metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,402 @@
+"""
+Output Storage Backends
+
+Uploads generated output files to object storage so job results can carry
+a URL instead of inlined base64 data. Used by the serverless handler when
+OUTPUT_MODE=upload.
+
+Also keeps the index of output files ComfyUI wrote for this worker, so
+they can be removed once delivered and evicted by a byte and age budget
+without scanning the output directory.
+
+Bucket settings follow RunPod's rp_upload conventions (BUCKET_ENDPOINT_URL,
+BUCKET_ACCESS_KEY_ID, BUCKET_SECRET_ACCESS_KEY), so an endpoint already
+configured for RunPod uploads works unchanged.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Iterable
+from pathlib import Path
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+except ImportError:  # pragma: no cover - only needed when uploads are enabled
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Read size when hashing files, independent of the multipart part size
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Most files one eviction pass deletes, so a large backlog is worked off in
+# short steps rather than one long stall
+EVICT_BATCH = 64
+
+
+class StorageError(Exception):
+    """Exception raised when an output can't be stored."""
+    pass
+
+
+def file_sha256(filepath: str | Path) -> str:
+    """Compute a file's sha256 without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OutputStorage(ABC):
+    """Base class for output storage backends."""
+
+    @abstractmethod
+    def upload(self, filepath: str | Path, key: str) -> dict[str, Any]:
+        """
+        Upload a file.
+
+        Args:
+            filepath: Local file to upload
+            key: Object key relative to the backend's prefix
+
+        Returns:
+            Dict with url, key, size_bytes and sha256
+
+        Raises:
+            StorageError: If the upload fails
+        """
+
+
+class S3OutputStorage(OutputStorage):
+    """
+    S3-compatible storage (AWS S3, R2, MinIO, ...).
+
+    Files above part_size are sent as multipart uploads with up to
+    max_concurrency parts in flight. Results link to the object through a
+    presigned GET URL, or through public_base_url if the bucket is public.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str | None = None,
+        access_key_id: str | None = None,
+        secret_access_key: str | None = None,
+        region: str | None = None,
+        prefix: str = "",
+        part_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 8,
+        presign_expiry: int = 3600,
+        public_base_url: str | None = None
+    ):
+        if boto3 is None:
+            raise StorageError("boto3 is required for S3 output uploads")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_expiry = presign_expiry
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            region_name=region,
+            config=Config(
+                signature_version="s3v4",
+                retries={"max_attempts": 3, "mode": "standard"},
+                # One connection per in-flight part, across concurrent uploads
+                max_pool_connections=max(10, max_concurrency * 2),
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+
+    def upload(self, filepath: str | Path, key: str) -> dict[str, Any]:
+        filepath = Path(filepath)
+        object_key = f"{self.prefix}{key}"
+        size = filepath.stat().st_size
+        sha256 = file_sha256(filepath)
+        content_type = mimetypes.guess_type(filepath.name)[0] or "application/octet-stream"
+
+        try:
+            self.client.upload_file(
+                str(filepath),
+                self.bucket,
+                object_key,
+                ExtraArgs={"ContentType": content_type, "Metadata": {"sha256": sha256}},
+                Config=self.transfer_config,
+            )
+        except Exception as e:
+            raise StorageError(f"Failed to upload {filepath.name} to s3://{self.bucket}/{object_key}: {e}")
+
+        logger.info(f"Uploaded {filepath.name} ({size / (1024 * 1024):.2f} MB) to s3://{self.bucket}/{object_key}")
+
+        return {
+            "url": self._url(object_key),
+            "key": object_key,
+            "size_bytes": size,
+            "sha256": sha256,
+        }
+
+    def _url(self, object_key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{object_key}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": object_key},
+            ExpiresIn=self.presign_expiry,
+        )
+
+
+def storage_from_env() -> OutputStorage | None:
+    """
+    Build the output storage backend from environment variables.
+
+    Returns:
+        Configured backend, or None if BUCKET_NAME isn't set
+    """
+    bucket = os.getenv("BUCKET_NAME")
+    if not bucket:
+        return None
+
+    return S3OutputStorage(
+        bucket=bucket,
+        endpoint_url=os.getenv("BUCKET_ENDPOINT_URL"),
+        access_key_id=os.getenv("BUCKET_ACCESS_KEY_ID"),
+        secret_access_key=os.getenv("BUCKET_SECRET_ACCESS_KEY"),
+        region=os.getenv("BUCKET_REGION"),
+        prefix=os.getenv("BUCKET_PREFIX", ""),
+        part_size=int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))),
+        max_concurrency=int(os.getenv("UPLOAD_CONCURRENCY", "8")),
+        presign_expiry=int(os.getenv("UPLOAD_URL_EXPIRY", "3600")),
+        public_base_url=os.getenv("BUCKET_PUBLIC_URL"),
+    )
+
+
+class OutputIndex:
+    """
+    Index of output files written for this worker's prompts.
+
+    Files are added as prompts finish and removed once delivered; files
+    delivered to several jobs are retained once per extra job and only
+    deleted by the last removal. Anything left behind (failed deliveries,
+    unreturned renders) is evicted oldest first once the index is over
+    max_bytes or a file is older than max_age, in short passes from a
+    background thread. With a state_path, the background thread saves
+    the index there and restores it at start, so a restarted worker still
+    evicts what it left behind. Files that aren't in the index, such as
+    result cache entries or other workers' outputs on a shared volume,
+    are never touched.
+
+    Args:
+        max_bytes: Byte budget for indexed files, 0 for unbounded
+        max_age: Seconds an indexed file may live, 0 for no limit
+        state_path: File the index is saved to, None to keep it in memory
+    """
+
+    def __init__(self, max_bytes: int = 0, max_age: float = 0, state_path: str | Path | None = None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.state_path = Path(state_path) if state_path else None
+        self.total_bytes = 0
+        self.removed = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._holders: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = False
+
+    def add(self, paths: Iterable[str | Path]) -> None:
+        """Record output files; missing files are skipped."""
+        now = time.time()
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            key = str(path)
+            with self._lock:
+                self.total_bytes -= self._entries.pop(key, (0, 0))[0]
+                self._entries[key] = (size, now)
+                self.total_bytes += size
+                self._dirty = True
+                over = self.max_bytes and self.total_bytes > self.max_bytes
+            if over:
+                self._wake.set()
+
+    def load(self) -> int:
+        """
+        Restore the entries saved to state_path by an earlier run.
+
+        Restored entries keep their age and go ahead of everything added
+        since, so they're evicted first. Entries whose file is gone are
+        dropped, as are files that are already indexed.
+
+        Returns:
+            Number of entries restored
+        """
+        if self.state_path is None:
+            return 0
+        try:
+            saved = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable output index {self.state_path}: {e}")
+            return 0
+
+        restored = OrderedDict()
+        for path, added in saved:
+            try:
+                restored[path] = (os.stat(path).st_size, added)
+            except OSError:
+                continue
+
+        with self._lock:
+            for path in self._entries:
+                restored.pop(path, None)
+            count = len(restored)
+            self.total_bytes += sum(size for size, _ in restored.values())
+            restored.update(self._entries)
+            self._entries = restored
+            self._dirty = True
+        # Let the evictor catch up on anything over budget or expired
+        self._wake.set()
+        logger.info(f"Restored {count} output index entries from {self.state_path}")
+        return count
+
+    def save(self) -> None:
+        """Write the index to state_path if it changed since the last save."""
+        if self.state_path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[path, added] for path, (_, added) in self._entries.items()]
+            self._dirty = False
+
+        tmp_path = self.state_path.with_name(f"{self.state_path.name}.tmp")
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(entries))
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            with self._lock:
+                self._dirty = True
+            logger.warning(f"Failed to save output index to {self.state_path}: {e}")
+
+    def retain(self, paths: Iterable[str | Path], count: int = 1) -> None:
+        """Require count more removals before indexed files are deleted."""
+        with self._lock:
+            for path in paths:
+                key = str(path)
+                if key in self._entries:
+                    self._holders[key] = self._holders.get(key, 1) + count
+
+    def remove(self, paths: Iterable[str | Path]) -> int:
+        """
+        Delete indexed files now, e.g. once delivered.
+
+        Returns:
+            Number of files deleted
+        """
+        victims = []
+        with self._lock:
+            for path in paths:
+                key = str(path)
+                holders = self._holders.pop(key, 1)
+                if holders > 1:
+                    self._holders[key] = holders - 1
+                    continue
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.total_bytes -= entry[0]
+                    victims.append(str(path))
+            self.removed += len(victims)
+            self._dirty = self._dirty or bool(victims)
+        self._unlink(victims)
+        return len(victims)
+
+    def evict(self, limit: int = EVICT_BATCH) -> int:
+        """
+        Run one eviction pass of at most limit files.
+
+        Returns:
+            Number of files evicted; limit means there may be more to do
+        """
+        cutoff = time.time() - self.max_age if self.max_age else None
+        victims = []
+        with self._lock:
+            while self._entries and len(victims) < limit:
+                path, (size, added) = next(iter(self._entries.items()))
+                over_budget = self.max_bytes and self.total_bytes > self.max_bytes
+                expired = cutoff is not None and added < cutoff
+                if not (over_budget or expired):
+                    break
+                del self._entries[path]
+                self._holders.pop(path, None)
+                self.total_bytes -= size
+                victims.append(path)
+            self.evictions += len(victims)
+            self._dirty = self._dirty or bool(victims)
+        self._unlink(victims)
+        if victims:
+            logger.info(f"Evicted {len(victims)} output files")
+        return len(victims)
+
+    def start(self, interval: float = 60.0) -> threading.Thread:
+        """
+        Evict from a daemon thread, every interval seconds and whenever
+        add goes over the byte budget. The thread first restores the
+        saved index, and saves it after every pass.
+        """
+        def run():
+            self.load()
+            while True:
+                self._wake.wait(interval)
+                self._wake.clear()
+                while self.evict() == EVICT_BATCH:
+                    pass
+                self.save()
+
+        thread = threading.Thread(target=run, name="output-evictor", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict[str, Any]:
+        """Current usage and removal counters."""
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "removed": self.removed,
+                "evictions": self.evictions,
+            }
+
+    @staticmethod
+    def _unlink(paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to delete {path}: {e}")
@@ -0,0 +1,118 @@
+"""
+Quality Tiers
+
+Rewrites a template's graph for a quality tier, so a client can get a
+quick, cheap look at a prompt before paying for a full render. Tiers are
+declarative profiles per template; "standard" is the template as shipped.
+A profile may hold:
+
+    {
+        "inputs": {"9": {"steps": 8}},         # node inputs, set before the
+                                               # job's params (which win)
+        "relink": {"12": {"samples": ["41", 0]}},  # rerouted links; nodes no
+                                               # output needs any more are
+                                               # pruned with the rest
+        "scale": 0.5,                          # render width and height factor
+        "max_frames": 49,                      # frame count cap
+    }
+
+scale and max_frames apply after the job's params, to the size the job
+asked for. Sizes stay multiples of the latent's 32 pixels and frame
+counts 8n + 1, as LTX-Video needs.
+"""
+
+from typing import Any
+
+from admission import LATENT_SPATIAL, LATENT_TEMPORAL, workflow_shape
+from comfy_bridge import clone_workflow, is_link
+
+QUALITY_TIERS = ("draft", "standard", "final")
+
+PROFILE_KEYS = ("inputs", "relink", "scale", "max_frames")
+
+
+class QualityError(Exception):
+    """Raised for unknown tiers and profiles that don't match their template."""
+    pass
+
+
+def check_profile(workflow: dict[str, Any], profile: dict[str, Any]) -> list[str]:
+    """
+    Find what a profile references that its template doesn't have.
+
+    Returns:
+        One message per problem; empty if the profile applies cleanly
+    """
+    problems = [f"unknown key '{key}'" for key in profile if key not in PROFILE_KEYS]
+    for section in ("inputs", "relink"):
+        for node_id, inputs in profile.get(section, {}).items():
+            if node_id not in workflow:
+                problems.append(f"{section} names missing node {node_id}")
+                continue
+            for input_name, value in inputs.items():
+                if input_name not in workflow[node_id].get("inputs", {}):
+                    problems.append(f"{section} names missing input {node_id}.{input_name}")
+                if section == "relink" and not (is_link(value) and value[0] in workflow):
+                    problems.append(f"relink of {node_id}.{input_name} is not a link to a node: {value!r}")
+    if ("scale" in profile or "max_frames" in profile) and workflow_shape(workflow) is None:
+        problems.append("scale or max_frames given, but the render size can't be found")
+    return problems
+
+
+def rewrite_graph(workflow: dict[str, Any], profile: dict[str, Any]) -> dict[str, Any]:
+    """
+    Apply a profile's inputs and relinks.
+
+    Args:
+        workflow: API format workflow; not modified
+        profile: Tier profile
+
+    Returns:
+        Rewritten copy of the workflow, or the workflow itself if the
+        profile changes neither
+
+    Raises:
+        QualityError: If the profile doesn't match the workflow
+    """
+    if not profile.get("inputs") and not profile.get("relink"):
+        return workflow
+    problems = check_profile(workflow, profile)
+    if problems:
+        raise QualityError("; ".join(problems))
+
+    workflow = clone_workflow(workflow)
+    for section in ("inputs", "relink"):
+        for node_id, inputs in profile.get(section, {}).items():
+            workflow[node_id]["inputs"].update(inputs)
+    return workflow
+
+
+def limit_shape(workflow: dict[str, Any], profile: dict[str, Any]) -> dict[str, int] | None:
+    """
+    Scale a workflow's render size and cap its frames in place.
+
+    Returns:
+        Dict with the resulting width, height and frames, or None if the
+        profile sets neither or the size can't be found
+    """
+    scale = profile.get("scale")
+    max_frames = profile.get("max_frames")
+    if scale is None and max_frames is None:
+        return None
+    shape = workflow_shape(workflow)
+    if shape is None:
+        return None
+
+    result = {"width": shape["width"], "height": shape["height"], "frames": shape["frames"]}
+    if scale is not None:
+        for name in ("width", "height"):
+            value = max(int(shape[name] * scale) // LATENT_SPATIAL * LATENT_SPATIAL, LATENT_SPATIAL)
+            node_id, input_name = shape["sources"][name]
+            workflow[node_id]["inputs"][input_name] = value
+            result[name] = value
+    if max_frames is not None and "frames" in shape["sources"]:
+        frames = (min(shape["frames"], max_frames) - 1) // LATENT_TEMPORAL * LATENT_TEMPORAL + 1
+        node_id, input_name = shape["sources"]["frames"]
+        workflow[node_id]["inputs"][input_name] = frames
+        result["frames"] = frames
+    return result
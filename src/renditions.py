@@ -0,0 +1,272 @@
+"""
+Output Renditions
+
+Encodes a ladder of renditions from a rendered master video with ffmpeg:
+resized H.264 MP4s at set bitrates, a poster frame JPEG and a short
+animated preview. Each rendition is its own ffmpeg process; a ladder
+runs them on a thread pool with the CPU cores split between them, so it
+takes about as long as its slowest rendition and leaves the GPU free
+for the next prompt.
+
+Renditions never upscale: a 720p master yields no 1080p rendition
+larger than itself, just a re-encode at the master's size.
+"""
+
+import os
+import re
+import time
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+RENDITION_PRESETS = {
+    "1080p": {"kind": "video", "height": 1080, "video_bitrate": "6M", "audio_bitrate": "192k"},
+    "720p": {"kind": "video", "height": 720, "video_bitrate": "3M", "audio_bitrate": "128k"},
+    "480p": {"kind": "video", "height": 480, "video_bitrate": "1200k", "audio_bitrate": "96k"},
+    "poster": {"kind": "poster", "height": 720},
+    "preview": {"kind": "preview", "height": 240, "fps": 12, "seconds": 3, "format": "gif"},
+}
+
+KINDS = ("video", "poster", "preview")
+PREVIEW_FORMATS = ("gif", "webp")
+
+# Output types (as in ComfyUI history) of each kind of rendition
+KIND_OUTPUT_TYPES = {"video": "video", "poster": "image", "preview": "image"}
+
+# Masters a ladder is rendered from
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".mkv")
+
+# x264 speed/size trade-off for video renditions, and the presets a
+# rendition may pick instead
+X264_PRESET = "veryfast"
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow")
+
+# Fields each kind of rendition takes besides name and kind. Every value
+# ends up in an ffmpeg argument or filtergraph, so each is checked for
+# type and range before anything is queued
+KIND_FIELDS = {
+    "video": ("width", "height", "video_bitrate", "audio_bitrate", "preset"),
+    "poster": ("width", "height"),
+    "preview": ("width", "height", "fps", "seconds", "format", "quality"),
+}
+INT_RANGES = {"width": (16, 8192), "height": (16, 8192), "fps": (1, 120), "quality": (0, 100)}
+MAX_PREVIEW_SECONDS = 60
+BITRATE_PATTERN = re.compile(r"[1-9][0-9]*[kM]?")
+NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class RenditionError(Exception):
+    """Raised for invalid rendition ladders."""
+    pass
+
+
+def parse_ladder(spec: str | list[Any]) -> list[dict[str, Any]]:
+    """
+    Resolve a ladder from preset names and overrides.
+
+    Args:
+        spec: Comma-separated preset names ("720p,480p,poster"), or a list
+            of preset names and dicts; a dict names a preset to override
+            ({"name": "720p", "video_bitrate": "2M"}) or defines a new
+            rendition with its own kind ({"name": "square", "kind":
+            "video", "height": 1080, "video_bitrate": "4M"})
+
+    Returns:
+        List of complete rendition specs, each with a name
+
+    Raises:
+        RenditionError: On unknown presets, kinds, fields or duplicate
+            names, and on values of the wrong type or out of range
+    """
+    if isinstance(spec, str):
+        spec = [name.strip() for name in spec.split(",") if name.strip()]
+    if not isinstance(spec, list):
+        raise RenditionError("'renditions' must be a list or comma-separated preset names")
+
+    ladder = []
+    for entry in spec:
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("name"), str):
+            raise RenditionError(f"Invalid rendition {entry!r}, expected a preset name or an object with a name")
+        preset = RENDITION_PRESETS.get(entry["name"], {})
+        rendition = {**preset, **entry}
+        if rendition.get("kind") not in KINDS:
+            raise RenditionError(
+                f"Unknown rendition '{entry['name']}': use one of {', '.join(RENDITION_PRESETS)} "
+                f"or give a kind ({', '.join(KINDS)})"
+            )
+        check_rendition(rendition)
+        ladder.append(rendition)
+
+    names = [rendition["name"] for rendition in ladder]
+    if len(set(names)) != len(names):
+        raise RenditionError("Rendition names must be unique")
+    return ladder
+
+
+def check_rendition(rendition: dict[str, Any]) -> None:
+    """
+    Check a resolved rendition's fields.
+
+    Raises:
+        RenditionError: On unknown fields and invalid or missing values
+    """
+    name = rendition["name"]
+    if not NAME_PATTERN.fullmatch(name):
+        raise RenditionError(f"Invalid rendition name {name!r}, use up to 64 letters, digits, - and _")
+    kind = rendition["kind"]
+    unknown = sorted(set(rendition) - {"name", "kind", *KIND_FIELDS[kind]})
+    if unknown:
+        raise RenditionError(f"Rendition '{name}' ({kind}) doesn't take {', '.join(unknown)}")
+
+    for field, (low, high) in INT_RANGES.items():
+        value = rendition.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+            raise RenditionError(f"Rendition '{name}' {field} must be a whole number from {low} to {high}")
+    for field in ("video_bitrate", "audio_bitrate"):
+        value = rendition.get(field)
+        if value is not None and not (isinstance(value, str) and BITRATE_PATTERN.fullmatch(value)):
+            raise RenditionError(f"Rendition '{name}' {field} must be a bitrate like \"3M\", \"128k\" or \"800000\"")
+    seconds = rendition.get("seconds")
+    if seconds is not None and (
+        not isinstance(seconds, (int, float)) or isinstance(seconds, bool)
+        or not 0 < seconds <= MAX_PREVIEW_SECONDS
+    ):
+        raise RenditionError(f"Rendition '{name}' seconds must be more than 0 and at most {MAX_PREVIEW_SECONDS}")
+    if rendition.get("preset", X264_PRESET) not in X264_PRESETS:
+        raise RenditionError(f"Rendition '{name}' preset must be one of {', '.join(X264_PRESETS)}")
+    if rendition.get("format", "gif") not in PREVIEW_FORMATS:
+        raise RenditionError(f"Preview format must be one of {', '.join(PREVIEW_FORMATS)}")
+
+    if kind == "video" and not rendition.get("video_bitrate"):
+        raise RenditionError(f"Video rendition '{name}' needs a video_bitrate")
+    if not rendition.get("width") and not rendition.get("height"):
+        raise RenditionError(f"Rendition '{name}' needs a width or height")
+
+
+def rendition_extension(rendition: dict[str, Any]) -> str:
+    if rendition["kind"] == "video":
+        return ".mp4"
+    if rendition["kind"] == "poster":
+        return ".jpg"
+    return f".{rendition.get('format', 'gif')}"
+
+
+def scale_filter(rendition: dict[str, Any]) -> str:
+    """ffmpeg scale filter fitting a rendition's size without upscaling."""
+    if rendition.get("height"):
+        return f"scale=-2:'min({int(rendition['height'])},ih)':flags=lanczos"
+    return f"scale='min({int(rendition['width'])},iw)':-2:flags=lanczos"
+
+
+def ffmpeg_command(
+    source: str | Path,
+    target: str | Path,
+    rendition: dict[str, Any],
+    threads: int = 0,
+    ffmpeg: str = "ffmpeg"
+) -> list[str]:
+    """Build the ffmpeg command encoding one rendition of source into target."""
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", str(source)]
+    scale = scale_filter(rendition)
+    kind = rendition["kind"]
+
+    if kind == "video":
+        bitrate = rendition["video_bitrate"]
+        command += [
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-vf", scale,
+            "-c:v", "libx264", "-preset", rendition.get("preset", X264_PRESET),
+            "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", _double(bitrate),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+            "-c:a", "aac", "-b:a", rendition.get("audio_bitrate", "128k"),
+        ]
+    elif kind == "poster":
+        # thumbnail picks the most representative frame of the opening frames
+        command += ["-vf", f"thumbnail,{scale}", "-frames:v", "1", "-q:v", "2"]
+    else:
+        frames = f"fps={rendition.get('fps', 12)},{scale}"
+        command += ["-t", str(rendition.get("seconds", 3)), "-an", "-loop", "0"]
+        if rendition.get("format", "gif") == "gif":
+            command += ["-filter_complex", f"[0:v]{frames},split[a][b];[a]palettegen[p];[b][p]paletteuse"]
+        else:
+            command += ["-vf", frames, "-c:v", "libwebp", "-q:v", str(rendition.get("quality", 60))]
+
+    if threads:
+        command += ["-threads", str(threads)]
+    command.append(str(target))
+    return command
+
+
+def render_ladder(
+    source: str | Path,
+    out_dir: str | Path,
+    ladder: list[dict[str, Any]],
+    workers: int = 0,
+    ffmpeg: str = "ffmpeg",
+    timeout: float = 600
+) -> list[dict[str, Any]]:
+    """
+    Encode every rendition of a ladder from source, concurrently.
+
+    Args:
+        source: Master video
+        out_dir: Directory for the renditions, named <source stem>_<name>
+        ladder: Rendition specs from parse_ladder
+        workers: ffmpeg processes at once; 0 runs all of them, up to one
+            per CPU core, each with an equal share of the cores
+        timeout: Seconds one rendition may take
+
+    Returns:
+        Per rendition, in ladder order: name, kind, path, size_bytes and
+        seconds, or name, kind and error if it failed
+    """
+    source = Path(source)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cores = os.cpu_count() or 1
+    workers = max(1, min(workers or cores, len(ladder), cores))
+    threads = max(1, cores // workers)
+
+    def encode(rendition: dict[str, Any]) -> dict[str, Any]:
+        target = out_dir / f"{source.stem}_{rendition['name']}{rendition_extension(rendition)}"
+        result = {"name": rendition["name"], "kind": rendition["kind"]}
+        started = time.perf_counter()
+        try:
+            subprocess.run(
+                ffmpeg_command(source, target, rendition, threads, ffmpeg),
+                check=True, capture_output=True, timeout=timeout,
+            )
+        except subprocess.CalledProcessError as e:
+            message = e.stderr.decode(errors="replace").strip().splitlines()
+            result["error"] = f"ffmpeg failed: {message[-1] if message else f'exit code {e.returncode}'}"
+        except subprocess.TimeoutExpired:
+            result["error"] = f"ffmpeg timed out after {timeout}s"
+        except OSError as e:
+            result["error"] = f"ffmpeg could not run: {e}"
+        else:
+            result.update({
+                "path": str(target),
+                "size_bytes": target.stat().st_size,
+                "seconds": round(time.perf_counter() - started, 3),
+            })
+        if "error" in result:
+            logger.warning(f"Rendition {rendition['name']} of {source.name}: {result['error']}")
+            target.unlink(missing_ok=True)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rendition") as pool:
+        return list(pool.map(encode, ladder))
+
+
+def _double(bitrate: str) -> str:
+    """Twice an ffmpeg bitrate ("3M" -> "6M"), for the rate control buffer."""
+    number = bitrate.rstrip("kKmM")
+    return f"{float(number) * 2:g}{bitrate[len(number):]}"
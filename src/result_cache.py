@@ -0,0 +1,487 @@
+"""
+Workflow Result Cache
+
+Stores the outputs of finished workflows keyed by a hash of the final
+workflow and the content of its input files, so identical requests
+(retries, A/B re-renders, duplicate submissions) return the stored outputs
+without running ComfyUI again. Seeds are part of the workflow, so only
+requests that pin the same seed can hit.
+
+Entries live in a size-bounded local directory, evicted least recently used
+first. A hit hands out hard links to the entry's files, so evicting the
+entry while a job still delivers them doesn't pull them away. A shared store (a directory on a network volume, or an S3 bucket)
+can sit behind it so workers share results; local misses fall through to
+it and local writes are published to it.
+
+Identical requests that arrive while the first is still rendering can't
+hit the cache yet; InflightTable lets them join that render instead.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable
+from urllib.parse import urlparse
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover - only needed for s3:// shared stores
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every stored entry when the key derivation changes
+KEY_VERSION = 1
+
+MANIFEST_NAME = "manifest.json"
+
+# Subdirectory of the cache directory holding the files handed out by hits
+CHECKOUT_DIR = ".checkout"
+
+
+class ResultCacheError(Exception):
+    """Exception raised when a cache entry can't be read or written."""
+    pass
+
+
+def canonical_workflow(workflow: dict[str, Any]) -> str:
+    """
+    Serialize a workflow so equivalent graphs give identical strings.
+
+    Keys are sorted and node _meta (UI titles) is dropped, since neither
+    affects what ComfyUI renders.
+    """
+    nodes = {
+        node_id: {key: value for key, value in node.items() if key != "_meta"}
+        for node_id, node in workflow.items()
+    }
+    return json.dumps(nodes, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def result_key(workflow: dict[str, Any], input_hashes: dict[str, str] | None = None) -> str:
+    """
+    Compute the cache key of a final workflow.
+
+    Args:
+        workflow: API format workflow, after all parameters are applied
+        input_hashes: Content hash of each input file the workflow reads,
+            by filename
+
+    Returns:
+        Hex sha256 digest
+    """
+    digest = hashlib.sha256(f"v{KEY_VERSION}\n".encode())
+    digest.update(canonical_workflow(workflow).encode())
+    digest.update(json.dumps(sorted((input_hashes or {}).items())).encode())
+    return digest.hexdigest()
+
+
+def _copy_file(src: Path, dest: Path) -> None:
+    """Hard link when possible (same filesystem), otherwise copy."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+class SharedResultStore(ABC):
+    """Base class for result stores shared between workers."""
+
+    @abstractmethod
+    def fetch(self, key: str, dest_dir: Path) -> bool:
+        """
+        Download an entry's manifest and files into dest_dir.
+
+        Returns:
+            True if the entry exists
+        """
+
+    @abstractmethod
+    def publish(self, key: str, src_dir: Path) -> None:
+        """Upload a complete local entry."""
+
+
+class DirectoryResultStore(SharedResultStore):
+    """
+    Shared store in a directory, e.g. on a RunPod network volume.
+
+    Also works as a local stand-in for a remote store in development.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+
+    def fetch(self, key: str, dest_dir: Path) -> bool:
+        entry = self.directory / key
+        if not (entry / MANIFEST_NAME).exists():
+            return False
+        for path in entry.iterdir():
+            shutil.copyfile(path, dest_dir / path.name)
+        return True
+
+    def publish(self, key: str, src_dir: Path) -> None:
+        entry = self.directory / key
+        if (entry / MANIFEST_NAME).exists():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.directory / f".tmp-{uuid.uuid4().hex}"
+        shutil.copytree(src_dir, tmp_dir)
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # Another worker published it first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class S3ResultStore(SharedResultStore):
+    """
+    Shared store in an S3-compatible bucket.
+
+    Objects are written under <prefix><key>/ with the manifest last, so an
+    entry without a manifest is incomplete and treated as missing.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client=None):
+        if client is None:
+            if boto3 is None:
+                raise ResultCacheError("boto3 is required for an S3 result store")
+            client = boto3.client(
+                "s3",
+                endpoint_url=os.getenv("BUCKET_ENDPOINT_URL"),
+                aws_access_key_id=os.getenv("BUCKET_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("BUCKET_SECRET_ACCESS_KEY"),
+                region_name=os.getenv("BUCKET_REGION"),
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def fetch(self, key: str, dest_dir: Path) -> bool:
+        base = f"{self.prefix}{key}/"
+        try:
+            manifest = self.client.get_object(Bucket=self.bucket, Key=base + MANIFEST_NAME)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return False
+        for output in json.loads(manifest)["outputs"]:
+            self.client.download_file(self.bucket, base + output["filename"], str(dest_dir / output["filename"]))
+        (dest_dir / MANIFEST_NAME).write_bytes(manifest)
+        return True
+
+    def publish(self, key: str, src_dir: Path) -> None:
+        base = f"{self.prefix}{key}/"
+        for path in src_dir.iterdir():
+            if path.name != MANIFEST_NAME:
+                self.client.upload_file(str(path), self.bucket, base + path.name)
+        self.client.upload_file(str(src_dir / MANIFEST_NAME), self.bucket, base + MANIFEST_NAME)
+
+
+class ResultCache:
+    """
+    Local result cache with an optional shared store behind it.
+
+    Args:
+        directory: Local directory for entries
+        max_bytes: Byte budget for the local directory, 0 for unbounded
+        shared: Optional store shared with other workers
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int = 0, shared: SharedResultStore | None = None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self) -> None:
+        """Adopt entries left by a previous run, oldest first."""
+        if not self.directory.is_dir():
+            return
+        found = []
+        for entry in self.directory.iterdir():
+            manifest = entry / MANIFEST_NAME
+            if entry.name.startswith(".") or not manifest.exists():
+                continue
+            found.append((manifest.stat().st_mtime, entry.name, _dir_size(entry)))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """
+        Look up a stored result.
+
+        Each output's file is linked (or copied, across filesystems) into
+        the checkout directory; the caller owns those files and deletes
+        them once delivered. An entry whose files are gone, e.g. evicted
+        by a concurrent put, is a miss.
+
+        Returns:
+            Dict with prompt_id and outputs (output file info dicts with a
+            local path), or None on a miss
+        """
+        with self._lock:
+            local = key in self._entries and (self.directory / key / MANIFEST_NAME).exists()
+            if local:
+                self._entries.move_to_end(key)
+
+        if not local:
+            if self.shared is None or not self._fetch_shared(key):
+                with self._lock:
+                    self.misses += 1
+                return None
+
+        entry = self.directory / key
+        try:
+            manifest = json.loads((entry / MANIFEST_NAME).read_text())
+            os.utime(entry / MANIFEST_NAME)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable result cache entry {key}: {e}")
+            self._remove(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        checkout = self.directory / CHECKOUT_DIR
+        token = uuid.uuid4().hex[:12]
+        linked = []
+        try:
+            checkout.mkdir(exist_ok=True)
+            for output in manifest["outputs"]:
+                path = checkout / f"{token}_{output['filename']}"
+                _copy_file(entry / output["filename"], path)
+                linked.append(path)
+                output["path"] = str(path)
+        except OSError as e:
+            logger.warning(f"Dropping incomplete result cache entry {key}: {e}")
+            for path in linked:
+                path.unlink(missing_ok=True)
+            self._remove(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return manifest
+
+    def put(self, key: str, prompt_id: str, outputs: list[tuple[dict, Path]]) -> None:
+        """
+        Store a finished workflow's outputs.
+
+        Args:
+            key: Cache key from result_key
+            prompt_id: ComfyUI prompt the outputs came from
+            outputs: (output file info dict, local path) per output
+
+        Raises:
+            ResultCacheError: If the entry can't be written
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.directory / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp_dir.mkdir()
+            manifest = {"prompt_id": prompt_id, "outputs": []}
+            for output, path in outputs:
+                _copy_file(path, tmp_dir / path.name)
+                manifest["outputs"].append({
+                    "type": output.get("type", "unknown"),
+                    "filename": path.name,
+                    "node_id": output.get("node_id"),
+                })
+            (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest))
+            size = _dir_size(tmp_dir)
+
+            self._remove(key)
+            os.rename(tmp_dir, self.directory / key)
+        except OSError as e:
+            raise ResultCacheError(f"Failed to store result {key}: {e}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        with self._lock:
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict(keep=key)
+
+        if self.shared is not None:
+            try:
+                self.shared.publish(key, self.directory / key)
+            except Exception as e:
+                logger.warning(f"Failed to publish result {key} to shared store: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _fetch_shared(self, key: str) -> bool:
+        """Copy an entry from the shared store into the local directory."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.directory / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+        try:
+            if not self.shared.fetch(key, tmp_dir):
+                return False
+            size = _dir_size(tmp_dir)
+            self._remove(key)
+            os.rename(tmp_dir, self.directory / key)
+        except Exception as e:
+            logger.warning(f"Failed to fetch result {key} from shared store: {e}")
+            return False
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        with self._lock:
+            self._entries[key] = size
+            self.total_bytes += size
+            self.shared_hits += 1
+        self._evict(keep=key)
+        return True
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            self.total_bytes -= self._entries.pop(key, 0)
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+
+    def _evict(self, keep: str) -> None:
+        if self.max_bytes <= 0:
+            return
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                victim = next((key for key in self._entries if key != keep), None)
+                if victim is None:
+                    return
+                self.evictions += 1
+            self._remove(victim)
+            logger.info(f"Evicted cached result: {victim}")
+
+
+class Flight:
+    """A render in progress, shared by the job that queued it and its duplicates."""
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.followers = 0
+
+    def wait(self, timeout: float | None = None) -> tuple[str, list[dict]]:
+        """
+        Wait for the render.
+
+        Returns:
+            Tuple of (prompt_id, output file info dicts)
+
+        Raises:
+            concurrent.futures.TimeoutError: If it doesn't finish in time
+            Exception: Whatever the rendering job failed with
+        """
+        return self.future.result(timeout)
+
+
+class InflightTable:
+    """
+    Renders in progress, by result key.
+
+    The first job with a key owns the render and must finish or fail it;
+    identical jobs arriving before then join it and get the same prompt
+    and outputs. Once finished the key is free again, so later duplicates
+    go through the result cache instead.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        """
+        Get the render for a key, starting one if there is none.
+
+        Returns:
+            Tuple of (flight, whether the caller owns it)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(
+        self,
+        key: str,
+        flight: Flight,
+        prompt_id: str,
+        output_files: list[dict],
+        retain: Callable[[int], None] | None = None
+    ) -> None:
+        """
+        Hand a finished render to its followers.
+
+        Args:
+            retain: Called with the final follower count after the key is
+                closed and before followers are woken, to keep the output
+                files around for each of them
+        """
+        followers = self._close(key, flight)
+        if followers and retain is not None:
+            retain(followers)
+        flight.future.set_result((prompt_id, output_files))
+
+    def fail(self, key: str, flight: Flight, error: BaseException) -> None:
+        """Fail a render's followers with the owner's error."""
+        self._close(key, flight)
+        if not flight.future.done():
+            flight.future.set_exception(error)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def _close(self, key: str, flight: Flight) -> int:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight.followers
+
+
+def shared_store_from_url(url: str) -> SharedResultStore:
+    """
+    Build a shared store from s3://bucket/prefix or a directory path.
+    """
+    if url.startswith("s3://"):
+        parsed = urlparse(url)
+        prefix = parsed.path.lstrip("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        return S3ResultStore(parsed.netloc, prefix)
+    return DirectoryResultStore(url)
@@ -0,0 +1,162 @@
+"""
+Render Scheduling
+
+Orders prompts waiting for ComfyUI by estimated cost instead of arrival.
+Shortest job first keeps short renders from queueing behind long ones;
+aging takes a share of each waiting prompt's wait off its estimate, so
+a long render stops being overtaken once it has waited long enough and
+can't starve. Prompts needing the model set that is resident (the one
+the prompt queued last loads) get a bonus worth roughly a model reload,
+so ComfyUI keeps its loaded models for as long as that doesn't cost
+more than it saves.
+
+The scheduler only picks; QueueDepthGate asks it which waiting prompt
+goes next, and batch mode uses order() to sequence its items.
+ModelResidency follows the resident set and counts the swaps made and
+avoided.
+"""
+
+import time
+import itertools
+import threading
+
+POLICIES = ("fifo", "sjf")
+
+_sequence = itertools.count()
+
+
+class SchedulerError(Exception):
+    """Raised for invalid scheduler settings."""
+    pass
+
+
+class Ticket:
+    """
+    A prompt waiting to be queued.
+
+    Args:
+        cost: Estimated execution seconds
+        group: Key of the model set the prompt loads (see
+            comfy_bridge.model_set_key); prompts of one group reuse
+            loaded models
+        label: Name for logs
+    """
+
+    def __init__(self, cost: float = 0.0, group: str | None = None, label: str = "", arrived: float | None = None):
+        self.cost = cost
+        self.group = group
+        self.label = label
+        self.arrived = time.monotonic() if arrived is None else arrived
+        self.seq = next(_sequence)
+
+    def __repr__(self) -> str:
+        return f"Ticket({self.label or self.seq}, cost={self.cost:.1f}, group={self.group})"
+
+
+class Scheduler:
+    """
+    Picks the next ticket to queue.
+
+    Args:
+        policy: "sjf" (shortest job first with aging) or "fifo"
+        aging: Seconds of estimated cost forgiven per second waited
+        group_bonus: Seconds of estimated cost forgiven for needing the
+            resident model set, about what a model reload costs
+    """
+
+    def __init__(self, policy: str = "sjf", aging: float = 0.2, group_bonus: float = 60.0):
+        if policy not in POLICIES:
+            raise SchedulerError(f"Unknown scheduler policy '{policy}', expected one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.aging = aging
+        self.group_bonus = group_bonus
+
+    def priority(self, ticket: Ticket, now: float, last_group: str | None = None) -> tuple[float, int]:
+        """Sort key of a ticket; lowest goes first, ties in arrival order."""
+        if self.policy == "fifo":
+            return (0.0, ticket.seq)
+        effective = ticket.cost - self.aging * max(now - ticket.arrived, 0.0)
+        if ticket.group is not None and ticket.group == last_group:
+            effective -= self.group_bonus
+        return (effective, ticket.seq)
+
+    def pick(self, tickets: list[Ticket], now: float | None = None, last_group: str | None = None) -> Ticket | None:
+        """The ticket to queue next, or None if there are none."""
+        if not tickets:
+            return None
+        now = time.monotonic() if now is None else now
+        return min(tickets, key=lambda ticket: self.priority(ticket, now, last_group))
+
+    def order(
+        self,
+        tickets: list[Ticket],
+        now: float | None = None,
+        last_group: str | None = None
+    ) -> list[Ticket]:
+        """
+        Sequence tickets queued all at once, as ComfyUI will run them.
+
+        Each pick advances the clock by the picked ticket's cost, so aging
+        and grouping play out as they would if the tickets were picked one
+        at a time as ComfyUI freed up.
+        """
+        now = time.monotonic() if now is None else now
+        remaining = list(tickets)
+        ordered = []
+        while remaining:
+            ticket = self.pick(remaining, now, last_group)
+            remaining.remove(ticket)
+            ordered.append(ticket)
+            now += ticket.cost
+            last_group = ticket.group
+        return ordered
+
+
+class ModelResidency:
+    """
+    Tracks which model set ComfyUI has loaded, from the prompts queued.
+
+    ComfyUI keeps the models of the prompt it ran last, so a prompt whose
+    model set differs from the one queued before it swaps them. Groups
+    are model set keys; prompts with no known set (None) don't change
+    what's resident.
+    """
+
+    def __init__(self):
+        self.resident: str | None = None
+        self.swaps = 0
+        self.avoided = 0
+        self._lock = threading.Lock()
+
+    def queued(self, group: str | None) -> bool:
+        """Record a prompt queued; True if it swaps the resident models."""
+        if group is None:
+            return False
+        with self._lock:
+            swap = self.resident is not None and group != self.resident
+            self.resident = group
+            self.swaps += swap
+        return swap
+
+    def keeps_resident(self, group: str | None) -> bool:
+        return self.resident is not None and group == self.resident
+
+    def record_avoided(self, count: int = 1) -> None:
+        """Count swaps arrival order would have made and the scheduler didn't."""
+        with self._lock:
+            self.avoided += count
+
+    def counters(self) -> dict[str, int]:
+        with self._lock:
+            return {"model_swaps": self.swaps, "model_swaps_avoided": self.avoided}
+
+
+def count_swaps(groups: list[str | None], resident: str | None = None) -> int:
+    """Model swaps running prompts of these groups in order would make."""
+    swaps = 0
+    for group in groups:
+        if group is None:
+            continue
+        swaps += resident is not None and group != resident
+        resident = group
+    return swaps
@@ -0,0 +1,14 @@
+"""
+Shared pytest fixtures.
+"""
+
+import pytest
+
+from tests.fake_comfy import FakeComfyServer
+
+
+@pytest.fixture
+def fake_comfy():
+    """A running fake ComfyUI server, stopped after the test."""
+    with FakeComfyServer() as server:
+        yield server
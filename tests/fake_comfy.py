@@ -0,0 +1,351 @@
+"""
+Fake ComfyUI server for tests.
+
+Serves the subset of ComfyUI's HTTP and websocket API that the bridge uses,
+on a free local port in a background thread. Prompts are "rendered" one at a
+time by a single worker, emitting the same event sequence ComfyUI does:
+execution_start, executing/progress/executed per node, execution_success and
+finally executing with node=None once the history entry has been written.
+Interrupts stop the running prompt at its next step (execution_interrupted)
+and queue deletes drop pending ones, as ComfyUI does. With node_cache, nodes
+identical (by class, inputs and upstream nodes) to one in the prompt before
+are reported in execution_cached and skipped, like ComfyUI's default cache.
+"""
+
+import asyncio
+import json
+import struct
+import threading
+import time
+import uuid
+from typing import Any
+
+from aiohttp import web, WSMsgType
+
+
+DEFAULT_OUTPUTS = {
+    "75": {"gifs": [{"filename": "LTX-2_00001_.mp4", "subfolder": "video", "type": "output"}]}
+}
+
+
+class FakeComfyServer:
+    """Minimal ComfyUI stand-in driven by an asyncio loop in a daemon thread."""
+
+    def __init__(
+        self,
+        render_time: float = 0.05,
+        steps: int = 4,
+        outputs: dict[str, Any] | None = None,
+        websocket: bool = True,
+        drop_socket_after: float | None = None,
+        fail_with: str | None = None,
+        http_errors: int = 0,
+        previews: bool = False,
+        node_cache: bool = False,
+    ):
+        self.render_time = render_time
+        self.steps = steps
+        self.outputs = outputs if outputs is not None else DEFAULT_OUTPUTS
+        self.websocket = websocket
+        self.drop_socket_after = drop_socket_after
+        self.fail_with = fail_with
+        self.http_errors = http_errors
+        self.previews = previews
+        self.node_cache = node_cache
+
+        self.host = "127.0.0.1"
+        self.port = None
+        self.prompts: dict[str, dict] = {}
+        self.history: dict[str, dict] = {}
+        self.completed_at: dict[str, float] = {}
+        self.request_counts: dict[str, int] = {}
+        self.peers: set = set()
+        self.ws_connections = 0
+        self.max_queue_depth = 0
+        self.interrupted: dict[str, float] = {}
+        self.deleted: list[str] = []
+        self.cached: dict[str, list[str]] = {}
+
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._queue: asyncio.Queue | None = None
+        self._pending: list[str] = []
+        self._running: str | None = None
+        self._interrupt_requested = False
+        self._cache_keys: set[str] = set()
+        self._sockets: dict[str, web.WebSocketResponse] = {}
+        self._started = threading.Event()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> "FakeComfyServer":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._started.wait(5):
+            raise RuntimeError("Fake ComfyUI server failed to start")
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+    def __enter__(self) -> "FakeComfyServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._setup())
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _setup(self) -> None:
+        app = web.Application(middlewares=[self._count_requests])
+        app.router.add_get("/system_stats", self._system_stats)
+        app.router.add_post("/prompt", self._prompt)
+        app.router.add_get("/history/{prompt_id}", self._history)
+        app.router.add_get("/queue", self._get_queue)
+        app.router.add_post("/queue", self._post_queue)
+        app.router.add_post("/interrupt", self._interrupt)
+        if self.websocket:
+            app.router.add_get("/ws", self._ws)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._render_worker())
+
+    async def _shutdown(self) -> None:
+        self._worker.cancel()
+        for ws in list(self._sockets.values()):
+            await ws.close()
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _count_requests(self, request, handler):
+        key = request.path.split("/")[1] if request.path != "/" else "/"
+        self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if request.method == "GET" and self.http_errors > 0:
+            self.http_errors -= 1
+            return web.Response(status=503)
+        return await handler(request)
+
+    # -- HTTP API ----------------------------------------------------------
+
+    async def _system_stats(self, request):
+        return web.json_response({
+            "system": {"os": "posix", "comfyui_version": "fake"},
+            "devices": [{
+                "name": "cuda:0 Fake GPU",
+                "type": "cuda",
+                "vram_total": 80 * 1024 ** 3,
+                "vram_free": 78 * 1024 ** 3,
+            }],
+        })
+
+    async def _prompt(self, request):
+        payload = await request.json()
+        prompt_id = uuid.uuid4().hex
+        self.prompts[prompt_id] = payload
+        self._pending.append(prompt_id)
+        depth = len(self._pending) + (1 if self._running else 0)
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        await self._queue.put(prompt_id)
+        return web.json_response({"prompt_id": prompt_id, "number": len(self.prompts), "node_errors": {}})
+
+    async def _history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id in self.history:
+            return web.json_response({prompt_id: self.history[prompt_id]})
+        return web.json_response({})
+
+    async def _get_queue(self, request):
+        def entry(number, prompt_id):
+            payload = self.prompts[prompt_id]
+            return [number, prompt_id, payload.get("prompt", {}), {"client_id": payload.get("client_id")}, []]
+
+        running = [entry(0, self._running)] if self._running else []
+        pending = [entry(i + 1, pid) for i, pid in enumerate(self._pending)]
+        return web.json_response({"queue_running": running, "queue_pending": pending})
+
+    async def _post_queue(self, request):
+        payload = await request.json()
+        for prompt_id in payload.get("delete", []):
+            if prompt_id in self._pending:
+                self._pending.remove(prompt_id)
+                self.deleted.append(prompt_id)
+        return web.Response(status=200)
+
+    async def _interrupt(self, request):
+        payload = await request.json() if request.can_read_body else None
+        target = (payload or {}).get("prompt_id")
+        if self._running and target in (None, self._running):
+            self._interrupt_requested = True
+        return web.Response(status=200)
+
+    async def _ws(self, request):
+        client_id = request.query.get("clientId", "")
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.ws_connections += 1
+        # Like ComfyUI, a reconnecting client id replaces the old socket,
+        # which stays open but gets no more events
+        self._sockets[client_id] = ws
+        await ws.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(self._pending)}}, "sid": client_id}})
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            if self._sockets.get(client_id) is ws:
+                del self._sockets[client_id]
+        return ws
+
+    # -- rendering ---------------------------------------------------------
+
+    async def _send(self, client_id: str, event_type: str, data: dict) -> None:
+        ws = self._sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps({"type": event_type, "data": data}))
+
+    @staticmethod
+    def _node_keys(workflow: dict) -> dict[str, str]:
+        keys: dict[str, str] = {}
+
+        def key(node_id: str) -> str:
+            if node_id not in keys:
+                node = workflow.get(node_id, {})
+                inputs = {
+                    name: [key(value[0]), value[1]] if isinstance(value, list) and len(value) == 2
+                    and isinstance(value[0], str) and value[0] in workflow else value
+                    for name, value in node.get("inputs", {}).items()
+                }
+                keys[node_id] = json.dumps([node.get("class_type"), inputs], sort_keys=True)
+            return keys[node_id]
+
+        for node_id in workflow:
+            key(node_id)
+        return keys
+
+    async def _send_preview(self, client_id: str, step: int) -> None:
+        # PREVIEW_IMAGE frame: event type 1, format 1 (JPEG), image bytes
+        ws = self._sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_bytes(struct.pack(">II", 1, 1) + b"\xff\xd8preview-%d" % step)
+
+    async def _interrupted(self, prompt_id: str, client_id: str, workflow: dict, started: dict, node_id: str) -> None:
+        base = {"prompt_id": prompt_id}
+        interrupted = {**base, "node_id": node_id, "node_type": workflow.get(node_id, {}).get("class_type", "Unknown"),
+                       "executed": [], "timestamp": int(time.time() * 1000)}
+        self.history[prompt_id] = {
+            "prompt": workflow,
+            "outputs": {},
+            "status": {"status_str": "error", "completed": False, "messages": [
+                ["execution_start", started],
+                ["execution_interrupted", interrupted],
+            ]},
+        }
+        self.interrupted[prompt_id] = time.perf_counter()
+        self.completed_at[prompt_id] = time.perf_counter()
+        await self._send(client_id, "execution_interrupted", interrupted)
+
+    async def _drop_sockets(self, client_id: str) -> None:
+        ws = self._sockets.get(client_id)
+        if ws is not None:
+            await ws.close()
+
+    async def _render_worker(self) -> None:
+        while True:
+            prompt_id = await self._queue.get()
+            if prompt_id not in self._pending:
+                continue
+            self._pending.remove(prompt_id)
+            self._running = prompt_id
+            self._interrupt_requested = False
+            try:
+                await self._render(prompt_id)
+            finally:
+                self._running = None
+
+    async def _render(self, prompt_id: str) -> None:
+        payload = self.prompts[prompt_id]
+        client_id = payload.get("client_id", "")
+        workflow = payload.get("prompt", {})
+        node_ids = list(workflow) or ["1"]
+        base = {"prompt_id": prompt_id}
+        started = {**base, "timestamp": int(time.time() * 1000)}
+
+        await self._send(client_id, "execution_start", started)
+        if self.node_cache:
+            keys = self._node_keys(workflow)
+            cached = [node_id for node_id in node_ids if keys.get(node_id) in self._cache_keys]
+            self._cache_keys = set(keys.values())
+            self.cached[prompt_id] = cached
+            if cached:
+                await self._send(client_id, "execution_cached", {**base, "nodes": cached})
+                node_ids = [node_id for node_id in node_ids if node_id not in cached]
+        if self.drop_socket_after is not None:
+            await asyncio.sleep(self.drop_socket_after)
+            await self._drop_sockets(client_id)
+
+        step_time = self.render_time / (len(node_ids) + self.steps)
+        for index, node_id in enumerate(node_ids):
+            await self._send(client_id, "executing", {**base, "node": node_id, "display_node": node_id})
+            if index == 0:
+                for step in range(1, self.steps + 1):
+                    await asyncio.sleep(step_time)
+                    if self._interrupt_requested:
+                        await self._interrupted(prompt_id, client_id, workflow, started, node_id)
+                        return
+                    await self._send(client_id, "progress", {**base, "node": node_id, "value": step, "max": self.steps})
+                    if self.previews:
+                        await self._send_preview(client_id, step)
+            await asyncio.sleep(step_time)
+
+            if self.fail_with and index == len(node_ids) - 1:
+                self.history[prompt_id] = {
+                    "prompt": workflow,
+                    "outputs": {},
+                    "status": {"status_str": "error", "completed": False, "messages": [
+                        ["execution_start", started],
+                        ["execution_error", {**base, "exception_message": self.fail_with, "timestamp": int(time.time() * 1000)}],
+                    ]},
+                }
+                self.completed_at[prompt_id] = time.perf_counter()
+                await self._send(client_id, "execution_error", {
+                    **base,
+                    "node_id": node_id,
+                    "node_type": workflow.get(node_id, {}).get("class_type", "Unknown"),
+                    "exception_message": self.fail_with,
+                    "exception_type": "RuntimeError",
+                })
+                return
+
+            if node_id in self.outputs:
+                await self._send(client_id, "executed", {**base, "node": node_id, "display_node": node_id, "output": self.outputs[node_id]})
+
+        finished = {**base, "timestamp": int(time.time() * 1000)}
+        self.history[prompt_id] = {
+            "prompt": workflow,
+            "outputs": self.outputs,
+            "status": {"status_str": "success", "completed": True, "messages": [
+                ["execution_start", started],
+                ["execution_success", finished],
+            ]},
+        }
+        await self._send(client_id, "execution_success", finished)
+        self.completed_at[prompt_id] = time.perf_counter()
+        await self._send(client_id, "executing", {**base, "node": None, "display_node": None})
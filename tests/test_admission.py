@@ -0,0 +1,157 @@
+"""
+Tests for render cost estimation and admission control.
+"""
+
+import sys
+import os
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from admission import (
+    DIMENSION_MULTIPLE,
+    CostModel,
+    apply_shape,
+    is_oom_error,
+    latent_tokens,
+    workflow_family,
+    workflow_shape,
+)
+from comfy_bridge import load_workflow
+
+
+WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+GIB = 1024 ** 3
+
+
+def template(name: str) -> dict:
+    return load_workflow(os.path.join(WORKFLOW_DIR, name))
+
+
+def shape(width: int, height: int, frames: int = 121, steps: int = 20) -> dict:
+    return {"width": width, "height": height, "frames": frames, "steps": steps,
+            "sources": {"width": ("1", "width"), "height": ("1", "height")}}
+
+
+class TestWorkflowShape:
+    """Tests for reading render size from workflows."""
+
+    def test_t2v_template(self):
+        """Test size comes from the empty image and steps add up over both passes."""
+        found = workflow_shape(template("LTX-2_00041_.json"))
+
+        assert (found["width"], found["height"], found["frames"], found["steps"]) == (720, 1280, 121, 23)
+        assert found["sources"]["width"] == ("92:89", "width")
+
+    def test_i2v_template(self):
+        """Test size comes from the latent video node."""
+        found = workflow_shape(template("LTX2_I2V.json"))
+
+        assert (found["width"], found["height"], found["frames"], found["steps"]) == (768, 512, 105, 20)
+
+    def test_unknown_size(self):
+        """Test workflows without a size node have no shape."""
+        assert workflow_shape({"1": {"class_type": "SaveVideo", "inputs": {}}}) is None
+
+    def test_apply_shape(self):
+        """Test a new size is written where it was read."""
+        workflow = template("LTX-2_00041_.json")
+        found = workflow_shape(workflow)
+
+        apply_shape(workflow, found, 512, 896)
+
+        assert (workflow_shape(workflow)["width"], workflow_shape(workflow)["height"]) == (512, 896)
+
+    def test_family_ignores_values(self):
+        """Test jobs from one template share a family whatever their settings."""
+        workflow = template("LTX2_I2V.json")
+        resized = template("LTX2_I2V.json")
+        apply_shape(resized, workflow_shape(resized), 1024, 576)
+
+        assert workflow_family(resized) == workflow_family(workflow)
+        assert workflow_family(template("LTX-2_00041_.json")) != workflow_family(workflow)
+
+
+class TestCostModel:
+    """Tests for estimates, admission decisions and calibration."""
+
+    def test_prior_alone_never_rejects(self):
+        """Test an estimate over budget is admitted until the family runs out of VRAM."""
+        model = CostModel()
+        large = shape(1920, 1088)
+
+        decision = model.decide("f", large, 16 * GIB)
+
+        assert decision["action"] == "admit"
+        assert decision["estimate"]["vram_bytes"] > 16 * GIB
+        assert model.decide("f", large, 16 * GIB, policy="downscale")["action"] == "admit"
+
+    def test_downscale_fits_budget(self):
+        """Test downscaling picks the largest aligned size that fits."""
+        model = CostModel()
+        model.observe_oom("f", shape(1920, 1088), 16 * GIB)
+
+        decision = model.decide("f", shape(1920, 1088), 16 * GIB, policy="downscale")
+
+        assert decision["action"] == "downscale"
+        assert decision["width"] % DIMENSION_MULTIPLE == 0 and decision["height"] % DIMENSION_MULTIPLE == 0
+        assert decision["width"] > decision["height"]
+        fitted = shape(decision["width"], decision["height"])
+        bigger = shape(decision["width"] + DIMENSION_MULTIPLE, decision["height"] + DIMENSION_MULTIPLE)
+        assert model.decide("f", fitted, 16 * GIB)["action"] == "admit"
+        assert model.decide("f", bigger, 16 * GIB)["action"] == "reject"
+
+    def test_oom_rejects_same_shape(self):
+        """Test a render that ran out of VRAM is no longer admitted."""
+        model = CostModel()
+        render = shape(768, 512)
+        assert model.decide("f", render, 12 * GIB)["action"] == "admit"
+
+        model.observe_oom("f", render, 12 * GIB)
+
+        assert model.decide("f", render, 12 * GIB)["action"] == "reject"
+        assert model.decide("other", render, 12 * GIB)["action"] == "admit"
+
+    def test_oom_keeps_smaller_shapes(self):
+        """Test running out of VRAM rejects that shape but not much smaller ones."""
+        model = CostModel()
+        model.observe_oom("f", shape(1920, 1088), 12 * GIB)
+
+        assert model.decide("f", shape(1920, 1088), 12 * GIB)["action"] == "reject"
+        assert model.decide("f", shape(1280, 704), 12 * GIB)["action"] == "admit"
+
+    def test_success_caps_estimate(self):
+        """Test a render that fit brings its estimate within the budget it ran in."""
+        model = CostModel()
+        render = shape(1280, 720)
+        assert model.estimate("f", render)["vram_bytes"] > 12 * GIB
+
+        model.observe("f", render, 60.0, 12 * GIB)
+
+        assert model.estimate("f", render)["vram_bytes"] <= 12 * GIB
+
+    def test_runtime_fit(self):
+        """Test execution time is fitted from recorded renders."""
+        model = CostModel()
+        for width, height, steps in ((512, 512, 20), (768, 512, 20), (1024, 576, 30)):
+            render = shape(width, height, steps=steps)
+            work = latent_tokens(width, height, 121) * steps
+            model.observe("f", render, 12.0 + 2e-4 * work)
+
+        estimate = model.estimate("f", shape(1280, 704, steps=25))
+
+        expected = 12.0 + 2e-4 * latent_tokens(1280, 704, 121) * 25
+        assert abs(estimate["seconds"] - expected) < 0.1
+
+    def test_history_replay(self, tmp_path):
+        """Test a restarted worker keeps what earlier renders taught it."""
+        history = tmp_path / "history.jsonl"
+        render = shape(768, 512)
+        CostModel(history).observe_oom("f", render, 12 * GIB)
+
+        assert CostModel(history).decide("f", render, 12 * GIB)["action"] == "reject"
+
+    def test_oom_error_detection(self):
+        assert is_oom_error("torch.OutOfMemoryError: Allocation on device")
+        assert is_oom_error("CUDA out of memory. Tried to allocate 2.00 GiB")
+        assert not is_oom_error("Prompt outputs failed validation")
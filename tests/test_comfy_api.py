@@ -5,19 +5,38 @@ Tests for the ComfyUI API client.
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 import json
+import struct
 import sys
 import os
+import time
+import requests
 
 # Add src to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from comfy_bridge import (
     ComfyClient,
+    add_preview_branch,
+    cache_reuse,
+    is_preview_node,
+    parse_preview_frame,
     ComfyAPIError,
+    ExecutionProfile,
+    execution_timestamps,
     extract_output_files,
     load_workflow,
     inject_params,
+    clone_workflow,
+    index_media_loaders,
+    model_set,
+    model_set_key,
+    node_signatures,
+    InjectionPlan,
+    WorkflowCache,
+    WorkflowGraphError,
+    prune_workflow,
 )
+from tests.fake_comfy import FakeComfyServer
 
 
 class TestComfyClient:
@@ -35,21 +54,28 @@ class TestComfyClient:
         assert client.base_url == "http://localhost:9000"
         assert client.timeout == 60
 
-    @patch('comfy_bridge.requests.get')
+    def test_endpoint_timeouts(self):
+        """Test per-endpoint timeouts override the default."""
+        client = ComfyClient(timeout=60, endpoint_timeouts={"prompt": 120})
+        assert client._timeout("prompt") == 120
+        assert client._timeout("ready") == 5
+        assert client._timeout("upload") == 60
+
+    @patch('comfy_bridge.requests.Session.get')
     def test_is_ready_success(self, mock_get):
         """Test is_ready returns True when server responds."""
         mock_get.return_value.status_code = 200
         client = ComfyClient()
         assert client.is_ready() is True
 
-    @patch('comfy_bridge.requests.get')
+    @patch('comfy_bridge.requests.Session.get')
     def test_is_ready_failure(self, mock_get):
         """Test is_ready returns False when server doesn't respond."""
-        mock_get.side_effect = Exception("Connection refused")
+        mock_get.side_effect = requests.ConnectionError("Connection refused")
         client = ComfyClient()
         assert client.is_ready() is False
 
-    @patch('comfy_bridge.requests.post')
+    @patch('comfy_bridge.requests.Session.post')
     def test_queue_prompt_success(self, mock_post):
         """Test successful prompt queuing."""
         mock_post.return_value.status_code = 200
@@ -62,7 +88,7 @@ class TestComfyClient:
         assert prompt_id == "abc123"
         mock_post.assert_called_once()
 
-    @patch('comfy_bridge.requests.post')
+    @patch('comfy_bridge.requests.Session.post')
     def test_queue_prompt_no_prompt_id(self, mock_post):
         """Test queue_prompt raises error when no prompt_id returned."""
         mock_post.return_value.status_code = 200
@@ -73,7 +99,7 @@ class TestComfyClient:
         with pytest.raises(ComfyAPIError, match="No prompt_id"):
             client.queue_prompt({"test": "workflow"})
 
-    @patch('comfy_bridge.requests.get')
+    @patch('comfy_bridge.requests.Session.get')
     def test_get_history_success(self, mock_get):
         """Test successful history retrieval."""
         expected = {"outputs": {"1": {"images": []}}}
@@ -86,7 +112,7 @@ class TestComfyClient:
 
         assert history == expected
 
-    @patch('comfy_bridge.requests.get')
+    @patch('comfy_bridge.requests.Session.get')
     def test_get_history_not_found(self, mock_get):
         """Test history returns None when prompt not found."""
         mock_get.return_value.status_code = 200
@@ -99,6 +125,36 @@ class TestComfyClient:
         assert history is None
 
 
+class TestSessionTransport:
+    """Tests for the pooled HTTP session against a fake ComfyUI server."""
+
+    def test_connections_are_reused(self, fake_comfy):
+        """Test repeated calls share one keep-alive connection."""
+        client = ComfyClient(port=fake_comfy.port)
+        for _ in range(10):
+            client.get_history("missing")
+            client.get_queue()
+
+        assert len(fake_comfy.peers) == 1
+
+    def test_get_retried_on_server_error(self):
+        """Test idempotent GETs are retried on 5xx responses."""
+        with FakeComfyServer(http_errors=2) as server:
+            client = ComfyClient(port=server.port, backoff_factor=0)
+            assert client.get_queue() == {"queue_running": [], "queue_pending": []}
+
+        assert server.request_counts["queue"] == 3
+
+    def test_get_fails_after_retries_exhausted(self):
+        """Test errors surface once retries are used up."""
+        with FakeComfyServer(http_errors=5) as server:
+            client = ComfyClient(port=server.port, retries=1, backoff_factor=0)
+            with pytest.raises(ComfyAPIError, match="Failed to get queue"):
+                client.get_queue()
+
+        assert server.request_counts["queue"] == 2
+
+
 class TestExtractOutputFiles:
     """Tests for extract_output_files function."""
 
@@ -223,3 +279,665 @@ class TestLoadWorkflow:
         """Test loading a file that doesn't exist."""
         with pytest.raises(FileNotFoundError):
             load_workflow("/nonexistent/path.json")
+
+
+class TestPruneWorkflow:
+    """Tests for local graph checks and pruning."""
+
+    WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+    GRAPH = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "ltx.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a fox", "clip": ["1", 1]}},
+        "3": {"class_type": "VAEDecode", "inputs": {"samples": ["2", 0], "vae": ["1", 2]}},
+        "4": {"class_type": "SaveVideo", "inputs": {"video": ["3", 0]}},
+        "5": {"class_type": "CLIPTextEncode", "inputs": {"text": "unused", "clip": ["1", 1]}},
+    }
+
+    def test_prunes_nodes_no_output_needs(self):
+        """Test nodes outside every output's dependencies are removed."""
+        pruned, removed = prune_workflow(self.GRAPH)
+
+        assert removed == ["5"]
+        assert list(pruned) == ["1", "2", "3", "4"]
+        assert "5" in self.GRAPH
+
+    def test_valid_graph_returned_as_is(self):
+        """Test a graph with nothing to prune is not copied."""
+        graph = {key: value for key, value in self.GRAPH.items() if key != "5"}
+
+        assert prune_workflow(graph) == (graph, [])
+        assert prune_workflow(graph)[0] is graph
+
+    def test_missing_link_target(self):
+        """Test links to missing nodes are all reported."""
+        graph = {**self.GRAPH, "3": {"class_type": "VAEDecode", "inputs": {"samples": ["9", 0], "vae": ["8", 2]}}}
+
+        with pytest.raises(WorkflowGraphError, match="missing node 9.*missing node 8"):
+            prune_workflow(graph)
+
+    def test_cycle(self):
+        """Test cycles among the nodes to run are rejected."""
+        graph = {**self.GRAPH, "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "x", "clip": ["3", 0]}}}
+
+        with pytest.raises(WorkflowGraphError, match=r"cycle through nodes \['2', '3'\]"):
+            prune_workflow(graph)
+
+    def test_malformed_nodes(self):
+        """Test nodes without a class_type and empty workflows are rejected."""
+        with pytest.raises(WorkflowGraphError, match="node 1 has no class_type"):
+            prune_workflow({"1": {"inputs": {}}})
+        with pytest.raises(WorkflowGraphError, match="non-empty"):
+            prune_workflow({})
+
+    def test_no_known_output_keeps_graph(self):
+        """Test graphs with only unknown output nodes are left whole."""
+        graph = {
+            "1": {"class_type": "LoadImage", "inputs": {"image": "ref.png"}},
+            "2": {"class_type": "CustomUploader", "inputs": {"images": ["1", 0]}},
+        }
+
+        assert prune_workflow(graph) == (graph, [])
+
+    def test_custom_outputs_next_to_known_ones_kept(self):
+        """Test dead ends of unknown classes are kept with what they need."""
+        graph = {
+            **self.GRAPH,
+            "6": {"class_type": "MyCustomSaveImage", "inputs": {"images": ["5", 0]}},
+            "7": {"class_type": "PreviewAny", "inputs": {"source": ["2", 0]}},
+        }
+
+        pruned, removed = prune_workflow(graph)
+
+        assert removed == []
+        assert pruned is graph
+
+    def test_templates(self):
+        """Test the shipped templates pass, with the I2V dead guide node pruned."""
+        t2v = load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX-2_00041_.json"))
+        i2v = load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX2_I2V.json"))
+
+        assert prune_workflow(t2v)[1] == []
+        assert prune_workflow(i2v)[1] == ["45"]
+
+    def test_under_a_millisecond(self):
+        """Test checking a full template takes well under a millisecond."""
+        workflow = load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX-2_00041_.json"))
+
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            prune_workflow(workflow)
+            timings.append(time.perf_counter() - start)
+
+        assert min(timings) < 0.001
+
+
+class TestNodeSignatures:
+    """Tests for predicting ComfyUI node cache hits."""
+
+    GRAPH = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "ltx.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a fox", "clip": ["1", 1]}},
+        "3": {"class_type": "RandomNoise", "inputs": {"noise_seed": 1}},
+        "4": {"class_type": "SamplerCustomAdvanced", "inputs": {"noise": ["3", 0], "guider": ["2", 0]}},
+        "5": {"class_type": "SaveVideo", "inputs": {"video": ["4", 0]}},
+    }
+
+    def _with(self, node_id, **inputs):
+        graph = clone_workflow(self.GRAPH)
+        graph[node_id]["inputs"].update(inputs)
+        return graph
+
+    def test_keys_follow_upstream_changes(self):
+        """Test a changed input changes its node's key and every key downstream."""
+        before = node_signatures(self.GRAPH)
+        after = node_signatures(self._with("3", noise_seed=2))
+
+        assert [node_id for node_id in before if before[node_id] != after[node_id]] == ["3", "4", "5"]
+
+    def test_keys_ignore_node_ids(self):
+        """Test the same subgraph under other IDs gets the same keys."""
+        renamed = {
+            "a": self.GRAPH["1"],
+            "b": {"class_type": "CLIPTextEncode", "inputs": {"text": "a fox", "clip": ["a", 1]}},
+        }
+
+        assert node_signatures(renamed)["b"] == node_signatures(self.GRAPH)["2"]
+
+    def test_cache_reuse_is_from_previous_prompt_only(self):
+        """Test reuse counts nodes shared with the prompt just before."""
+        fox_1, fox_2, owl = self.GRAPH, self._with("3", noise_seed=2), self._with("2", text="an owl")
+
+        assert cache_reuse([fox_1, fox_2, owl]) == [set(), {"1", "2"}, {"1"}]
+        # The fox encoding is gone once the owl prompt ran
+        assert cache_reuse([fox_1, owl, fox_2]) == [set(), {"1", "3"}, {"1"}]
+
+
+class TestExecutionTimestamps:
+    """Tests for reading execution times from history entries."""
+
+    def test_success(self):
+        """Test start and end come from the status messages."""
+        history = {"status": {"messages": [
+            ["execution_start", {"prompt_id": "p", "timestamp": 1000500}],
+            ["execution_cached", {"prompt_id": "p", "nodes": [], "timestamp": 1000600}],
+            ["execution_success", {"prompt_id": "p", "timestamp": 1003000}],
+        ]}}
+        assert execution_timestamps(history) == (1000.5, 1003.0)
+
+    def test_missing(self):
+        """Test entries without both timestamps give None."""
+        assert execution_timestamps({"outputs": {}}) is None
+        assert execution_timestamps({"status": {"messages": [["execution_start", {"timestamp": 1}]]}}) is None
+
+
+class TestExecutionProfile:
+    """Tests for per-node timing from websocket events."""
+
+    WORKFLOW = {
+        "1": {"class_type": "CLIPTextEncode", "inputs": {}, "_meta": {"title": "Prompt"}},
+        "2": {"class_type": "SamplerCustomAdvanced", "inputs": {}},
+        "3": {"class_type": "VAEDecode", "inputs": {}},
+        "4": {"class_type": "SaveVideo", "inputs": {}},
+    }
+
+    def test_node_timings(self):
+        """Test each node is timed from its executing event to the next."""
+        profile = ExecutionProfile(self.WORKFLOW)
+        events = [
+            (0.0, "execution_cached", {"nodes": ["1"]}),
+            (0.0, "executing", {"node": "2"}),
+            (1.0, "progress", {"value": 1, "max": 3}),
+            (1.5, "progress", {"value": 2, "max": 3}),
+            (2.0, "progress", {"value": 3, "max": 3}),
+            (2.2, "executing", {"node": "3"}),
+            (2.7, "executing", {"node": "4"}),
+            (2.8, "executed", {"node": "4"}),
+            (2.9, "execution_success", {}),
+            (2.9, "executing", {"node": None}),
+        ]
+        for now, event_type, data in events:
+            profile.handle(event_type, data, now)
+
+        nodes = {node["node_id"]: node for node in profile.summary()}
+        assert [node["node_id"] for node in profile.summary()] == ["2", "3", "4", "1"]
+        assert nodes["2"]["class_type"] == "SamplerCustomAdvanced"
+        assert nodes["2"]["seconds"] == pytest.approx(2.2)
+        assert nodes["2"]["steps"] == 3
+        assert nodes["2"]["seconds_per_step"] == pytest.approx(0.5)
+        assert nodes["3"]["seconds"] == pytest.approx(0.5)
+        assert nodes["4"]["output"] is True
+        assert nodes["1"] == {"node_id": "1", "class_type": "CLIPTextEncode", "title": "Prompt",
+                              "seconds": 0.0, "cached": True}
+
+    def test_step_progress(self):
+        """Test progress reports sampler steps and never goes back."""
+        profile = ExecutionProfile(self.WORKFLOW)
+        profile.handle("executing", {"node": "1"}, 0.0)
+        profile.handle("executing", {"node": "2"}, 0.1)
+        assert profile.handle("progress", {"value": 2, "max": 4}, 0.2)
+
+        percent, message = profile.progress()
+        assert message == "SamplerCustomAdvanced step 2/4"
+        assert percent == 37  # (1 node + 2/4 steps) of 4 nodes
+
+        profile.handle("executing", {"node": "3"}, 0.3)
+        assert profile.progress() == (50, "Running VAEDecode")
+
+    def test_unknown_workflow(self):
+        """Test a profile without the workflow still reports steps."""
+        profile = ExecutionProfile()
+        profile.handle("executing", {"node": "7"}, 0.0)
+        profile.handle("progress", {"value": 5, "max": 10}, 0.1)
+
+        assert profile.progress() == (50, "node 7 step 5/10")
+
+
+class TestWaitForReady:
+    """Tests for startup readiness polling."""
+
+    def test_backoff_is_sub_second(self):
+        """Test readiness is polled with growing sub-second delays."""
+        client = ComfyClient()
+        with patch.object(client, 'is_ready', side_effect=[False, False, False, True]), \
+             patch('comfy_bridge.time.sleep') as mock_sleep:
+            assert client.wait_for_ready(timeout=10, initial_interval=0.05, max_interval=0.15)
+
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.05, 0.1, 0.15]
+
+    def test_abort(self):
+        """Test waiting stops once should_abort reports the process died."""
+        client = ComfyClient()
+        with patch.object(client, 'is_ready', return_value=False), \
+             patch('comfy_bridge.time.sleep'):
+            assert not client.wait_for_ready(timeout=10, should_abort=lambda: True)
+
+
+class TestWaitForCompletion:
+    """Tests for wait_for_completion against a fake ComfyUI server."""
+
+    def test_queue_prompt_sends_client_id(self, fake_comfy):
+        """Test that prompts are tagged with the client's websocket id."""
+        client = ComfyClient(port=fake_comfy.port)
+        prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+
+        assert fake_comfy.prompts[prompt_id]["client_id"].startswith(client.client_id)
+
+    def test_concurrent_waits_share_one_socket(self):
+        """Test waits on two prompts at once both see their terminal events."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with FakeComfyServer(render_time=0.2) as server:
+            client = ComfyClient(port=server.port)
+            prompt_ids = [client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}}) for _ in range(2)]
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(2) as pool:
+                results = list(pool.map(
+                    lambda pid: client.wait_for_completion(pid, timeout=10, poll_interval=5),
+                    prompt_ids
+                ))
+            elapsed = time.perf_counter() - start
+
+        assert all(result["outputs"] for result in results)
+        # Neither wait fell back to the 5s poll interval
+        assert elapsed < 2
+        assert server.ws_connections == 1
+
+    def test_prompts_queued_up_front_share_one_socket(self):
+        """Test a run of queued prompts holds one socket and each wait gets its own events."""
+        with FakeComfyServer(render_time=0.05) as server:
+            client = ComfyClient(port=server.port)
+            prompt_ids = [client.queue_prompt({"1": {"class_type": "Test", "inputs": {"seed": i}}}) for i in range(5)]
+            profiles = [ExecutionProfile() for _ in prompt_ids]
+            results = [
+                client.wait_for_completion(prompt_id, timeout=10, poll_interval=5, profile=profile)
+                for prompt_id, profile in zip(prompt_ids, profiles)
+            ]
+            buffered = client.event_stream().buffered()
+            client.close()
+
+        assert all(result["outputs"] for result in results)
+        assert server.ws_connections == 1
+        assert all(profile.nodes for profile in profiles)
+        assert buffered == 0
+
+    def test_websocket_completion_latency(self):
+        """Test completion is detected from the event stream, not the poll interval."""
+        with FakeComfyServer(render_time=0.3) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            history = client.wait_for_completion(prompt_id, timeout=10, poll_interval=2.0)
+            returned_at = time.perf_counter()
+
+        assert history["outputs"]
+        assert returned_at - server.completed_at[prompt_id] < 0.05
+        # One history check on subscribe, one to fetch the outputs
+        assert server.request_counts["history"] == 2
+
+    def test_profile_and_step_progress(self):
+        """Test the event stream fills the profile and drives progress."""
+        workflow = {
+            "1": {"class_type": "KSampler", "inputs": {}},
+            "75": {"class_type": "SaveVideo", "inputs": {}},
+        }
+        progress = []
+        with FakeComfyServer(render_time=0.2, steps=4) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt(workflow)
+            profile = ExecutionProfile(workflow)
+            client.wait_for_completion(
+                prompt_id, timeout=10, poll_interval=2.0,
+                progress_callback=lambda pct, msg: progress.append((pct, msg)), profile=profile
+            )
+
+        nodes = profile.summary()
+        assert [node["class_type"] for node in nodes] == ["KSampler", "SaveVideo"]
+        assert nodes[0]["steps"] == 4
+        assert nodes[0]["seconds"] > nodes[1]["seconds"] > 0
+        assert nodes[1]["output"] is True
+        assert ("KSampler step 4/4") in [msg for _, msg in progress]
+        assert [pct for pct, _ in progress] == sorted(pct for pct, _ in progress)
+
+    def test_websocket_execution_error(self):
+        """Test execution_error events raise immediately."""
+        with FakeComfyServer(fail_with="CUDA out of memory") as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "VAEDecode", "inputs": {}}})
+
+            with pytest.raises(ComfyAPIError, match="CUDA out of memory"):
+                client.wait_for_completion(prompt_id, timeout=10, poll_interval=2.0)
+
+    def test_already_completed_before_subscribe(self, fake_comfy):
+        """Test a prompt that finished before the socket opened is still picked up."""
+        client = ComfyClient(port=fake_comfy.port)
+        prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+        while prompt_id not in fake_comfy.history:
+            time.sleep(0.01)
+
+        history = client.wait_for_completion(prompt_id, timeout=1, poll_interval=2.0)
+
+        assert history["outputs"]
+
+    def test_falls_back_to_polling_without_websocket(self):
+        """Test polling is used when the server has no websocket endpoint."""
+        with FakeComfyServer(websocket=False) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            history = client.wait_for_completion(prompt_id, timeout=10, poll_interval=0.05)
+
+        assert history["outputs"]
+
+    def test_falls_back_to_polling_when_socket_drops(self):
+        """Test polling takes over if the socket drops mid-run."""
+        with FakeComfyServer(render_time=0.3, drop_socket_after=0.01) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            history = client.wait_for_completion(prompt_id, timeout=10, poll_interval=0.05)
+
+        assert history["outputs"]
+        assert server.request_counts["history"] > 2
+
+    def test_preview_callback(self):
+        """Test latent previews and executed outputs reach the preview callback."""
+        with FakeComfyServer(previews=True, render_time=0.1) as server:
+            client = ComfyClient(port=server.port)
+            events = []
+            workflow = {"1": {"class_type": "Test", "inputs": {}}, "75": {"class_type": "SaveVideo", "inputs": {}}}
+            prompt_id = client.queue_prompt(workflow)
+            client.wait_for_completion(prompt_id, timeout=10, preview_callback=events.append)
+
+        latents = [event for event in events if event["kind"] == "latent"]
+        assert [event["image"] for event in latents] == [b"\xff\xd8preview-%d" % step for step in range(1, 5)]
+        assert {event["mime"] for event in latents} == {"image/jpeg"}
+        assert latents[0]["node_id"] == "1"
+        assert all(0 <= event["progress"] <= 99 for event in events)
+        outputs = [event for event in events if event["kind"] == "output"]
+        assert [event["node_id"] for event in outputs] == ["75"]
+        assert outputs[0]["output"]["gifs"][0]["filename"] == "LTX-2_00001_.mp4"
+
+    def test_polling_only_client(self, fake_comfy):
+        """Test use_websocket=False polls the history endpoint."""
+        client = ComfyClient(port=fake_comfy.port, use_websocket=False)
+        prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+        history = client.wait_for_completion(prompt_id, timeout=10, poll_interval=0.05)
+
+        assert history["outputs"]
+        assert fake_comfy.request_counts.get("ws") is None
+
+
+class TestCancelPrompt:
+    """Tests for taking prompts out of a fake ComfyUI server."""
+
+    def _wait_running(self, server, prompt_id):
+        deadline = time.time() + 5
+        while server._running != prompt_id:
+            assert time.time() < deadline, "prompt never started"
+            time.sleep(0.01)
+
+    def test_running_prompt_interrupted(self):
+        """Test a running prompt is interrupted and ComfyUI is free within a step."""
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            self._wait_running(server, prompt_id)
+
+            start = time.perf_counter()
+            outcome = client.cancel_prompt(prompt_id)
+            time_to_free = time.perf_counter() - start
+
+            assert outcome == "interrupted"
+            assert prompt_id in server.interrupted
+            assert client.queue_depth() == 0
+            # A step is 0.1s; polling backs off from 0.05s
+            assert time_to_free < 0.5
+            client.close()
+
+    def test_pending_prompt_deleted(self):
+        """Test a pending prompt is deleted without running and the running one is left alone."""
+        with FakeComfyServer(render_time=0.5) as server:
+            client = ComfyClient(port=server.port)
+            running = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            pending = client.queue_prompt({"1": {"class_type": "Test", "inputs": {"seed": 2}}})
+            self._wait_running(server, running)
+
+            assert client.cancel_prompt(pending) == "deleted"
+            assert server.deleted == [pending]
+            history = client.wait_for_completion(running, timeout=10)
+            client.close()
+
+        assert history["outputs"]
+        assert pending not in server.history and not server.interrupted
+
+    def test_finished_prompt(self, fake_comfy):
+        """Test cancelling a prompt that already finished does nothing."""
+        client = ComfyClient(port=fake_comfy.port)
+        prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+        client.wait_for_completion(prompt_id, timeout=10)
+
+        assert client.cancel_prompt(prompt_id) == "finished"
+        assert not fake_comfy.interrupted
+
+    def test_wait_aborted(self):
+        """Test should_abort ends a wait promptly without touching the prompt."""
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            prompt_id = client.queue_prompt({"1": {"class_type": "Test", "inputs": {}}})
+            start = time.perf_counter()
+            with pytest.raises(ComfyAPIError, match="cancelled"):
+                client.wait_for_completion(prompt_id, timeout=10, should_abort=lambda: time.perf_counter() - start > 0.2)
+
+            assert time.perf_counter() - start < 0.5
+            assert server._running == prompt_id
+            client.cancel_prompt(prompt_id)
+            client.close()
+
+
+class TestWorkflowCache:
+    """Tests for the parsed workflow cache."""
+
+    def test_parses_once(self, tmp_path):
+        """Test repeated loads don't re-read the file."""
+        workflow_file = tmp_path / "wf.json"
+        workflow_file.write_text(json.dumps({"1": {"inputs": {"text": "a"}, "class_type": "Test"}}))
+        cache = WorkflowCache()
+
+        with patch('comfy_bridge.load_workflow', wraps=load_workflow) as mock_load:
+            cache.load(workflow_file)
+            cache.load(workflow_file)
+
+        assert mock_load.call_count == 1
+
+    def test_returns_isolated_copies(self, tmp_path):
+        """Test edits to a loaded workflow don't leak into the cache."""
+        workflow_file = tmp_path / "wf.json"
+        workflow_file.write_text(json.dumps({
+            "1": {"inputs": {"text": "a"}, "class_type": "Test"},
+            "2": {"inputs": {"clip": ["1", 0]}, "class_type": "Test"},
+        }))
+        cache = WorkflowCache()
+
+        first = cache.load(workflow_file)
+        first["1"]["inputs"]["text"] = "changed"
+        first["1"]["class_type"] = "Other"
+        del first["2"]
+
+        second = cache.load(workflow_file)
+        assert second["1"]["inputs"]["text"] == "a"
+        assert second["1"]["class_type"] == "Test"
+        assert "2" in second
+
+    def test_invalidates_on_mtime_change(self, tmp_path):
+        """Test a rewritten file is re-parsed."""
+        workflow_file = tmp_path / "wf.json"
+        workflow_file.write_text(json.dumps({"1": {"inputs": {"text": "a"}}}))
+        cache = WorkflowCache()
+        assert cache.load(workflow_file)["1"]["inputs"]["text"] == "a"
+
+        workflow_file.write_text(json.dumps({"1": {"inputs": {"text": "b"}}}))
+        stat = workflow_file.stat()
+        os.utime(workflow_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert cache.load(workflow_file)["1"]["inputs"]["text"] == "b"
+
+    def test_extracts_ui_format(self, tmp_path):
+        """Test LiteGraph UI workflows are cached in API format."""
+        api = {"1": {"inputs": {}, "class_type": "Test"}}
+        workflow_file = tmp_path / "ui.json"
+        workflow_file.write_text(json.dumps({"nodes": [], "links": [], "extra": {"prompt": api}}))
+
+        assert WorkflowCache().load(workflow_file) == api
+
+    def test_compile_cached_per_version(self, tmp_path):
+        """Test compiled artifacts are built once and rebuilt after a change."""
+        workflow_file = tmp_path / "wf.json"
+        workflow_file.write_text(json.dumps({"1": {"inputs": {}}}))
+        cache = WorkflowCache()
+        builder = Mock(side_effect=lambda wf: object())
+
+        first = cache.compile(workflow_file, "plan", builder)
+        assert cache.compile(workflow_file, "plan", builder) is first
+
+        stat = workflow_file.stat()
+        os.utime(workflow_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert cache.compile(workflow_file, "plan", builder) is not first
+        assert builder.call_count == 2
+
+    def test_clone_workflow_shares_nothing_mutable(self):
+        """Test clone_workflow copies node and inputs dicts."""
+        workflow = {"1": {"inputs": {"width": 512}, "class_type": "EmptyImage"}}
+        cloned = clone_workflow(workflow)
+
+        assert cloned == workflow
+        assert cloned["1"] is not workflow["1"]
+        assert cloned["1"]["inputs"] is not workflow["1"]["inputs"]
+
+
+class TestInjectionPlan:
+    """Tests for compiled parameter injection plans."""
+
+    WORKFLOW = {
+        "3": {"inputs": {"text": "original"}, "class_type": "CLIPTextEncode"},
+        "27": {"inputs": {"width": 512, "height": 512}, "class_type": "EmptyImage"},
+        "40": {"inputs": {"image": "input_image", "upload": "image"}, "class_type": "LoadImage"},
+        "41": {"inputs": {"file": "control_video"}, "class_type": "LoadVideo"},
+    }
+
+    def test_invalid_nodes_dropped_at_compile(self):
+        """Test mappings to missing nodes are rejected when compiling."""
+        plan = InjectionPlan(self.WORKFLOW, {
+            "prompt": ("3", "text"),
+            "seed": ("99", "noise_seed"),
+        })
+
+        assert plan.targets == {"prompt": ("3", "text")}
+        assert plan.invalid == {"seed": ("99", "noise_seed")}
+
+    def test_apply_sets_mapped_values(self):
+        """Test apply writes only the params present in the input."""
+        plan = InjectionPlan(self.WORKFLOW, {
+            "prompt": ("3", "text"),
+            "width": ("27", "width"),
+            "height": ("27", "height"),
+        })
+        workflow = clone_workflow(self.WORKFLOW)
+
+        applied = plan.apply(workflow, {"prompt": "A cat", "width": 768, "other": 1})
+
+        assert sorted(applied) == ["prompt", "width"]
+        assert workflow["3"]["inputs"]["text"] == "A cat"
+        assert workflow["27"]["inputs"] == {"width": 768, "height": 512}
+
+    def test_index_media_loaders(self):
+        """Test loader nodes are indexed by referenced filename."""
+        index = index_media_loaders(self.WORKFLOW)
+
+        assert index == {"input_image": [("40", "image")], "control_video": [("41", "file")]}
+
+    def test_bind_media(self):
+        """Test saved files replace loader placeholders."""
+        plan = InjectionPlan(self.WORKFLOW, {})
+        workflow = clone_workflow(self.WORKFLOW)
+
+        plan.bind_media(workflow, {"input_image": "saved.png", "control_video": "saved.mp4"})
+
+        assert workflow["40"]["inputs"]["image"] == "saved.png"
+        assert workflow["41"]["inputs"]["file"] == "saved.mp4"
+        assert self.WORKFLOW["40"]["inputs"]["image"] == "input_image"
+
+    def test_bind_media_touched_nodes(self):
+        """Test loaders retargeted after compiling are still bound."""
+        plan = InjectionPlan(self.WORKFLOW, {})
+        workflow = clone_workflow(self.WORKFLOW)
+        inject_params(workflow, {"40": {"image": "reference"}})
+
+        plan.bind_media(workflow, {"reference": "saved.png"}, touched_nodes={"40"})
+
+        assert workflow["40"]["inputs"]["image"] == "saved.png"
+
+
+class TestPreviews:
+    """Tests for binary preview frames and the first-pass preview branch."""
+
+    def test_parse_preview_frame(self):
+        """Test both preview frame layouts decode and other frames are ignored."""
+        assert parse_preview_frame(struct.pack(">II", 1, 2) + b"png") == ("image/png", b"png")
+        metadata = json.dumps({"image_type": "image/webp", "node_id": "3"}).encode()
+        frame = struct.pack(">II", 4, len(metadata)) + metadata + b"webp"
+        assert parse_preview_frame(frame) == ("image/webp", b"webp")
+        assert parse_preview_frame(struct.pack(">II", 1, 9) + b"data") is None
+        assert parse_preview_frame(struct.pack(">II", 3, 0) + b"text") is None
+        assert parse_preview_frame(b"\x00\x01") is None
+
+    def test_branch_decodes_upsampler_input(self):
+        """Test the t2v template gets a decode of its first pass at the video's fps."""
+        workflow = load_workflow(os.path.join(TestModelSet.WORKFLOW_DIR, "LTX-2_00041_.json"))
+        with_previews, nodes = add_preview_branch(workflow)
+
+        assert nodes == ["preview:92:84"]
+        assert is_preview_node(nodes[0]) and not is_preview_node("75")
+        save = with_previews["preview:92:84"]
+        decode = with_previews[save["inputs"]["images"][0]]
+        assert save["class_type"] == "SaveAnimatedWEBP"
+        assert save["inputs"]["fps"] == workflow["92:97"]["inputs"]["fps"]
+        assert decode["inputs"] == {"samples": ["92:81", 2], "vae": ["92:1", 2]}
+        assert "preview:92:84" not in workflow
+        assert prune_workflow(with_previews)[1] == []
+
+    def test_no_upsampler_unchanged(self):
+        """Test single-pass workflows are returned as is."""
+        workflow = {"1": {"class_type": "SaveImage", "inputs": {}}}
+
+        assert add_preview_branch(workflow) == (workflow, [])
+
+
+class TestModelSet:
+    """Tests for extracting the models a workflow loads."""
+
+    WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+    def test_template_model_sets(self):
+        """Test templates sharing models share a key and LoRAs are listed apart."""
+        t2v = model_set(load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX-2_00041_.json")))
+        i2v = model_set(load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX2_I2V.json")))
+        canny = model_set(load_workflow(os.path.join(self.WORKFLOW_DIR, "LTX2_canny_to_video.json")))
+
+        assert t2v["loras"] == ["ltx-2-19b-distilled-lora-384.safetensors"]
+        assert "ltx-2-19b-dev.safetensors" in t2v["models"]
+        assert "ltx-2-19b-distilled-lora-384.safetensors" not in t2v["models"]
+        assert model_set_key(i2v) == model_set_key(canny)
+        assert model_set_key(t2v) != model_set_key(i2v)
+
+    def test_zero_strength_lora_skipped(self):
+        """Test a LoRA at zero strength isn't part of the set."""
+        workflow = {
+            "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "base.safetensors"}},
+            "2": {"class_type": "LoraLoaderModelOnly",
+                  "inputs": {"lora_name": "camera.safetensors", "strength_model": 0, "model": ["1", 0]}},
+            "3": {"class_type": "LoraLoader",
+                  "inputs": {"lora_name": "style.safetensors", "strength_model": 0, "strength_clip": 0.5}},
+        }
+
+        assert model_set(workflow) == {"models": ["base.safetensors"], "loras": ["style.safetensors"]}
+        assert model_set_key({"models": [], "loras": []}) is None
@@ -54,8 +54,571 @@ class TestHandlerInputValidation:
         assert "not available" in result["error"]
 
 
-class TestEncodeDecodeBase64:
-    """Tests for base64 encoding/decoding utilities."""
+class TestTemplateJobs:
+    """Tests for template mode job preparation."""
+
+    WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_template_job_does_not_mutate_cache(self, mock_client, mock_progress):
+        """Test per-job params are applied to a copy of the cached template."""
+        import handler
+
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {"outputs": {}}
+
+        job = {"id": "test-job", "input": {"template": "t2v", "prompt": "A red fox"}}
+        with patch('handler.WORKFLOW_DIR', self.WORKFLOW_DIR):
+            handler.handler(job)
+            queued = mock_client.queue_prompt.call_args[0][0]
+            fresh = handler.template_cache.load(os.path.join(self.WORKFLOW_DIR, "LTX-2_00041_.json"))
+
+        assert queued["92:3"]["inputs"]["text"] == "A red fox"
+        assert fresh["92:3"]["inputs"]["text"] != "A red fox"
+
+
+    def test_template_plan_compiled_once(self):
+        """Test the injection plan is reused across jobs."""
+        import handler
+
+        path = os.path.join(self.WORKFLOW_DIR, "LTX-2_00041_.json")
+        plan = handler.get_template_plan("t2v", path)
+
+        assert handler.get_template_plan("t2v", path) is plan
+        assert not plan.invalid
+        assert plan.targets["prompt"] == ("92:3", "text")
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_direct_workflow_binds_input_images(self, mock_client, mock_progress, tmp_path):
+        """Test LoadImage nodes are pointed at saved input images."""
+        from handler import handler
+
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {"outputs": {}}
+
+        job = {"id": "test-job", "input": {
+            "workflow": {"1": {"inputs": {"image": "ref"}, "class_type": "LoadImage"}},
+            "images": {"ref": base64.b64encode(b"fake image data").decode()},
+        }}
+        with patch('handler.COMFY_INPUT_DIR', str(tmp_path)):
+            handler(job)
+
+        queued = mock_client.queue_prompt.call_args[0][0]
+        assert queued["1"]["inputs"]["image"].startswith("input_")
+
+
+class TestResultCaching:
+    """Tests for serving repeated workflows from the result cache."""
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_repeat_job_served_from_cache(self, mock_client, mock_progress, tmp_path):
+        """Test an identical second job doesn't queue a prompt."""
+        import handler
+        from result_cache import ResultCache
+
+        output_dir = tmp_path / "output"
+        output_dir.mkdir()
+        (output_dir / "out.mp4").write_bytes(b"rendered")
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {
+            "outputs": {"75": {"gifs": [{"filename": "out.mp4", "subfolder": ""}]}}
+        }
+
+        job = {"id": "job", "input": {"workflow": {"1": {"class_type": "SaveVideo", "inputs": {"seed": 7}}}}}
+        with patch('handler.result_cache', ResultCache(tmp_path / "cache")), \
+             patch('handler.COMFY_OUTPUT_DIR', str(output_dir)):
+            first = handler.handler(job)
+            (output_dir / "out.mp4").unlink()
+            second = handler.handler(job)
+            forced = handler.handler({"id": "job", "input": {**job["input"], "cache": False}})
+
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert second["prompt_id"] == "abc123"
+        assert base64.b64decode(second["outputs"][0]["data"]) == b"rendered"
+        assert forced["cached"] is False
+        assert mock_client.queue_prompt.call_count == 2
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_cache_hit_files_deleted_once_delivered(self, mock_client, mock_progress, tmp_path):
+        """Test a hit delivers its own links and leaves the cache entry in place."""
+        import handler
+        from output_storage import OutputIndex
+        from result_cache import ResultCache
+
+        output_dir = tmp_path / "output"
+        output_dir.mkdir()
+        (output_dir / "out.mp4").write_bytes(b"rendered")
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {
+            "outputs": {"75": {"gifs": [{"filename": "out.mp4", "subfolder": ""}]}}
+        }
+        cache = ResultCache(tmp_path / "cache")
+
+        job = {"id": "job", "input": {"workflow": {"1": {"class_type": "SaveVideo", "inputs": {"seed": 7}}}}}
+        with patch('handler.result_cache', cache), \
+             patch('handler.output_index', OutputIndex()), \
+             patch('handler.COMFY_OUTPUT_DIR', str(output_dir)):
+            handler.handler(job)
+            second = handler.handler(job)
+
+        assert second["cached"] is True
+        assert base64.b64decode(second["outputs"][0]["data"]) == b"rendered"
+        assert list((tmp_path / "cache" / ".checkout").iterdir()) == []
+        assert cache.stats()["entries"] == 1
+
+    def test_input_file_hashes(self, tmp_path):
+        """Test loader inputs are keyed by content, not name."""
+        import handler
+
+        (tmp_path / "brand.png").write_bytes(b"v1")
+        workflow = {
+            "1": {"class_type": "LoadImage", "inputs": {"image": "brand.png"}},
+            "2": {"class_type": "LoadImage", "inputs": {"image": "input_" + "a" * 32 + ".png"}},
+        }
+        with patch('handler.COMFY_INPUT_DIR', str(tmp_path)):
+            before = handler.input_file_hashes(workflow)
+            (tmp_path / "brand.png").write_bytes(b"v2")
+            after = handler.input_file_hashes(workflow)
+
+        assert before["input_" + "a" * 32 + ".png"] == "a" * 32
+        assert before["brand.png"] != after["brand.png"]
+
+
+class TestBatchJobs:
+    """Tests for batch jobs with many variants."""
+
+    def _setup_outputs(self, tmp_path):
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+
+    def test_expand_variants_grid(self):
+        """Test variants are combined with every grid point."""
+        from handler import expand_variants
+
+        items = expand_variants({
+            "variants": [{"prompt": "a"}, {"prompt": "b"}],
+            "grid": {"seed": [1, 2], "resolution": ["720p"]},
+        })
+
+        assert items == [
+            {"prompt": "a", "seed": 1, "resolution": "720p"},
+            {"prompt": "a", "seed": 2, "resolution": "720p"},
+            {"prompt": "b", "seed": 1, "resolution": "720p"},
+            {"prompt": "b", "seed": 2, "resolution": "720p"},
+        ]
+
+    def test_expand_variants_limit(self):
+        """Test oversized and malformed batches are rejected."""
+        from handler import JobError, expand_variants
+
+        with patch('handler.BATCH_MAX_ITEMS', 3):
+            with pytest.raises(JobError, match="limit"):
+                expand_variants({"grid": {"seed": [1, 2, 3, 4]}})
+        with pytest.raises(JobError):
+            expand_variants({"variants": {"prompt": "not a list"}})
+
+    def test_expand_sweep_prompt_major(self):
+        """Test sweeps vary the prompt slowest and the seed fastest, one parameter at a time."""
+        from handler import expand_variants
+
+        items = expand_variants({"sweep": {"seed": [1, 2], "resolution": ["480p", "720p"], "prompt": ["a", "b"]}})
+
+        assert [(item["prompt"], item["resolution"], item["seed"]) for item in items] == [
+            ("a", "480p", 1), ("a", "480p", 2), ("a", "720p", 2), ("a", "720p", 1),
+            ("b", "720p", 1), ("b", "720p", 2), ("b", "480p", 2), ("b", "480p", 1),
+        ]
+
+    def test_sweep_rejects_other_params(self):
+        """Test sweeps only take the parameters they know the order of."""
+        from handler import JobError, expand_variants
+
+        with pytest.raises(JobError, match="Can't sweep cfg"):
+            expand_variants({"sweep": {"seed": [1], "cfg": [3.0, 4.0]}})
+
+    def test_sweep_reuses_text_encoding(self, tmp_path):
+        """Test a sweep queues each prompt's items back to back and reports reuse."""
+        import handler
+        from comfy_bridge import ComfyClient
+        from tests.fake_comfy import FakeComfyServer
+
+        self._setup_outputs(tmp_path)
+        job = {"id": "sweep", "input": {
+            "template": "t2v", "resolution": "480p",
+            "sweep": {"prompt": ["A red fox", "An owl"], "seed": [1, 2, 3]},
+        }}
+
+        with FakeComfyServer(node_cache=True) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), \
+                 patch('handler.progress_update'), \
+                 patch('handler.WORKFLOW_DIR', TestTemplateJobs.WORKFLOW_DIR), \
+                 patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+                result = handler.handler(job)
+            client.close()
+
+        assert result["status"] == "success"
+        queued = [payload["prompt"] for payload in server.prompts.values()]
+        assert [workflow["92:3"]["inputs"]["text"] for workflow in queued] == ["A red fox"] * 3 + ["An owl"] * 3
+        # Each prompt is encoded once: by the first of its seeds
+        encoded = [prompt_id for prompt_id, cached in server.cached.items() if "92:3" not in cached]
+        assert len(encoded) == 2
+        reuse = result["metrics"]["node_reuse"]
+        assert reuse["rate"] == reuse["expected_rate"] > 0.5
+
+    def test_batch_queued_up_front(self, fake_comfy, tmp_path):
+        """Test every item is queued before the first one is awaited."""
+        import handler
+        from comfy_bridge import ComfyClient
+
+        self._setup_outputs(tmp_path)
+        client = ComfyClient(port=fake_comfy.port)
+        job = {"id": "batch", "input": {
+            "workflow": {"1": {"class_type": "KSampler", "inputs": {"seed": 0}}},
+            "grid": {"params": [{"1": {"seed": seed}} for seed in range(4)]},
+        }}
+
+        with patch('handler.comfy_client', client), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            items = handler.run_batch(job)
+            first = next(items)
+            queued_before_first = len(fake_comfy.prompts)
+            rest = list(items)
+
+        assert queued_before_first == 4
+        assert [item["index"] for item in [first, *rest]] == [0, 1, 2, 3]
+        seeds = [fake_comfy.prompts[item["prompt_id"]]["prompt"]["1"]["inputs"]["seed"] for item in [first, *rest]]
+        assert seeds == [0, 1, 2, 3]
+        client.close()
+
+    def test_batch_partial_failure(self, fake_comfy, tmp_path):
+        """Test a bad variant fails alone and the others still deliver outputs."""
+        import handler
+        from comfy_bridge import ComfyClient
+
+        self._setup_outputs(tmp_path)
+        client = ComfyClient(port=fake_comfy.port)
+        workflow = {"1": {"class_type": "KSampler", "inputs": {"seed": 0}}}
+        job = {"id": "batch", "input": {
+            "variants": [{"workflow": workflow}, {"template": "missing"}, {"workflow": workflow, "params": {"1": {"seed": 5}}}],
+        }}
+
+        with patch('handler.comfy_client', client), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            result = handler.handler(job)
+            messages = list(handler.stream_handler(job))
+
+        assert result["status"] == "partial"
+        assert [item["status"] for item in result["items"]] == ["success", "error", "success"]
+        assert "Unknown template" in result["items"][1]["error"]
+        assert base64.b64decode(result["items"][2]["outputs"][0]["data"]) == b"video"
+        assert workflow["1"]["inputs"]["seed"] == 0
+
+        # Streaming: the failed item arrives first, then chunks and summary per item
+        kinds = [(m["type"], m.get("item", m.get("index"))) for m in messages]
+        assert kinds == [("item", 1), ("chunk", 0), ("item", 0), ("chunk", 2), ("item", 2), ("result", None)]
+        assert "metrics" in messages[-1]
+        assert {k: v for k, v in messages[-1].items() if k != "metrics"} == {"type": "result", "status": "partial", "items": 3}
+        client.close()
+
+
+class TestAsyncHandler:
+    """Tests for concurrent jobs through the async handler."""
+
+    def test_concurrent_jobs_overlap_and_bound_queue(self, tmp_path):
+        """Test ingest overlaps rendering and ComfyUI's queue stays bounded."""
+        import asyncio
+        import time
+        import handler
+        from comfy_bridge import ComfyClient, QueueDepthGate
+        from tests.fake_comfy import FakeComfyServer
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+
+        def slow_ingest(job_input):
+            time.sleep(0.2)
+            return {}
+
+        jobs = [{"id": f"job-{i}", "input": {"workflow": {"1": {"class_type": "KSampler", "inputs": {"seed": i}}}}}
+                for i in range(4)]
+
+        async def run_all(client):
+            with patch('handler.queue_gate', QueueDepthGate(client, max_depth=2, poll_interval=0.02)):
+                return await asyncio.gather(*(handler.async_handler(job) for job in jobs))
+
+        with FakeComfyServer(render_time=0.2) as server, \
+             patch('handler.process_input_images', side_effect=slow_ingest), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client):
+                start = time.perf_counter()
+                results = asyncio.run(run_all(client))
+                elapsed = time.perf_counter() - start
+            client.close()
+
+        assert [r["status"] for r in results] == ["success"] * 4
+        assert server.max_queue_depth <= 2
+        # Back to back this is 4 x (0.2 ingest + 0.2 render)
+        assert elapsed < 1.4
+
+    def test_batch_items_go_through_gate(self, tmp_path):
+        """Test an async batch keeps ComfyUI's queue within the gate's bound."""
+        import asyncio
+        import handler
+        from comfy_bridge import ComfyClient, QueueDepthGate
+        from tests.fake_comfy import FakeComfyServer
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+
+        batch = {"id": "batch", "input": {
+            "workflow": {"1": {"class_type": "KSampler", "inputs": {"seed": 0}}},
+            "grid": {"params": [{"1": {"seed": seed}} for seed in range(5)]},
+        }}
+        single = {"id": "single", "input": {"workflow": {"1": {"class_type": "KSampler", "inputs": {"seed": 99}}}}}
+
+        async def run_all(client):
+            with patch('handler.queue_gate', QueueDepthGate(client, max_depth=2, poll_interval=0.02)):
+                return await asyncio.gather(handler.async_handler(batch), handler.async_handler(single))
+
+        with FakeComfyServer(render_time=0.1) as server, \
+             patch('handler.result_cache', None), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client):
+                batch_result, single_result = asyncio.run(run_all(client))
+            client.close()
+
+        assert batch_result["status"] == "success"
+        assert [item["status"] for item in batch_result["items"]] == ["success"] * 5
+        assert single_result["status"] == "success"
+        assert len(server.prompts) == 6
+        assert server.max_queue_depth <= 2
+        assert "queue_gate" in batch_result["metrics"]["stages"]
+
+    def test_concurrency_modifier(self):
+        """Test the modifier reports the configured concurrency."""
+        import handler
+
+        with patch('handler.JOB_CONCURRENCY', 3):
+            assert handler.concurrency_modifier(1) == 3
+
+
+class TestCoalescing:
+    """Tests for identical jobs joining a render in progress."""
+
+    WORKFLOW = {"75": {"class_type": "SaveVideo", "inputs": {"fps": 24}}}
+
+    def _run_async(self, server, tmp_path, jobs, index=None):
+        import asyncio
+        import handler
+        from comfy_bridge import ComfyClient, QueueDepthGate
+
+        async def run_all(client):
+            with patch('handler.queue_gate', QueueDepthGate(client, max_depth=2, poll_interval=0.02)):
+                return await asyncio.gather(*(handler.async_handler(job) for job in jobs))
+
+        client = ComfyClient(port=server.port)
+        with patch('handler.comfy_client', client), \
+             patch('handler.output_index', index), \
+             patch('handler.result_cache', None), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            results = asyncio.run(run_all(client))
+        client.close()
+        return results
+
+    def test_duplicates_share_one_prompt(self, tmp_path):
+        """Test identical concurrent jobs render once and all get the outputs."""
+        import handler
+        from output_storage import OutputIndex
+        from tests.fake_comfy import FakeComfyServer
+
+        (tmp_path / "video").mkdir()
+        output = tmp_path / "video" / "LTX-2_00001_.mp4"
+        output.write_bytes(b"video")
+        index = OutputIndex()
+        jobs = [{"id": f"job-{i}", "input": {"workflow": self.WORKFLOW}} for i in range(3)]
+
+        with FakeComfyServer(render_time=0.3) as server:
+            results = self._run_async(server, tmp_path, jobs, index)
+
+        assert len(server.prompts) == 1
+        assert [r["status"] for r in results] == ["success"] * 3
+        assert len({r["prompt_id"] for r in results}) == 1
+        assert all(base64.b64decode(r["outputs"][0]["data"]) == b"video" for r in results)
+        # Whichever job got there first rendered; the other two waited on it
+        assert sum("coalesced_wait" in r["metrics"]["stages"] for r in results) == 2
+        # Deleted once, after the last job delivered it
+        assert not output.exists()
+        assert index.stats()["removed"] == 1
+        assert len(handler.inflight) == 0
+
+    def test_cache_false_opts_out(self, tmp_path):
+        """Test jobs with "cache": false render on their own."""
+        from tests.fake_comfy import FakeComfyServer
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        jobs = [{"id": f"job-{i}", "input": {"workflow": self.WORKFLOW, "cache": False}} for i in range(2)]
+
+        with FakeComfyServer(render_time=0.2) as server:
+            results = self._run_async(server, tmp_path, jobs)
+
+        assert [r["status"] for r in results] == ["success"] * 2
+        assert len(server.prompts) == 2
+
+    def test_owner_failure_fails_duplicates(self, tmp_path):
+        """Test jobs that joined a failed render report its error."""
+        import handler
+        from tests.fake_comfy import FakeComfyServer
+
+        jobs = [{"id": f"job-{i}", "input": {"workflow": self.WORKFLOW}} for i in range(2)]
+
+        with FakeComfyServer(render_time=0.2, fail_with="CUDA out of memory") as server:
+            results = self._run_async(server, tmp_path, jobs)
+
+        assert len(server.prompts) == 1
+        assert all("CUDA out of memory" in r["error"] for r in results)
+        assert len(handler.inflight) == 0
+
+    def test_batch_duplicates_render_once(self, fake_comfy, tmp_path):
+        """Test identical batch items share one prompt."""
+        import handler
+        from comfy_bridge import ComfyClient
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        client = ComfyClient(port=fake_comfy.port)
+        job = {"id": "batch", "input": {"workflow": self.WORKFLOW, "variants": [{}, {}, {"timeout": 30}]}}
+
+        with patch('handler.comfy_client', client), \
+             patch('handler.result_cache', None), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            result = handler.handler(job)
+        client.close()
+
+        assert result["status"] == "success"
+        assert len(fake_comfy.prompts) == 1
+        assert len({item["prompt_id"] for item in result["items"]}) == 1
+
+
+class TestJobMetrics:
+    """Tests for the per-job metrics record."""
+
+    def test_result_carries_stage_timings(self, fake_comfy, tmp_path):
+        """Test a job reports its stages and updates the registry."""
+        import handler
+        from comfy_bridge import ComfyClient
+        from metrics import MetricsRegistry
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        client = ComfyClient(port=fake_comfy.port)
+        registry = MetricsRegistry()
+        job = {"id": "job", "input": {
+            "workflow": {"1": {"class_type": "LoadImage", "inputs": {"image": "ref"}}},
+            "images": {"ref": base64.b64encode(b"image bytes").decode()},
+        }}
+
+        with patch('handler.comfy_client', client), \
+             patch('handler.metrics_registry', registry), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_INPUT_DIR', str(tmp_path / "input")), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)), \
+             patch.dict(handler.startup_timings, clear=True):
+            result = handler.handler(job)
+        client.close()
+
+        metrics = result["metrics"]
+        assert result["status"] == "success"
+        assert {"input_decode", "param_injection", "queue", "wait_to_start", "execution",
+                "output_collection", "encoding"} <= set(metrics["stages"])
+        assert metrics["stages"]["execution"] > 0
+        assert metrics["total_seconds"] >= sum(metrics["stages"].values()) * 0.5
+        assert "first_job" in metrics["worker"]
+        assert registry.jobs == {"success": 1}
+        assert metrics["nodes"][0]["node_id"] == "1"
+        assert metrics["nodes"][0]["class_type"] == "LoadImage"
+        assert "LoadImage" in registry.node_seconds
+
+    def test_error_result_has_metrics(self):
+        """Test failed jobs are counted too."""
+        import handler
+        from metrics import MetricsRegistry
+
+        registry = MetricsRegistry()
+        with patch('handler.comfy_client', None), \
+             patch('handler.metrics_registry', registry):
+            result = handler.handler({"id": "job", "input": {"workflow": {}}})
+
+        assert result["status"] == "error"
+        assert "metrics" in result
+        assert registry.jobs == {"error": 1}
+
+
+class TestStartup:
+    """Tests for the staged cold start."""
+
+    WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+    def test_startup_stage_timed(self):
+        """Test stages are recorded even when they fail."""
+        import handler
+
+        with patch.dict(handler.startup_timings, clear=True):
+            with pytest.raises(RuntimeError):
+                with handler.startup_stage("boom"):
+                    raise RuntimeError()
+            assert "boom" in handler.startup_timings
+
+    def test_prewarm_queues_tiny_render(self, fake_comfy):
+        """Test warm-up renders use the template at minimal size."""
+        import handler
+        from comfy_bridge import ComfyClient
+
+        client = ComfyClient(port=fake_comfy.port)
+        with patch('handler.comfy_client', client), \
+             patch('handler.WORKFLOW_DIR', self.WORKFLOW_DIR):
+            prompt_ids = handler.prewarm_templates(["t2v"])
+            with patch.dict(handler.startup_timings, clear=True):
+                handler.await_prewarm(prompt_ids)
+                assert "prewarm" in handler.startup_timings
+
+        queued = fake_comfy.prompts[prompt_ids[0]]["prompt"]
+        assert queued["92:89"]["inputs"]["width"] == 256
+        assert queued["92:9"]["inputs"]["steps"] == 1
+        assert prompt_ids[0] in fake_comfy.history
+        client.close()
+
+    def test_prewarm_template_names(self):
+        """Test PREWARM_TEMPLATES parsing."""
+        import handler
+
+        with patch('handler.PREWARM_TEMPLATES', "all"):
+            assert handler.prewarm_template_names() == list(handler.WORKFLOW_TEMPLATES)
+        with patch('handler.PREWARM_TEMPLATES', "t2v, nope"):
+            assert handler.prewarm_template_names() == ["t2v"]
+        with patch('handler.PREWARM_TEMPLATES', ""):
+            assert handler.prewarm_template_names() == []
+
+
+class TestEncodeBase64:
+    """Tests for base64 encoding utilities."""
 
     def test_encode_file_base64(self, tmp_path):
         """Test encoding a file to base64."""
@@ -70,18 +633,6 @@ class TestEncodeDecodeBase64:
 
         assert decoded == test_content
 
-    def test_decode_base64_to_file(self, tmp_path):
-        """Test decoding base64 to a file."""
-        from handler import decode_base64_to_file
-
-        original = b"Test data for encoding"
-        encoded = base64.b64encode(original).decode()
-        output_file = tmp_path / "output.txt"
-
-        decode_base64_to_file(encoded, output_file)
-
-        assert output_file.read_bytes() == original
-
 
 class TestProcessInputImages:
     """Tests for input image processing."""
@@ -108,8 +659,63 @@ class TestProcessInputImages:
             assert len(result) == 1
             assert "test_image" in result
             # Check file was created
-            saved_files = list(tmp_path.glob("input_test_image_*.png"))
+            saved_files = list(tmp_path.glob("input_*.png"))
             assert len(saved_files) == 1
+            assert saved_files[0].name == result["test_image"]
+            assert saved_files[0].read_bytes() == b"fake image data"
+
+    def test_identical_images_share_a_file(self, tmp_path):
+        """Test identical content maps to one content-addressed file."""
+        from handler import process_input_images
+
+        image_data = base64.b64encode(b"same bytes").decode()
+        job_input = {"images": {"first": image_data, "second": image_data}}
+
+        with patch('handler.COMFY_INPUT_DIR', str(tmp_path)):
+            result = process_input_images(job_input)
+
+        assert result["first"] == result["second"]
+
+    @patch('handler.comfy_client')
+    def test_inputs_released_after_job(self, mock_comfy_client, tmp_path):
+        """Test a job's inputs are unpinned once it finishes, even on failure."""
+        import handler
+
+        mock_comfy_client.queue_prompt.side_effect = handler.ComfyAPIError("rejected")
+        image_data = base64.b64encode(b"pinned bytes").decode()
+        job = {"id": "job-1", "input": {"workflow": {"1": {"class_type": "LoadImage", "inputs": {"image": "x.png"}}}, "images": {"image": image_data}}}
+
+        with patch('handler.COMFY_INPUT_DIR', str(tmp_path)), \
+             patch('handler.progress_update'):
+            result = handler.handler(job)
+            store = handler.media_fetcher.store(tmp_path)
+
+        assert result["status"] == "error"
+        assert store._pins == {}
+        assert len(list(tmp_path.iterdir())) == 1
+
+    @patch('handler.comfy_client')
+    def test_broken_graph_rejected_before_queueing(self, mock_comfy_client):
+        """Test a workflow linking to a missing node never reaches ComfyUI."""
+        import handler
+
+        job = {"id": "job-1", "input": {"workflow": {
+            "75": {"class_type": "SaveVideo", "inputs": {"video": ["74", 0]}},
+        }}}
+
+        result = handler.handler(job)
+
+        assert result["status"] == "error"
+        assert "links to missing node 74" in result["error"]
+        mock_comfy_client.queue_prompt.assert_not_called()
+
+    def test_invalid_image_is_a_job_error(self, tmp_path):
+        """Test undecodable input is reported back to the caller."""
+        from handler import process_input_images, JobError
+
+        with patch('handler.COMFY_INPUT_DIR', str(tmp_path)):
+            with pytest.raises(JobError, match="bad"):
+                process_input_images({"images": {"bad": "not base64!"}})
 
 
 class TestCollectOutputs:
@@ -166,6 +772,119 @@ class TestCollectOutputs:
             assert result[0]["filename"] == "output.mp4"
 
 
+class TestStreamHandler:
+    """Tests for chunked output streaming."""
+
+    HISTORY = {"outputs": {"75": {"gifs": [{"filename": "out.mp4", "subfolder": "video"}]}}}
+    WORKFLOW = {"75": {"class_type": "SaveVideo", "inputs": {}}}
+
+    def _run(self, tmp_path, data, chunk_size, consume=list):
+        from handler import stream_handler
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "out.mp4").write_bytes(data)
+
+        with patch('handler.comfy_client') as mock_client, \
+                patch('handler.progress_update'), \
+                patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)), \
+                patch('handler.OUTPUT_CHUNK_SIZE', chunk_size):
+            mock_client.is_ready.return_value = True
+            mock_client.queue_prompt.return_value = "abc123"
+            mock_client.wait_for_completion.return_value = self.HISTORY
+            return consume(stream_handler({"id": "test-job", "input": {"workflow": self.WORKFLOW}}))
+
+    def test_chunks_reassemble(self, tmp_path):
+        """Test chunks carry sequence numbers and checksums and rebuild the file."""
+        import hashlib
+
+        data = os.urandom(10_000)
+        messages = self._run(tmp_path, data, chunk_size=4096)
+
+        chunks, result = messages[:-1], messages[-1]
+        assert [c["seq"] for c in chunks] == [0, 1, 2]
+        assert [c["offset"] for c in chunks] == [0, 4096, 8192]
+        for chunk in chunks:
+            raw = base64.b64decode(chunk["data"])
+            assert hashlib.sha256(raw).hexdigest() == chunk["sha256"]
+        assert b"".join(base64.b64decode(c["data"]) for c in chunks) == data
+
+        assert result["status"] == "success"
+        assert result["outputs"] == [{
+            "type": "video",
+            "filename": "out.mp4",
+            "size_bytes": 10_000,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "chunks": 3,
+        }]
+
+    def test_peak_memory_bounded_by_chunk_size(self, tmp_path):
+        """Test streaming a large file never holds more than a few chunks."""
+        import tracemalloc
+
+        chunk_size = 256 * 1024
+        data = os.urandom(16 * 1024 * 1024)
+
+        def consume(messages):
+            tracemalloc.start()
+            count = sum(1 for _ in messages)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return count, peak
+
+        count, peak = self._run(tmp_path, data, chunk_size, consume)
+
+        assert count == 64 + 1
+        assert peak < 8 * chunk_size
+
+    def test_error_yields_single_result(self):
+        """Test input errors are reported as one result message."""
+        from handler import stream_handler
+
+        with patch('handler.comfy_client') as mock_client:
+            mock_client.is_ready.return_value = True
+            messages = list(stream_handler({"id": "test-job", "input": {}}))
+
+        assert len(messages) == 1
+        assert messages[0]["type"] == "result"
+        assert messages[0]["status"] == "error"
+
+
+class TestCollectOutputsUpload:
+    """Tests for uploading outputs to a storage backend."""
+
+    def test_uploads_overlap_and_keep_order(self, tmp_path):
+        """Test outputs upload concurrently and results stay in output order."""
+        import time
+        from handler import collect_outputs
+
+        for name in ("a.mp4", "b.mp4", "c.png"):
+            (tmp_path / name).write_bytes(b"data")
+
+        storage = Mock()
+
+        def slow_upload(filepath, key):
+            time.sleep(0.2)
+            return {"url": f"https://bucket/{key}", "key": key, "size_bytes": 4, "sha256": "x"}
+
+        storage.upload.side_effect = slow_upload
+        output_files = [
+            {"type": "video", "filename": "a.mp4", "subfolder": ""},
+            {"type": "video", "filename": "b.mp4", "subfolder": ""},
+            {"type": "image", "filename": "c.png", "subfolder": ""},
+        ]
+
+        with patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            start = time.perf_counter()
+            result = collect_outputs(output_files, storage=storage, key_prefix="job-1/")
+            elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.4
+        assert [r["filename"] for r in result] == ["a.mp4", "b.mp4", "c.png"]
+        assert result[0]["url"] == "https://bucket/job-1/a.mp4"
+        assert result[2]["type"] == "image"
+        assert "data" not in result[0]
+
+
 class TestWorkflowTemplates:
     """Tests for workflow template handling."""
 
@@ -184,28 +903,544 @@ class TestWorkflowTemplates:
         for name, filename in WORKFLOW_TEMPLATES.items():
             assert filename.endswith(".json"), f"Template {name} should be a JSON file"
 
+    def test_shipped_mappings_resolve(self):
+        """Test every param of every template's mapping names an existing node input."""
+        from comfy_bridge import InjectionPlan, load_workflow
+        from handler import TEMPLATE_PARAM_MAPPING, WORKFLOW_TEMPLATES
+
+        workflow_dir = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+        for name, filename in WORKFLOW_TEMPLATES.items():
+            workflow = load_workflow(os.path.join(workflow_dir, filename))
+            plan = InjectionPlan(workflow, TEMPLATE_PARAM_MAPPING[name])
+            assert plan.invalid == {}, f"Template {name}"
+
+    def test_unresolved_param_rejected(self):
+        """Test a job setting a param its template can't take fails instead of ignoring it."""
+        from comfy_bridge import InjectionPlan
+        from handler import JobError, apply_template_params
+
+        workflow = {"1": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}}}
+        plan = InjectionPlan(workflow, {"prompt": ("1", "text"), "seed": ("2", "noise_seed")})
+
+        assert apply_template_params(workflow, "t2v", {"prompt": "a fox"}, plan)["1"]["inputs"]["text"] == "a fox"
+        with pytest.raises(JobError, match="can't set seed"):
+            apply_template_params(workflow, "t2v", {"seed": 1}, plan)
+
+
+class TestOutputCleanup:
+    """Tests for removing outputs once delivered."""
+
+    def run_job(self, fake_comfy, tmp_path, index, **patches):
+        import handler
+        from comfy_bridge import ComfyClient
+
+        client = ComfyClient(port=fake_comfy.port)
+        job = {"id": "job", "input": {"workflow": {"75": {"class_type": "SaveVideo", "inputs": {}}}}}
+        with patch('handler.comfy_client', client), \
+             patch('handler.output_index', index), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)), \
+             patch.multiple('handler', **patches):
+            result = handler.handler(job)
+        client.close()
+        return result
+
+    def test_output_deleted_after_delivery(self, fake_comfy, tmp_path):
+        """Test the rendered file is gone once its data is in the result."""
+        from output_storage import OutputIndex
+
+        (tmp_path / "video").mkdir()
+        output = tmp_path / "video" / "LTX-2_00001_.mp4"
+        output.write_bytes(b"video")
+        index = OutputIndex()
+
+        result = self.run_job(fake_comfy, tmp_path, index, result_cache=None)
+
+        assert result["status"] == "success"
+        assert base64.b64decode(result["outputs"][0]["data"]) == b"video"
+        assert not output.exists()
+        assert index.stats()["removed"] == 1
+
+    def test_kept_when_disabled(self, fake_comfy, tmp_path):
+        """Test DELETE_DELIVERED_OUTPUTS=false leaves outputs to eviction."""
+        from output_storage import OutputIndex
+
+        (tmp_path / "video").mkdir()
+        output = tmp_path / "video" / "LTX-2_00001_.mp4"
+        output.write_bytes(b"video")
+        index = OutputIndex()
+
+        self.run_job(fake_comfy, tmp_path, index, result_cache=None, DELETE_DELIVERED_OUTPUTS=False)
+
+        assert output.exists()
+        assert index.stats()["files"] == 1
+
+
+class TestAdmission:
+    """Tests for admitting jobs against the VRAM budget."""
+
+    WORKFLOW = {
+        "1": {"class_type": "EmptyLTXVLatentVideo", "inputs": {"width": 1920, "height": 1088, "length": 121}},
+        "75": {"class_type": "SaveVideo", "inputs": {"video": ["1", 0]}},
+    }
+
+    def oom_model(self, budget):
+        """A cost model that saw WORKFLOW run out of VRAM within budget."""
+        from admission import CostModel, workflow_family, workflow_shape
+
+        model = CostModel()
+        model.observe_oom(workflow_family(self.WORKFLOW), workflow_shape(self.WORKFLOW), budget)
+        return model
+
+    @patch('handler.progress_update')
+    @patch('handler.vram_budget_bytes', int(24 * 1024 ** 3 * 0.9))
+    @patch('handler.comfy_client')
+    def test_default_config_admits_1080p(self, mock_comfy_client, mock_progress):
+        """Test a fresh worker on a 24 GB card runs a 1080p job the prior rates over budget."""
+        import handler
+        from admission import CostModel
+
+        mock_comfy_client.queue_prompt.return_value = "p1"
+        mock_comfy_client.wait_for_completion.return_value = {"outputs": {}}
+
+        with patch('handler.cost_model', CostModel()):
+            result = handler.handler({"id": "job-1", "input": {"workflow": self.WORKFLOW}})
+
+        mock_comfy_client.queue_prompt.assert_called_once()
+        assert result["metrics"]["estimate"]["vram_bytes"] > handler.vram_budget_bytes
+
+    @patch('handler.vram_budget_bytes', 16 * 1024 ** 3)
+    @patch('handler.comfy_client')
+    def test_oversized_job_rejected_before_queueing(self, mock_comfy_client):
+        """Test a render shown not to fit never reaches ComfyUI."""
+        import handler
+
+        with patch('handler.cost_model', self.oom_model(16 * 1024 ** 3)):
+            result = handler.handler({"id": "job-1", "input": {"workflow": self.WORKFLOW}})
+
+        assert result["status"] == "error"
+        assert "1920x1088x121" in result["error"]
+        mock_comfy_client.queue_prompt.assert_not_called()
+
+    @patch('handler.progress_update')
+    @patch('handler.vram_budget_bytes', 16 * 1024 ** 3)
+    @patch('handler.comfy_client')
+    def test_downscale_policy(self, mock_comfy_client, mock_progress):
+        """Test the downscale policy queues a smaller render and reports the estimate."""
+        import handler
+        from admission import CostModel
+
+        mock_comfy_client.queue_prompt.return_value = "p1"
+        mock_comfy_client.wait_for_completion.return_value = {"outputs": {}}
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "admission": "downscale"}}
+
+        with patch('handler.cost_model', self.oom_model(16 * 1024 ** 3)):
+            result = handler.handler(job)
+
+        queued = mock_comfy_client.queue_prompt.call_args[0][0]
+        width, height = result["metrics"]["estimate"]["downscaled_to"]
+        assert (queued["1"]["inputs"]["width"], queued["1"]["inputs"]["height"]) == (width, height)
+        assert width < 1920
+        assert self.WORKFLOW["1"]["inputs"]["width"] == 1920
+
+    @patch('handler.vram_budget_bytes', 80 * 1024 ** 3)
+    @patch('handler.comfy_client')
+    def test_oom_failure_recalibrates(self, mock_comfy_client):
+        """Test a render that runs out of VRAM stops the same job being admitted."""
+        import handler
+        from admission import CostModel
+
+        mock_comfy_client.queue_prompt.return_value = "p1"
+        mock_comfy_client.wait_for_completion.side_effect = handler.ComfyAPIError(
+            "Execution error: torch.OutOfMemoryError: Allocation on device"
+        )
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW}}
+
+        with patch('handler.cost_model', CostModel()), patch('handler.progress_update'):
+            first = handler.handler(job)
+            mock_comfy_client.queue_prompt.reset_mock()
+            second = handler.handler(job)
+
+        assert "OutOfMemoryError" in first["error"]
+        assert "VRAM" in second["error"]
+        mock_comfy_client.queue_prompt.assert_not_called()
+
+    def test_batch_queued_shortest_first(self, fake_comfy, tmp_path):
+        """Test batch items are queued and yielded in estimated cost order."""
+        import handler
+        from admission import CostModel
+        from comfy_bridge import ComfyClient
+        from scheduler import Scheduler
+
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        client = ComfyClient(port=fake_comfy.port)
+        job = {"id": "batch", "input": {
+            "workflow": {"1": {"class_type": "EmptyLTXVLatentVideo",
+                               "inputs": {"width": 512, "height": 512, "length": 97}}},
+            "grid": {"params": [{"1": {"width": width}} for width in (1280, 512, 768)]},
+        }}
+
+        with patch('handler.comfy_client', client), \
+             patch('handler.cost_model', CostModel()), \
+             patch('handler.scheduler', Scheduler("sjf")), \
+             patch('handler.progress_update'), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            items = list(handler.run_batch(job))
+        client.close()
+
+        assert [item["index"] for item in items] == [1, 2, 0]
+        widths = [fake_comfy.prompts[item["prompt_id"]]["prompt"]["1"]["inputs"]["width"] for item in items]
+        assert widths == [512, 768, 1280]
+
+
+class TestRenditions:
+    """Tests for delivering renditions with the outputs."""
+
+    @patch('handler.progress_update')
+    def test_renditions_delivered_and_removed(self, mock_progress, fake_comfy, tmp_path):
+        """Test renditions come back after the master with sizes, then are deleted."""
+        import functools
+        import handler
+        from comfy_bridge import ComfyClient
+        from output_storage import OutputIndex
+        from renditions import render_ladder
+        from tests.test_renditions import FAKE_FFMPEG
+
+        ffmpeg = tmp_path / "ffmpeg"
+        ffmpeg.write_text(FAKE_FFMPEG)
+        ffmpeg.chmod(0o755)
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        client = ComfyClient(port=fake_comfy.port)
+        job = {"id": "job-1", "input": {"workflow": {"75": {"class_type": "SaveVideo", "inputs": {}}},
+                                        "renditions": "720p,poster", "cache": False}}
 
-class TestCleanupOldOutputs:
-    """Tests for output cleanup."""
+        with patch('handler.comfy_client', client), \
+             patch('handler.output_index', OutputIndex()), \
+             patch('handler.render_ladder', functools.partial(render_ladder, ffmpeg=str(ffmpeg))), \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            result = handler.handler(job)
+        client.close()
 
-    def test_cleanup_old_files(self, tmp_path):
-        """Test that old files are cleaned up."""
-        from handler import cleanup_old_outputs
+        assert result["status"] == "success", result
+        master, rendition, poster = result["outputs"]
+        assert "rendition" not in master
+        assert (rendition["rendition"], rendition["source"], rendition["type"]) == ("720p", "LTX-2_00001_.mp4", "video")
+        assert poster["filename"] == "LTX-2_00001__poster.jpg" and poster["type"] == "image"
+        assert rendition["size_bytes"] == len(base64.b64decode(rendition["data"]))
+        assert "renditions" in result["metrics"]["stages"]
+        assert not list((tmp_path / "renditions").rglob("*.mp4"))
+
+    @pytest.mark.parametrize("renditions", ["4k", [{"name": "720p", "video_bitrate": 2000000}]])
+    @patch('handler.comfy_client')
+    def test_invalid_ladder_rejected_before_rendering(self, mock_comfy_client, renditions):
+        import handler
+
+        result = handler.handler({"id": "job-1", "input": {"template": "t2v", "renditions": renditions}})
+
+        assert result["status"] == "error"
+        assert "Invalid renditions" in result["error"]
+        mock_comfy_client.queue_prompt.assert_not_called()
+
+
+class TestPreviews:
+    """Tests for delivering previews while a job renders."""
+
+    WORKFLOW = {
+        "1": {"class_type": "EmptyLatentImage", "inputs": {}},
+        "2": {"class_type": "VAELoader", "inputs": {}},
+        "3": {"class_type": "LTXVLatentUpsampler", "inputs": {"samples": ["1", 0], "vae": ["2", 0]}},
+        "75": {"class_type": "SaveVideo", "inputs": {"video": ["3", 0]}},
+    }
+    OUTPUTS = {
+        "75": {"gifs": [{"filename": "LTX-2_00001_.mp4", "subfolder": "video", "type": "output"}]},
+        "preview:3": {"images": [{"filename": "LTX-2_00001_.webp", "subfolder": "preview", "type": "output"}]},
+    }
+
+    def _outputs(self, tmp_path):
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "LTX-2_00001_.mp4").write_bytes(b"video")
+        (tmp_path / "preview").mkdir()
+        preview = tmp_path / "preview" / "LTX-2_00001_.webp"
+        preview.write_bytes(b"first pass")
+        return preview
+
+    def test_previews_sent_as_progress_updates(self, tmp_path):
+        """Test throttled latent previews and the first pass go out, and only the video is returned."""
+        import handler
+        from comfy_bridge import ComfyClient
+        from output_storage import OutputIndex
+        from tests.fake_comfy import FakeComfyServer
+
+        preview_file = self._outputs(tmp_path)
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "previews": True, "cache": False}}
+
+        with FakeComfyServer(outputs=self.OUTPUTS, previews=True) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), \
+                 patch('handler.output_index', OutputIndex()), \
+                 patch('handler.progress_update') as mock_progress, \
+                 patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+                result = handler.handler(job)
+            queued = next(iter(server.prompts.values()))["prompt"]
+            client.close()
+
+        assert result["status"] == "success", result
+        assert [output["filename"] for output in result["outputs"]] == ["LTX-2_00001_.mp4"]
+        assert "preview:3" in queued
+        previews = [c.args[3] for c in mock_progress.call_args_list if len(c.args) > 3]
+        latents = [preview for preview in previews if preview["kind"] == "latent"]
+        first_pass = [preview for preview in previews if preview["kind"] == "first_pass"]
+        # Four sampler steps inside one PREVIEW_INTERVAL
+        assert len(latents) == 1
+        assert base64.b64decode(latents[0]["data"]) == b"\xff\xd8preview-1"
+        assert len(first_pass) == 1
+        assert base64.b64decode(first_pass[0]["data"]) == b"first pass"
+        assert first_pass[0]["mime"] == "image/webp"
+        assert not preview_file.exists()
+
+    def test_previews_off_by_default(self, fake_comfy, tmp_path):
+        """Test jobs without previews queue the workflow unchanged and get no previews."""
+        import handler
+        from comfy_bridge import ComfyClient
+
+        self._outputs(tmp_path)
+        client = ComfyClient(port=fake_comfy.port)
+        with patch('handler.comfy_client', client), \
+             patch('handler.progress_update') as mock_progress, \
+             patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+            result = handler.handler({"id": "job-1", "input": {"workflow": self.WORKFLOW, "cache": False}})
+        client.close()
+
+        assert result["status"] == "success", result
+        assert not any(node_id.startswith("preview:") for node_id in next(iter(fake_comfy.prompts.values()))["prompt"])
+        assert all(len(c.args) == 3 for c in mock_progress.call_args_list)
+
+    def test_stream_yields_previews_before_chunks(self, tmp_path):
+        """Test streaming jobs get preview messages ahead of the output chunks."""
+        import handler
+        from comfy_bridge import ComfyClient
+        from tests.fake_comfy import FakeComfyServer
+
+        self._outputs(tmp_path)
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "previews": True, "cache": False}}
+
+        with FakeComfyServer(outputs=self.OUTPUTS, previews=True) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), \
+                 patch('handler.progress_update'), \
+                 patch('handler.PREVIEW_INTERVAL', 0), \
+                 patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
+                messages = list(handler.stream_handler(job))
+            client.close()
+
+        types = [message["type"] for message in messages]
+        assert types == ["preview"] * 5 + ["chunk", "result"]
+        assert [message["kind"] for message in messages[:5]] == ["latent"] * 4 + ["first_pass"]
+        assert messages[-1]["status"] == "success"
+        assert "execution" in messages[-1]["metrics"]["stages"]
+
+
+class TestCancellation:
+    """Tests for freeing ComfyUI when a job times out or is cancelled."""
+
+    WORKFLOW = {"1": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+
+    def _wait_running(self, server):
         import time
 
-        # Create an "old" file by setting mtime to past
-        old_file = tmp_path / "old_output.mp4"
-        old_file.write_bytes(b"old data")
-        # Set mtime to 48 hours ago
-        old_time = time.time() - (48 * 3600)
-        os.utime(old_file, (old_time, old_time))
+        deadline = time.time() + 5
+        while server._running is None:
+            assert time.time() < deadline, "prompt never started"
+            time.sleep(0.01)
 
-        # Create a "new" file
-        new_file = tmp_path / "new_output.mp4"
-        new_file.write_bytes(b"new data")
+    def test_timeout_interrupts_prompt(self):
+        """Test a timed out job interrupts its prompt and ends with ComfyUI free."""
+        import time
+        import handler
+        from comfy_bridge import ComfyClient
+        from tests.fake_comfy import FakeComfyServer
 
-        with patch('handler.COMFY_OUTPUT_DIR', str(tmp_path)):
-            cleanup_old_outputs(max_age_hours=24)
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "timeout": 0.3, "cache": False}}
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), patch('handler.progress_update'):
+                result = handler.handler(job)
+                returned = time.perf_counter()
+
+            assert client.queue_depth() == 0
+            client.close()
+
+        assert result["status"] == "error"
+        assert "Timeout" in result["error"]
+        assert "cancel" in result["metrics"]["stages"]
+        (prompt_id, interrupted), = server.interrupted.items()
+        # The timeout is noticed within a websocket read and the prompt
+        # stops at its next 0.1s step
+        assert returned - interrupted < 0.5
+        assert result["metrics"]["total_seconds"] < 0.3 + 1.5
+
+    def test_cancelled_async_job_frees_comfyui(self):
+        """Test cancelling an async job interrupts its prompt before the task ends."""
+        import asyncio
+        import time
+        import handler
+        from comfy_bridge import ComfyClient, QueueDepthGate
+        from tests.fake_comfy import FakeComfyServer
+
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "cache": False}}
+
+        async def run(server, client):
+            with patch('handler.queue_gate', QueueDepthGate(client, max_depth=2, poll_interval=0.02)):
+                task = asyncio.create_task(handler.async_handler(job))
+                await asyncio.to_thread(self._wait_running, server)
+                cancelled_at = time.perf_counter()
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                return time.perf_counter() - cancelled_at
+
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), patch('handler.progress_update'):
+                time_to_free = asyncio.run(run(server, client))
+
+            assert client.queue_depth() == 0
+            client.close()
+
+        assert len(server.interrupted) == 1
+        assert time_to_free < 1.5
+
+    def test_cancel_while_queueing_frees_comfyui(self):
+        """Test a job cancelled before its POST returns still takes its prompt out."""
+        import asyncio
+        import time
+        import handler
+        from comfy_bridge import ComfyClient, QueueDepthGate
+        from tests.fake_comfy import FakeComfyServer
 
-        assert not old_file.exists()  # Should be deleted
-        assert new_file.exists()  # Should remain
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "cache": False}}
+        real_queue_workflow = handler.queue_workflow
+
+        def slow_queue_workflow(workflow):
+            # The prompt is in ComfyUI's queue, but the POST hasn't returned
+            queued = real_queue_workflow(workflow)
+            time.sleep(0.3)
+            return queued
+
+        async def run(server, client):
+            with patch('handler.queue_gate', QueueDepthGate(client, max_depth=2, poll_interval=0.02)), \
+                 patch('handler.queue_workflow', slow_queue_workflow):
+                task = asyncio.create_task(handler.async_handler(job))
+                await asyncio.to_thread(self._wait_running, server)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), patch('handler.progress_update'):
+                asyncio.run(run(server, client))
+
+            assert client.queue_depth() == 0
+            assert client.event_stream().buffered() == 0
+            client.close()
+
+        assert len(server.interrupted) == 1
+
+    def test_abandoned_batch_deletes_pending_items(self):
+        """Test closing a batch early takes its queued items out of ComfyUI."""
+        import handler
+        from comfy_bridge import ComfyClient
+        from tests.fake_comfy import FakeComfyServer
+
+        job = {"id": "job-1", "input": {"workflow": self.WORKFLOW, "cache": False,
+                                        "grid": {"seed": [1, 2, 3]}}}
+        with FakeComfyServer(render_time=10, steps=100) as server:
+            client = ComfyClient(port=server.port)
+            with patch('handler.comfy_client', client), \
+                 patch('handler.scheduler', None), \
+                 patch('handler.progress_update'), \
+                 patch('handler.await_outputs', side_effect=KeyboardInterrupt):
+                items = handler.run_batch(job)
+                with pytest.raises(KeyboardInterrupt):
+                    next(items)
+
+            assert client.queue_depth() == 0
+            client.close()
+
+        assert len(server.deleted) == 2
+        assert len(server.interrupted) == 1
+
+
+class TestQuality:
+    """Tests for quality tiers on template jobs."""
+
+    WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_draft_queues_rewritten_graph(self, mock_client, mock_progress):
+        """Test a draft t2v job skips the upscale pass at a reduced size."""
+        import handler
+
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {"outputs": {}}
+
+        job = {"id": "test-job", "input": {
+            "template": "t2v", "prompt": "A red fox", "resolution": "720p", "quality": "draft",
+        }}
+        with patch('handler.WORKFLOW_DIR', self.WORKFLOW_DIR):
+            handler.handler(job)
+        queued = mock_client.queue_prompt.call_args[0][0]
+
+        classes = {node["class_type"] for node in queued.values()}
+        assert "LTXVLatentUpsampler" not in classes
+        assert queued["92:9"]["inputs"]["steps"] == 8
+        assert queued["92:89"]["inputs"]["width"] == 640
+        assert queued["92:89"]["inputs"]["height"] == 352
+        assert queued["92:3"]["inputs"]["text"] == "A red fox"
+
+    @patch('handler.progress_update')
+    @patch('handler.comfy_client')
+    def test_job_params_override_tier(self, mock_client, mock_progress):
+        """Test a job's own steps win over the tier's."""
+        import handler
+
+        mock_client.is_ready.return_value = True
+        mock_client.queue_prompt.return_value = "abc123"
+        mock_client.wait_for_completion.return_value = {"outputs": {}}
+
+        job = {"id": "test-job", "input": {"template": "t2v", "quality": "final", "steps": 30}}
+        with patch('handler.WORKFLOW_DIR', self.WORKFLOW_DIR):
+            handler.handler(job)
+        queued = mock_client.queue_prompt.call_args[0][0]
+
+        assert queued["92:9"]["inputs"]["steps"] == 30
+
+    @patch('handler.comfy_client')
+    def test_unknown_tier_is_an_error(self, mock_client):
+        """Test an unknown quality fails the job."""
+        from handler import handler
+
+        mock_client.is_ready.return_value = True
+        with patch('handler.WORKFLOW_DIR', self.WORKFLOW_DIR):
+            result = handler({"id": "test-job", "input": {"template": "t2v", "quality": "ultra"}})
+
+        assert result["status"] == "error"
+        assert "Unknown quality" in result["error"]
+
+    @patch('handler.comfy_client')
+    def test_direct_workflow_rejects_tier(self, mock_client):
+        """Test tiers other than standard need a template."""
+        from handler import handler
+
+        mock_client.is_ready.return_value = True
+        result = handler({"id": "test-job", "input": {
+            "workflow": {"1": {"inputs": {}, "class_type": "SaveImage"}}, "quality": "draft",
+        }})
+
+        assert result["status"] == "error"
+        assert "templates" in result["error"]
@@ -0,0 +1,329 @@
+"""
+Tests for input media ingestion.
+"""
+
+import pytest
+import base64
+import functools
+import hashlib
+import sys
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from input_media import (
+    InputMediaError,
+    InputStore,
+    MediaFetcher,
+    iter_base64,
+    sniff_extension,
+)
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+# The test server is on loopback, which is refused without an allow list
+LOCAL_HOSTS = ["127.0.0.1"]
+
+
+class SlowFileHandler(SimpleHTTPRequestHandler):
+    """Static file handler with a configurable per-request delay."""
+
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        if self.path.startswith("/redirect?to="):
+            self.send_response(302)
+            self.send_header("Location", self.path.partition("=")[2])
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """Serve tmp_path/served over HTTP."""
+    served = tmp_path / "served"
+    served.mkdir()
+    handler = functools.partial(SlowFileHandler, directory=str(served))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    SlowFileHandler.delay = 0.0
+
+
+class TestBase64:
+    """Tests for incremental base64 decoding."""
+
+    def test_decodes_across_slices(self):
+        """Test slices decode to the original bytes."""
+        data = os.urandom(10_000)
+        encoded = base64.b64encode(data).decode()
+
+        with patch('input_media.BASE64_CHUNK_CHARS', 400):
+            chunks = list(iter_base64(encoded))
+
+        assert len(chunks) > 1
+        assert b"".join(chunks) == data
+
+    def test_data_uri_and_line_breaks(self):
+        """Test data URI prefixes and MIME line breaks are handled."""
+        data = os.urandom(500)
+        encoded = base64.encodebytes(data).decode()
+
+        with patch('input_media.BASE64_CHUNK_CHARS', 40):
+            assert b"".join(iter_base64(f"data:image/png;base64,{encoded}")) == data
+
+    def test_invalid_base64(self):
+        """Test malformed data raises InputMediaError."""
+        with pytest.raises(InputMediaError):
+            list(iter_base64("not base64!"))
+
+    def test_sniff_extension(self):
+        """Test common containers are recognised."""
+        assert sniff_extension(PNG_HEADER + b"rest") == ".png"
+        assert sniff_extension(b"\x00\x00\x00\x18ftypmp42") == ".mp4"
+        assert sniff_extension(b"unknown") is None
+
+
+class TestMediaFetcher:
+    """Tests for MediaFetcher."""
+
+    def test_base64_saved_content_addressed(self, tmp_path):
+        """Test base64 input is saved under its content hash."""
+        data = PNG_HEADER + os.urandom(100)
+        filename = MediaFetcher().fetch(base64.b64encode(data).decode(), tmp_path)
+
+        assert filename == f"input_{hashlib.sha256(data).hexdigest()[:32]}.png"
+        assert (tmp_path / filename).read_bytes() == data
+        assert not list(tmp_path.glob(".incoming-*"))
+
+    def test_data_uri_extension_hint(self, tmp_path):
+        """Test the data URI mime type is used when content isn't recognised."""
+        encoded = base64.b64encode(b"plain bytes").decode()
+        filename = MediaFetcher().fetch(f"data:image/jpeg;base64,{encoded}", tmp_path)
+
+        assert filename.endswith(".jpg")
+
+    def test_http_url_streamed(self, tmp_path, file_server):
+        """Test http inputs are streamed with bounded memory."""
+        import tracemalloc
+
+        served, base_url = file_server
+        data = b"\x00\x00\x00\x18ftypmp42" + os.urandom(16 * 1024 * 1024)
+        (served / "clip.mov").write_bytes(data)
+
+        tracemalloc.start()
+        filename = MediaFetcher(allowed_hosts=LOCAL_HOSTS).fetch(f"{base_url}/clip.mov", tmp_path / "input")
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        assert filename.endswith(".mp4")
+        assert (tmp_path / "input" / filename).read_bytes() == data
+        assert peak < 4 * 1024 * 1024
+
+    def test_http_error(self, tmp_path, file_server):
+        """Test missing URLs raise InputMediaError."""
+        _, base_url = file_server
+        with pytest.raises(InputMediaError, match="404"):
+            MediaFetcher(allowed_hosts=LOCAL_HOSTS).fetch(f"{base_url}/missing.png", tmp_path)
+
+    def test_private_hosts_refused(self, tmp_path, file_server):
+        """Test loopback and metadata addresses aren't fetched without an allow list."""
+        served, base_url = file_server
+        (served / "a.png").write_bytes(PNG_HEADER)
+
+        for url in (f"{base_url}/a.png", "http://169.254.169.254/latest/meta-data/", "http://localhost:8188/queue"):
+            with pytest.raises(InputMediaError, match="non-public"):
+                MediaFetcher().fetch(url, tmp_path)
+
+    def test_allowed_hosts(self, tmp_path, file_server):
+        """Test an allow list admits its hosts only, redirects included."""
+        served, base_url = file_server
+        (served / "a.png").write_bytes(PNG_HEADER)
+        fetcher = MediaFetcher(allowed_hosts=LOCAL_HOSTS)
+
+        assert fetcher.fetch(f"{base_url}/redirect?to=/a.png", tmp_path).endswith(".png")
+        with pytest.raises(InputMediaError, match="allowed hosts"):
+            fetcher.fetch(f"{base_url}/redirect?to=http://localhost:1/a.png", tmp_path)
+        with pytest.raises(InputMediaError, match="allowed hosts"):
+            MediaFetcher(allowed_hosts=[".example.com"]).fetch(f"{base_url}/a.png", tmp_path)
+
+    def test_oversized_input_refused(self, tmp_path, file_server):
+        """Test inputs over the byte limit are cut off and leave nothing behind."""
+        served, base_url = file_server
+        (served / "big.png").write_bytes(PNG_HEADER + b"x" * 4096)
+        fetcher = MediaFetcher(allowed_hosts=LOCAL_HOSTS, max_input_bytes=1024)
+
+        with pytest.raises(InputMediaError, match="limit"):
+            fetcher.fetch(f"{base_url}/big.png", tmp_path / "input")
+        with pytest.raises(InputMediaError, match="limit"):
+            fetcher.fetch(base64.b64encode(b"x" * 4096).decode(), tmp_path / "input")
+        assert list((tmp_path / "input").iterdir()) == []
+
+    def test_fetch_all_concurrent(self, tmp_path, file_server):
+        """Test several URLs are fetched in parallel."""
+        served, base_url = file_server
+        for i in range(4):
+            (served / f"{i}.png").write_bytes(PNG_HEADER + bytes([i]))
+        SlowFileHandler.delay = 0.2
+
+        start = time.perf_counter()
+        saved = MediaFetcher(max_workers=4, allowed_hosts=LOCAL_HOSTS).fetch_all(
+            {f"image_{i}": f"{base_url}/{i}.png" for i in range(4)}, tmp_path / "input"
+        )
+        elapsed = time.perf_counter() - start
+
+        assert len(set(saved.values())) == 4
+        assert elapsed < 0.6
+
+    def test_fetch_all_names_failing_input(self, tmp_path):
+        """Test errors identify the input that failed."""
+        with pytest.raises(InputMediaError, match="control_video"):
+            MediaFetcher().fetch_all({"control_video": "not base64!"}, tmp_path)
+
+    def test_file_url_within_allowed_root(self, tmp_path):
+        """Test file:// inputs are read from allowed roots."""
+        volume = tmp_path / "volume"
+        volume.mkdir()
+        (volume / "still.png").write_bytes(PNG_HEADER + b"still")
+
+        fetcher = MediaFetcher(allowed_file_roots=[volume])
+        filename = fetcher.fetch(f"file://{volume}/still.png", tmp_path / "input")
+
+        assert (tmp_path / "input" / filename).read_bytes() == PNG_HEADER + b"still"
+
+    def test_file_url_outside_allowed_root(self, tmp_path):
+        """Test file:// inputs outside the allowed roots are rejected."""
+        secret = tmp_path / "secret.txt"
+        secret.write_bytes(b"secret")
+
+        fetcher = MediaFetcher(allowed_file_roots=[tmp_path / "volume"])
+        with pytest.raises(InputMediaError, match="must be under"):
+            fetcher.fetch(f"file://{secret}", tmp_path / "input")
+
+    def test_s3_url(self, tmp_path, monkeypatch):
+        """Test s3:// inputs are streamed from the bucket."""
+        moto_server = pytest.importorskip("moto.server")
+        import boto3
+
+        server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+        server.start()
+        try:
+            host, port = server.get_host_and_port()
+            monkeypatch.setenv("BUCKET_ENDPOINT_URL", f"http://{host}:{port}")
+            monkeypatch.setenv("BUCKET_ACCESS_KEY_ID", "test")
+            monkeypatch.setenv("BUCKET_SECRET_ACCESS_KEY", "test")
+            monkeypatch.setenv("BUCKET_REGION", "us-east-1")
+            client = boto3.client(
+                "s3", endpoint_url=f"http://{host}:{port}", region_name="us-east-1",
+                aws_access_key_id="test", aws_secret_access_key="test",
+            )
+            client.create_bucket(Bucket="inputs")
+            client.put_object(Bucket="inputs", Key="brand/still.png", Body=PNG_HEADER + b"brand")
+
+            filename = MediaFetcher().fetch("s3://inputs/brand/still.png", tmp_path)
+        finally:
+            server.stop()
+
+        assert (tmp_path / filename).read_bytes() == PNG_HEADER + b"brand"
+
+
+class TestInputStore:
+    """Tests for the content-addressed input store."""
+
+    def encoded(self, size, fill):
+        return base64.b64encode(PNG_HEADER + bytes([fill]) * size).decode()
+
+    def test_repeat_input_is_a_hit(self, tmp_path):
+        """Test a repeated input reuses the stored file without rewriting it."""
+        fetcher = MediaFetcher()
+        data = self.encoded(100, 1)
+
+        first = fetcher.fetch(data, tmp_path)
+        mtime = (tmp_path / first).stat().st_mtime_ns
+        with patch('input_media.iter_base64') as decode:
+            second = fetcher.fetch(data, tmp_path)
+
+        assert second == first
+        decode.assert_not_called()
+        assert (tmp_path / first).stat().st_mtime_ns == mtime
+        stats = fetcher.store(tmp_path).stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_same_content_different_encoding_is_a_hit(self, tmp_path):
+        """Test content already stored isn't replaced when it arrives differently encoded."""
+        fetcher = MediaFetcher()
+        raw = PNG_HEADER + b"x" * 100
+
+        first = fetcher.fetch(base64.b64encode(raw).decode(), tmp_path)
+        second = fetcher.fetch(f"data:image/png;base64,{base64.b64encode(raw).decode()}", tmp_path)
+
+        assert second == first
+        assert fetcher.store(tmp_path).stats()["hits"] == 1
+        assert len(list(tmp_path.iterdir())) == 1
+
+    def test_lru_eviction_under_budget(self, tmp_path):
+        """Test least recently used unpinned files are evicted over budget."""
+        fetcher = MediaFetcher(cache_max_bytes=2500)
+        a = fetcher.fetch(self.encoded(1000, 1), tmp_path)
+        b = fetcher.fetch(self.encoded(1000, 2), tmp_path)
+        fetcher.release([a, b], tmp_path)
+
+        # Touch a so b becomes least recently used
+        fetcher.release([fetcher.fetch(self.encoded(1000, 1), tmp_path)], tmp_path)
+        c = fetcher.fetch(self.encoded(1000, 3), tmp_path)
+
+        assert (tmp_path / a).exists()
+        assert not (tmp_path / b).exists()
+        assert (tmp_path / c).exists()
+        stats = fetcher.store(tmp_path).stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= 2500
+
+        # An evicted input is fetched again as a miss
+        fetcher.fetch(self.encoded(1000, 2), tmp_path)
+        assert fetcher.store(tmp_path).stats()["misses"] == 4
+
+    def test_pinned_files_not_evicted(self, tmp_path):
+        """Test files in use by a job survive until released."""
+        fetcher = MediaFetcher(cache_max_bytes=1500)
+        a = fetcher.fetch(self.encoded(1000, 1), tmp_path)
+        b = fetcher.fetch(self.encoded(1000, 2), tmp_path)
+
+        assert (tmp_path / a).exists() and (tmp_path / b).exists()
+
+        fetcher.release([a, b], tmp_path)
+        assert not (tmp_path / a).exists()
+        assert (tmp_path / b).exists()
+
+    def test_adopts_existing_files(self, tmp_path):
+        """Test files from a previous run count toward the budget."""
+        (tmp_path / "input_old.png").write_bytes(b"x" * 1000)
+        (tmp_path / "user_file.png").write_bytes(b"y" * 1000)
+
+        store = InputStore(tmp_path, max_bytes=1500)
+        fetcher = MediaFetcher(cache_max_bytes=1500)
+        fetcher._stores[tmp_path] = store
+        fetcher.release([fetcher.fetch(self.encoded(1000, 1), tmp_path)], tmp_path)
+
+        assert not (tmp_path / "input_old.png").exists()
+        assert (tmp_path / "user_file.png").exists()
+
+    def test_failed_fetch_all_releases_saved_inputs(self, tmp_path):
+        """Test inputs saved before a failure aren't left pinned."""
+        fetcher = MediaFetcher(cache_max_bytes=1)
+        with pytest.raises(InputMediaError):
+            fetcher.fetch_all({"good": self.encoded(1000, 1), "bad": "not base64!"}, tmp_path)
+
+        assert not list(tmp_path.glob("input_*"))
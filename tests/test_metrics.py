@@ -0,0 +1,115 @@
+"""
+Tests for job and worker metrics.
+"""
+
+import asyncio
+import contextvars
+import sys
+import os
+
+import requests
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from metrics import (
+    MetricsRegistry,
+    StageTimer,
+    current_timer,
+    record_stage,
+    serve_metrics,
+    stage,
+    start_job_timer,
+)
+
+
+class TestStageTimer:
+    """Tests for per-job stage timing."""
+
+    def test_repeated_stages_accumulate(self):
+        """Test a stage entered several times sums its durations."""
+        timer = StageTimer()
+        timer.record("encoding", 0.25)
+        timer.record("encoding", 0.5)
+
+        assert timer.as_dict() == {"encoding": 0.75}
+
+    def test_node_reuse(self):
+        """Test cached and run nodes are counted per prompt, with the expected share."""
+        timer = StageTimer()
+        assert timer.reuse() is None
+
+        timer.record_nodes([{"node_id": "1", "class_type": "A", "seconds": 1.0},
+                            {"node_id": "2", "class_type": "B", "seconds": 2.0}])
+        timer.record_nodes([{"node_id": "1", "class_type": "A", "seconds": 0.0, "cached": True},
+                            {"node_id": "2", "class_type": "B", "seconds": 2.0}])
+        timer.expect_reuse(1, 4)
+
+        assert timer.reuse() == {"cached": 1, "run": 3, "rate": 0.25, "expected_rate": 0.25}
+
+    def test_stage_without_job_is_noop(self):
+        """Test stage() outside a job doesn't fail or record anywhere."""
+        async def outside():
+            with stage("queue"):
+                pass
+            record_stage("execution", 1.0)
+            return current_timer()
+
+        assert contextvars.Context().run(asyncio.run, outside()) is None
+
+    def test_timer_follows_job_into_threads(self):
+        """Test concurrent jobs keep separate timers, including in to_thread."""
+        async def job(seconds):
+            timer = start_job_timer()
+            await asyncio.to_thread(record_stage, "execution", seconds)
+            return timer.as_dict()
+
+        async def main():
+            return await asyncio.gather(job(1.0), job(2.0))
+
+        assert asyncio.run(main()) == [{"execution": 1.0}, {"execution": 2.0}]
+
+
+class TestMetricsRegistry:
+    """Tests for OpenMetrics export."""
+
+    def test_render(self):
+        """Test counters, histograms and gauges render in OpenMetrics format."""
+        registry = MetricsRegistry(buckets=(1, 10))
+        registry.observe_job("success", {"execution": 0.5}, 2.0)
+        registry.observe_job("success", {"execution": 5.0}, 6.0)
+        registry.observe_job("error", {}, 0.1)
+        registry.set_worker_timings({"comfyui_boot": 12.5})
+        registry.set_counters({"model_swaps": 3, "model_swaps_avoided": 4})
+
+        text = registry.render()
+        lines = text.splitlines()
+
+        assert 'comfy_worker_jobs_total{status="success"} 2' in lines
+        assert 'comfy_worker_jobs_total{status="error"} 1' in lines
+        assert 'comfy_worker_job_stage_seconds_bucket{stage="execution",le="1"} 1' in lines
+        assert 'comfy_worker_job_stage_seconds_bucket{stage="execution",le="10"} 2' in lines
+        assert 'comfy_worker_job_stage_seconds_bucket{stage="execution",le="+Inf"} 2' in lines
+        assert 'comfy_worker_job_stage_seconds_sum{stage="execution"} 5.5' in lines
+        assert 'comfy_worker_job_seconds_count 3' in lines
+        assert 'comfy_worker_startup_seconds{stage="comfyui_boot"} 12.5' in lines
+        assert '# TYPE comfy_worker_model_swaps_avoided counter' in lines
+        assert 'comfy_worker_model_swaps_avoided_total 4' in lines
+        assert text.endswith("# EOF\n")
+
+    def test_serve_metrics(self):
+        """Test the /metrics endpoint serves the registry."""
+        registry = MetricsRegistry()
+        registry.observe_job("success", {"queue": 0.01}, 1.0)
+        server = serve_metrics(registry, host="127.0.0.1", port=0)
+        try:
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            r = requests.get(f"{base}/metrics", timeout=5)
+            missing = requests.get(f"{base}/other", timeout=5)
+        finally:
+            server.shutdown()
+
+        assert r.status_code == 200
+        assert r.headers["Content-Type"].startswith("application/openmetrics-text")
+        assert 'comfy_worker_jobs_total{status="success"} 1' in r.text
+        assert missing.status_code == 404
@@ -0,0 +1,252 @@
+"""
+Tests for output storage backends.
+"""
+
+import pytest
+import hashlib
+import sys
+import os
+import time
+
+import requests
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from output_storage import (
+    EVICT_BATCH,
+    OutputIndex,
+    S3OutputStorage,
+    StorageError,
+    file_sha256,
+    storage_from_env,
+)
+
+moto_server = pytest.importorskip("moto.server")
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    """A local moto S3 server."""
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def storage(s3_endpoint):
+    """S3 storage pointed at a fresh bucket on the moto server."""
+    storage = S3OutputStorage(
+        bucket="outputs",
+        endpoint_url=s3_endpoint,
+        access_key_id="test",
+        secret_access_key="test",
+        region="us-east-1",
+        prefix="jobs/",
+        part_size=5 * 1024 * 1024,
+        max_concurrency=4,
+    )
+    storage.client.create_bucket(Bucket="outputs")
+    return storage
+
+
+class TestS3OutputStorage:
+    """Tests for S3OutputStorage against a moto server."""
+
+    def test_upload_returns_url_size_and_checksum(self, storage, tmp_path):
+        """Test the returned URL serves the uploaded bytes."""
+        data = os.urandom(1024)
+        filepath = tmp_path / "out.mp4"
+        filepath.write_bytes(data)
+
+        result = storage.upload(filepath, "job-1/out.mp4")
+
+        assert result["key"] == "jobs/job-1/out.mp4"
+        assert result["size_bytes"] == 1024
+        assert result["sha256"] == hashlib.sha256(data).hexdigest()
+        assert requests.get(result["url"], timeout=5).content == data
+
+        head = storage.client.head_object(Bucket="outputs", Key="jobs/job-1/out.mp4")
+        assert head["ContentType"] == "video/mp4"
+        assert head["Metadata"]["sha256"] == result["sha256"]
+
+    def test_large_file_uses_multipart(self, storage, tmp_path):
+        """Test files above the part size are uploaded in parts."""
+        data = os.urandom(12 * 1024 * 1024)
+        filepath = tmp_path / "big.mp4"
+        filepath.write_bytes(data)
+
+        result = storage.upload(filepath, "big.mp4")
+
+        head = storage.client.head_object(Bucket="outputs", Key=result["key"])
+        assert head["ETag"].strip('"').endswith("-3")
+        assert requests.get(result["url"], timeout=5).content == data
+
+    def test_public_base_url(self, storage, tmp_path):
+        """Test public buckets get plain URLs instead of presigned ones."""
+        storage.public_base_url = "https://cdn.example.com"
+        filepath = tmp_path / "out.png"
+        filepath.write_bytes(b"png")
+
+        result = storage.upload(filepath, "out.png")
+
+        assert result["url"] == "https://cdn.example.com/jobs/out.png"
+
+    def test_upload_failure_raises_storage_error(self, s3_endpoint, tmp_path):
+        """Test upload errors are wrapped in StorageError."""
+        storage = S3OutputStorage(
+            bucket="missing-bucket",
+            endpoint_url=s3_endpoint,
+            access_key_id="test",
+            secret_access_key="test",
+            region="us-east-1",
+        )
+        filepath = tmp_path / "out.png"
+        filepath.write_bytes(b"png")
+
+        with pytest.raises(StorageError, match="missing-bucket"):
+            storage.upload(filepath, "out.png")
+
+
+class TestStorageHelpers:
+    """Tests for storage helper functions."""
+
+    def test_file_sha256(self, tmp_path):
+        """Test streaming hash matches hashlib."""
+        data = os.urandom(3 * 1024 * 1024 + 7)
+        filepath = tmp_path / "data.bin"
+        filepath.write_bytes(data)
+
+        assert file_sha256(filepath) == hashlib.sha256(data).hexdigest()
+
+    def test_storage_from_env_unconfigured(self, monkeypatch):
+        """Test no backend is built without a bucket name."""
+        monkeypatch.delenv("BUCKET_NAME", raising=False)
+        assert storage_from_env() is None
+
+    def test_storage_from_env(self, monkeypatch):
+        """Test the backend picks up bucket settings."""
+        monkeypatch.setenv("BUCKET_NAME", "outputs")
+        monkeypatch.setenv("BUCKET_PREFIX", "ltx/")
+        monkeypatch.setenv("BUCKET_ENDPOINT_URL", "http://127.0.0.1:9000")
+
+        storage = storage_from_env()
+
+        assert storage.bucket == "outputs"
+        assert storage.prefix == "ltx/"
+
+
+class TestOutputIndex:
+    """Tests for the output file index."""
+
+    def make_files(self, directory, count, size=100):
+        paths = []
+        for index in range(count):
+            path = directory / f"LTX-2_{index:05d}_.mp4"
+            path.write_bytes(b"v" * size)
+            paths.append(path)
+        return paths
+
+    def test_remove_deletes_indexed_files_only(self, tmp_path):
+        """Test delivered files are deleted and unindexed ones are kept."""
+        index = OutputIndex()
+        indexed, unindexed = self.make_files(tmp_path, 2)
+        index.add([indexed])
+
+        assert index.remove([indexed, unindexed]) == 1
+        assert not indexed.exists()
+        assert unindexed.exists()
+        assert index.stats()["bytes"] == 0
+
+    def test_saved_index_restored_after_restart(self, tmp_path):
+        """Test a restarted worker evicts its own leftovers first and nothing else."""
+        state_path = tmp_path / ".output-index.json"
+        kept, delivered, left_over = self.make_files(tmp_path, 3)
+        (tmp_path / "other-worker").mkdir()
+        (foreign,) = self.make_files(tmp_path / "other-worker", 1)
+
+        index = OutputIndex(state_path=state_path)
+        index.add([left_over, delivered])
+        index.remove([delivered])
+        index.save()
+
+        restarted = OutputIndex(max_bytes=150, state_path=state_path)
+        restarted.add([kept])
+
+        assert restarted.load() == 1
+        assert restarted.stats()["bytes"] == 200
+
+        restarted.evict()
+
+        assert not left_over.exists()
+        assert kept.exists() and foreign.exists()
+        assert restarted.stats()["bytes"] == 100
+
+    def test_unreadable_state_ignored(self, tmp_path):
+        """Test a corrupt saved index starts the worker with an empty index."""
+        state_path = tmp_path / ".output-index.json"
+        state_path.write_text("{not json")
+
+        index = OutputIndex(state_path=state_path)
+
+        assert index.load() == 0
+        assert index.stats()["files"] == 0
+
+    def test_retained_files_need_every_removal(self, tmp_path):
+        """Test a file shared by several jobs outlives all but the last removal."""
+        index = OutputIndex()
+        (path,) = self.make_files(tmp_path, 1)
+        index.add([path])
+        index.retain([path], 2)
+
+        assert index.remove([path]) == 0
+        assert index.remove([path]) == 0
+        assert path.exists()
+        assert index.remove([path]) == 1
+        assert not path.exists()
+
+    def test_evicts_oldest_beyond_byte_budget(self, tmp_path):
+        """Test eviction removes the oldest files until under budget."""
+        index = OutputIndex(max_bytes=250)
+        paths = self.make_files(tmp_path, 4)
+        for path in paths:
+            index.add([path])
+
+        assert index.evict() == 2
+        assert [path.exists() for path in paths] == [False, False, True, True]
+        assert index.stats()["bytes"] == 200
+
+    def test_evicts_expired_files(self, tmp_path):
+        """Test files older than max_age are evicted."""
+        index = OutputIndex(max_age=60)
+        old, new = self.make_files(tmp_path, 2)
+        index.add([old])
+        index._entries[str(old)] = (100, time.time() - 120)
+        index.add([new])
+
+        assert index.evict() == 1
+        assert not old.exists()
+        assert new.exists()
+
+    def test_eviction_is_incremental(self, tmp_path):
+        """Test one pass removes at most a batch of files."""
+        index = OutputIndex(max_bytes=1)
+        index.add(self.make_files(tmp_path, EVICT_BATCH + 5, size=1))
+
+        assert index.evict() == EVICT_BATCH
+        assert index.evict() == 4
+
+    def test_background_eviction_on_add(self, tmp_path):
+        """Test going over budget wakes the background evictor."""
+        index = OutputIndex(max_bytes=150)
+        index.start(interval=60)
+        paths = self.make_files(tmp_path, 2)
+        index.add(paths)
+
+        deadline = time.time() + 2
+        while paths[0].exists() and time.time() < deadline:
+            time.sleep(0.01)
+        assert not paths[0].exists()
+        assert paths[1].exists()
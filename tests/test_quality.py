@@ -0,0 +1,99 @@
+"""
+Tests for quality tier profiles.
+"""
+
+import sys
+import os
+
+import pytest
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from admission import workflow_shape
+from comfy_bridge import load_workflow, prune_workflow
+from quality import QualityError, check_profile, limit_shape, rewrite_graph
+
+
+WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+
+
+def template(name: str) -> dict:
+    return load_workflow(os.path.join(WORKFLOW_DIR, name))
+
+
+class TestRewriteGraph:
+    """Tests for profile inputs and relinks."""
+
+    def test_t2v_draft_skips_second_pass(self):
+        """Test the t2v draft decodes the first pass and prunes the rest."""
+        from handler import QUALITY_PROFILES
+
+        workflow = template("LTX-2_00041_.json")
+        draft, pruned = prune_workflow(rewrite_graph(workflow, QUALITY_PROFILES["t2v"]["draft"]))
+
+        classes = {node["class_type"] for node in draft.values()}
+        assert not classes & {"LTXVLatentUpsampler", "LatentUpscaleModelLoader", "ManualSigmas"}
+        assert len(draft) == len(workflow) - len(pruned)
+        assert "92:70" in pruned
+        assert draft["92:9"]["inputs"]["steps"] == 8
+        assert draft["92:98"]["inputs"]["samples"] == ["92:81", 2]
+
+    def test_does_not_mutate_input(self):
+        """Test the template is rewritten in a copy."""
+        workflow = template("LTX-2_00041_.json")
+
+        rewrite_graph(workflow, {"inputs": {"92:9": {"steps": 8}}})
+
+        assert workflow["92:9"]["inputs"]["steps"] == 20
+
+    def test_mismatched_profile_raises(self):
+        """Test a profile naming missing nodes is rejected."""
+        with pytest.raises(QualityError, match="missing node 99"):
+            rewrite_graph(template("LTX-2_00041_.json"), {"inputs": {"99": {"steps": 8}}})
+
+
+class TestCheckProfile:
+    """Tests for profile validation."""
+
+    def test_reports_each_problem(self):
+        workflow = template("LTX-2_00041_.json")
+        problems = check_profile(workflow, {
+            "inputs": {"92:9": {"stepz": 8}},
+            "relink": {"92:98": {"samples": "92:81"}},
+            "speed": 2,
+        })
+
+        assert len(problems) == 3
+
+    def test_shipped_profiles_fit_their_templates(self):
+        """Test every profile in the handler applies to its template."""
+        from handler import QUALITY_PROFILES, WORKFLOW_TEMPLATES
+
+        for name, tiers in QUALITY_PROFILES.items():
+            workflow = template(WORKFLOW_TEMPLATES[name])
+            for tier, profile in tiers.items():
+                assert check_profile(workflow, profile) == [], f"{name} {tier}"
+
+
+class TestLimitShape:
+    """Tests for size scaling and frame caps."""
+
+    def test_scales_size_and_caps_frames(self):
+        """Test sizes stay multiples of 32 and frames 8n + 1."""
+        workflow = template("LTX-2_00041_.json")
+
+        result = limit_shape(workflow, {"scale": 0.5, "max_frames": 50})
+
+        assert result == {"width": 352, "height": 640, "frames": 49}
+        shape = workflow_shape(workflow)
+        assert (shape["width"], shape["height"], shape["frames"]) == (352, 640, 49)
+
+    def test_short_renders_keep_their_frames(self):
+        workflow = template("LTX-2_00041_.json")
+        workflow["92:62"]["inputs"]["value"] = 25
+
+        assert limit_shape(workflow, {"max_frames": 49})["frames"] == 25
+
+    def test_no_limits_is_a_no_op(self):
+        assert limit_shape(template("LTX-2_00041_.json"), {"inputs": {}}) is None
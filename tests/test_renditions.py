@@ -0,0 +1,145 @@
+"""
+Tests for the output rendition ladder.
+"""
+
+import pytest
+import shutil
+import stat
+import subprocess
+import sys
+import os
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from renditions import RenditionError, ffmpeg_command, parse_ladder, render_ladder
+
+
+# Writes its last argument (the target) and fails for targets named "broken"
+FAKE_FFMPEG = """#!/bin/sh
+for target; do :; done
+case "$target" in
+    *broken*) echo "Unknown encoder 'libbroken'" >&2; exit 1 ;;
+esac
+printf 'rendition of %s' "$target" > "$target"
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+class TestParseLadder:
+    """Tests for resolving ladders from presets and overrides."""
+
+    def test_preset_names(self):
+        """Test comma-separated names resolve to full presets."""
+        ladder = parse_ladder("720p, poster,preview")
+
+        assert [r["name"] for r in ladder] == ["720p", "poster", "preview"]
+        assert ladder[0]["video_bitrate"] == "3M"
+        assert parse_ladder("") == []
+
+    def test_overrides_and_custom(self):
+        """Test presets can be overridden and new renditions defined."""
+        ladder = parse_ladder([
+            {"name": "720p", "video_bitrate": "2M"},
+            {"name": "square", "kind": "video", "width": 1080, "video_bitrate": "4M"},
+        ])
+
+        assert ladder[0]["video_bitrate"] == "2M" and ladder[0]["height"] == 720
+        assert ladder[1]["width"] == 1080
+
+    @pytest.mark.parametrize("spec", [
+        "4k",
+        [{"name": "x", "kind": "audio"}],
+        [{"name": "x", "kind": "video", "height": 720}],
+        [{"name": "preview", "format": "apng"}],
+        ["720p", "720p"],
+        {"720p": {}},
+        [{"name": "preview", "fps": "12,movie=/etc/passwd[m];[m]null"}],
+        [{"name": "preview", "fps": 0}],
+        [{"name": "preview", "seconds": "3;x"}],
+        [{"name": "preview", "quality": 101}],
+        [{"name": "720p", "video_bitrate": 2000000}],
+        [{"name": "720p", "video_bitrate": "fast"}],
+        [{"name": "720p", "audio_bitrate": "128k -map 0"}],
+        [{"name": "720p", "preset": "veryfast -vf hflip"}],
+        [{"name": "720p", "height": "abc"}],
+        [{"name": "720p", "height": True}],
+        [{"name": "poster", "fps": 12}],
+        [{"name": "../escape", "kind": "poster", "height": 720}],
+    ])
+    def test_invalid(self, spec):
+        with pytest.raises(RenditionError):
+            parse_ladder(spec)
+
+
+class TestFfmpegCommand:
+    """Tests for the encoder command of each kind of rendition."""
+
+    def test_video(self):
+        """Test video renditions cap height and bitrate and keep optional audio."""
+        command = ffmpeg_command("in.mp4", "out.mp4", parse_ladder("720p")[0], threads=4)
+
+        assert command[0] == "ffmpeg" and command[-1] == "out.mp4"
+        assert "scale=-2:'min(720,ih)':flags=lanczos" in command
+        assert command[command.index("-b:v") + 1] == "3M"
+        assert command[command.index("-bufsize") + 1] == "6M"
+        assert "0:a:0?" in command
+        assert command[command.index("-threads") + 1] == "4"
+
+    def test_poster_and_preview(self):
+        poster = ffmpeg_command("in.mp4", "out.jpg", parse_ladder("poster")[0])
+        gif = ffmpeg_command("in.mp4", "out.gif", parse_ladder("preview")[0])
+        webp = ffmpeg_command("in.mp4", "out.webp", parse_ladder([{"name": "preview", "format": "webp"}])[0])
+
+        assert poster[poster.index("-frames:v") + 1] == "1"
+        assert "palettegen" in gif[gif.index("-filter_complex") + 1]
+        assert "libwebp" in webp
+
+
+class TestRenderLadder:
+    """Tests for encoding a ladder concurrently."""
+
+    def test_sizes_and_failures(self, tmp_path, fake_ffmpeg):
+        """Test each rendition reports its size, and a failure doesn't stop the rest."""
+        master = tmp_path / "LTX-2_00001_.mp4"
+        master.write_bytes(b"master")
+        ladder = parse_ladder(["720p", "poster", {"name": "broken", "kind": "video",
+                                                  "height": 480, "video_bitrate": "1M"}])
+
+        results = render_ladder(master, tmp_path / "out", ladder, ffmpeg=fake_ffmpeg)
+
+        assert [r["name"] for r in results] == ["720p", "poster", "broken"]
+        assert results[0]["path"].endswith("LTX-2_00001__720p.mp4")
+        assert results[0]["size_bytes"] == os.path.getsize(results[0]["path"])
+        assert results[1]["path"].endswith(".jpg")
+        assert "libbroken" in results[2]["error"]
+        assert not (tmp_path / "out" / "LTX-2_00001__broken.mp4").exists()
+
+    def test_missing_ffmpeg(self, tmp_path):
+        master = tmp_path / "in.mp4"
+        master.write_bytes(b"master")
+
+        results = render_ladder(master, tmp_path / "out", parse_ladder("poster"), ffmpeg=str(tmp_path / "nope"))
+
+        assert "could not run" in results[0]["error"]
+
+    @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+    def test_real_ffmpeg(self, tmp_path):
+        """Test a full ladder encodes from a synthetic clip."""
+        master = tmp_path / "clip.mp4"
+        subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=960x544:rate=24",
+            "-t", "2", "-pix_fmt", "yuv420p", str(master),
+        ], check=True)
+
+        results = render_ladder(master, tmp_path / "out", parse_ladder("1080p,480p,poster,preview"))
+
+        assert [r.get("error") for r in results] == [None] * 4
+        assert all(r["size_bytes"] > 0 for r in results)
@@ -0,0 +1,210 @@
+"""
+Tests for the workflow result cache.
+"""
+
+import pytest
+import sys
+import os
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from result_cache import (
+    DirectoryResultStore,
+    InflightTable,
+    ResultCache,
+    S3ResultStore,
+    result_key,
+)
+
+
+WORKFLOW = {
+    "1": {"class_type": "CLIPTextEncode", "inputs": {"text": "a fox", "clip": ["2", 0]}, "_meta": {"title": "Prompt"}},
+    "2": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "ltx.safetensors"}},
+}
+
+
+def make_outputs(directory: Path, *contents: bytes) -> list:
+    directory.mkdir(parents=True, exist_ok=True)
+    outputs = []
+    for index, data in enumerate(contents):
+        path = directory / f"out_{index}.mp4"
+        path.write_bytes(data)
+        outputs.append(({"type": "video", "filename": path.name, "node_id": "75"}, path))
+    return outputs
+
+
+class TestResultKey:
+    """Tests for cache key derivation."""
+
+    def test_key_ignores_order_and_meta(self):
+        """Test key order and UI titles don't change the key."""
+        reordered = {
+            "2": dict(WORKFLOW["2"]),
+            "1": {"inputs": {"clip": ["2", 0], "text": "a fox"}, "class_type": "CLIPTextEncode"},
+        }
+        assert result_key(reordered) == result_key(WORKFLOW)
+
+    def test_key_changes_with_values_and_inputs(self):
+        """Test parameters and input content are part of the key."""
+        changed = {**WORKFLOW, "1": {**WORKFLOW["1"], "inputs": {"text": "a cat", "clip": ["2", 0]}}}
+
+        assert result_key(changed) != result_key(WORKFLOW)
+        assert result_key(WORKFLOW, {"ref.png": "aaa"}) != result_key(WORKFLOW, {"ref.png": "bbb"})
+
+
+class TestResultCache:
+    """Tests for the local cache and shared stores."""
+
+    def test_put_then_get(self, tmp_path):
+        """Test stored outputs are returned with local paths."""
+        cache = ResultCache(tmp_path / "cache")
+        cache.put("k1", "prompt-1", make_outputs(tmp_path / "out", b"video bytes"))
+
+        result = cache.get("k1")
+
+        assert result["prompt_id"] == "prompt-1"
+        assert Path(result["outputs"][0]["path"]).read_bytes() == b"video bytes"
+        assert cache.get("missing") is None
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+    def test_entry_survives_output_removal(self, tmp_path):
+        """Test the cache keeps its own copy of outputs."""
+        cache = ResultCache(tmp_path / "cache")
+        outputs = make_outputs(tmp_path / "out", b"video bytes")
+        cache.put("k1", "prompt-1", outputs)
+        outputs[0][1].unlink()
+
+        assert Path(cache.get("k1")["outputs"][0]["path"]).read_bytes() == b"video bytes"
+
+    def test_lru_eviction(self, tmp_path):
+        """Test least recently used entries go first once over budget."""
+        cache = ResultCache(tmp_path / "cache", max_bytes=2500)
+        cache.put("a", "p", make_outputs(tmp_path / "a", b"a" * 1000))
+        cache.put("b", "p", make_outputs(tmp_path / "b", b"b" * 1000))
+        cache.get("a")
+        cache.put("c", "p", make_outputs(tmp_path / "c", b"c" * 1000))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= 2500
+
+    def test_hit_survives_eviction(self, tmp_path):
+        """Test a job keeps the files it got even if a concurrent put evicts the entry."""
+        cache = ResultCache(tmp_path / "cache", max_bytes=1500)
+        cache.put("a", "p", make_outputs(tmp_path / "a", b"a" * 1000))
+
+        hit = cache.get("a")
+        cache.put("b", "p", make_outputs(tmp_path / "b", b"b" * 1000))
+
+        assert cache.stats()["evictions"] == 1
+        assert Path(hit["outputs"][0]["path"]).read_bytes() == b"a" * 1000
+
+    def test_entry_with_missing_files_is_a_miss(self, tmp_path):
+        """Test an entry whose files are gone is dropped instead of returned."""
+        cache = ResultCache(tmp_path / "cache")
+        cache.put("k1", "prompt-1", make_outputs(tmp_path / "out", b"video bytes"))
+        (tmp_path / "cache" / "k1" / "out_0.mp4").unlink()
+
+        assert cache.get("k1") is None
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["misses"] == 1
+
+    def test_reloads_entries_from_disk(self, tmp_path):
+        """Test a restarted worker finds earlier entries."""
+        ResultCache(tmp_path / "cache").put("k1", "prompt-1", make_outputs(tmp_path / "out", b"x" * 10))
+
+        cache = ResultCache(tmp_path / "cache")
+
+        assert cache.get("k1")["prompt_id"] == "prompt-1"
+        assert cache.stats()["entries"] == 1
+
+    def test_shared_directory_store(self, tmp_path):
+        """Test a result stored by one worker is found by another."""
+        shared = DirectoryResultStore(tmp_path / "volume")
+        first = ResultCache(tmp_path / "worker1", shared=shared)
+        second = ResultCache(tmp_path / "worker2", shared=shared)
+
+        first.put("k1", "prompt-1", make_outputs(tmp_path / "out", b"shared bytes"))
+        result = second.get("k1")
+
+        assert Path(result["outputs"][0]["path"]).read_bytes() == b"shared bytes"
+        assert second.stats()["shared_hits"] == 1
+        # Now local to the second worker
+        second.get("k1")
+        assert second.stats()["shared_hits"] == 1
+
+    def test_shared_s3_store(self, tmp_path):
+        """Test the S3 store round-trips entries through a bucket."""
+        moto_server = pytest.importorskip("moto.server")
+        import boto3
+
+        server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+        server.start()
+        try:
+            host, port = server.get_host_and_port()
+            client = boto3.client(
+                "s3", endpoint_url=f"http://{host}:{port}", region_name="us-east-1",
+                aws_access_key_id="test", aws_secret_access_key="test",
+            )
+            client.create_bucket(Bucket="results")
+            shared = S3ResultStore("results", "cache/", client=client)
+
+            ResultCache(tmp_path / "worker1", shared=shared).put(
+                "k1", "prompt-1", make_outputs(tmp_path / "out", b"one", b"two")
+            )
+            second = ResultCache(tmp_path / "worker2", shared=shared)
+            result = second.get("k1")
+            missing = second.get("k2")
+        finally:
+            server.stop()
+
+        assert [Path(o["path"]).read_bytes() for o in result["outputs"]] == [b"one", b"two"]
+        assert missing is None
+
+
+class TestInflightTable:
+    """Tests for joining renders in progress."""
+
+    def test_duplicates_join_the_owner(self):
+        """Test the first caller owns a key and later ones follow it."""
+        table = InflightTable()
+        flight, owner = table.join("k")
+        joined, joined_owner = table.join("k")
+        retained = []
+
+        assert (owner, joined_owner) == (True, False)
+        assert joined is flight
+
+        table.finish("k", flight, "prompt-1", [{"filename": "a.mp4"}], retain=retained.append)
+
+        assert joined.wait(1) == ("prompt-1", [{"filename": "a.mp4"}])
+        assert retained == [1]
+        assert len(table) == 0
+        assert table.join("k")[1] is True
+
+    def test_failure_reaches_followers(self):
+        """Test followers get the owner's error."""
+        table = InflightTable()
+        flight, _ = table.join("k")
+        joined, _ = table.join("k")
+
+        table.fail("k", flight, RuntimeError("out of memory"))
+
+        with pytest.raises(RuntimeError, match="out of memory"):
+            joined.wait(1)
+        assert len(table) == 0
+
+    def test_stale_owner_does_not_close_new_flight(self):
+        """Test failing a finished flight leaves a newer one for the key alone."""
+        table = InflightTable()
+        first, _ = table.join("k")
+        table.finish("k", first, "p1", [])
+        second, _ = table.join("k")
+
+        table.fail("k", first, RuntimeError("late"))
+
+        assert table.join("k") == (second, False)
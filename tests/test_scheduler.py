@@ -0,0 +1,168 @@
+"""
+Tests for cost-aware render scheduling.
+"""
+
+import asyncio
+import pytest
+import sys
+import os
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from comfy_bridge import QueueDepthGate
+from scheduler import ModelResidency, Scheduler, SchedulerError, Ticket, count_swaps
+
+
+def labels(tickets: list) -> list:
+    return [ticket.label for ticket in tickets]
+
+
+class TestScheduler:
+    """Tests for picking and ordering tickets."""
+
+    def test_shortest_first(self):
+        """Test cheaper renders go first, ties in arrival order."""
+        tickets = [Ticket(60, label="a", arrived=0), Ticket(10, label="b", arrived=0),
+                   Ticket(30, label="c", arrived=0), Ticket(10, label="d", arrived=0)]
+
+        assert labels(Scheduler("sjf", group_bonus=0).order(tickets, now=0)) == ["b", "d", "c", "a"]
+        assert labels(Scheduler("fifo").order(tickets, now=0)) == ["a", "b", "c", "d"]
+
+    def test_aging_prevents_starvation(self):
+        """Test a long render that has waited long enough beats new short ones."""
+        scheduler = Scheduler("sjf", aging=1.0, group_bonus=0)
+        long = Ticket(100, label="long", arrived=0)
+
+        assert scheduler.pick([long, Ticket(20, label="short", arrived=50)], now=50).label == "short"
+        assert scheduler.pick([long, Ticket(20, label="short", arrived=90)], now=90).label == "long"
+
+    def test_order_ages_tickets_as_it_goes(self):
+        """Test a long render isn't pushed behind every shorter one in a big batch."""
+        scheduler = Scheduler("sjf", aging=1.0, group_bonus=0)
+        tickets = [Ticket(100, label="long", arrived=0)]
+        tickets += [Ticket(20, label=f"s{i}", arrived=i * 20) for i in range(10)]
+
+        ordered = labels(scheduler.order(tickets, now=0))
+
+        assert ordered.index("long") < len(ordered) - 1
+
+    def test_group_bonus(self):
+        """Test renders sharing the last group's models are preferred."""
+        scheduler = Scheduler("sjf", aging=0, group_bonus=30)
+        tickets = [Ticket(20, "i2v", "a", arrived=0), Ticket(40, "t2v", "b", arrived=0),
+                   Ticket(25, "i2v", "c", arrived=0), Ticket(45, "t2v", "d", arrived=0)]
+
+        assert labels(scheduler.order(tickets, now=0, last_group="t2v")) == ["b", "d", "a", "c"]
+
+    def test_unknown_policy(self):
+        with pytest.raises(SchedulerError):
+            Scheduler("lifo")
+
+    def test_count_swaps(self):
+        """Test swaps are counted at each change of group, starting from the resident one."""
+        assert count_swaps(["a", "a", "b", None, "b", "a"]) == 2
+        assert count_swaps(["a", "b"], resident="b") == 2
+
+
+class TestModelResidency:
+    """Tests for following the loaded model set."""
+
+    def test_swaps_follow_queued_groups(self):
+        residency = ModelResidency()
+
+        assert residency.queued("i2v") is False
+        assert residency.queued(None) is False
+        assert residency.queued("i2v") is False
+        assert residency.queued("t2v") is True
+        residency.record_avoided(2)
+
+        assert residency.resident == "t2v"
+        assert residency.counters() == {"model_swaps": 1, "model_swaps_avoided": 2}
+
+
+class FakeQueue:
+    """Stands in for ComfyClient.queue_depth."""
+
+    def __init__(self, depth: int = 0):
+        self.depth = depth
+
+    def queue_depth(self) -> int:
+        return self.depth
+
+
+class TestScheduledGate:
+    """Tests for QueueDepthGate ordering waiting prompts."""
+
+    def test_waiting_prompts_go_in_scheduler_order(self):
+        """Test prompts that queued up behind a full queue leave cheapest first."""
+        queue = FakeQueue(depth=2)
+        gate = QueueDepthGate(queue, max_depth=2, poll_interval=0.01, scheduler=Scheduler("sjf", group_bonus=0))
+        entered = []
+
+        async def render(ticket):
+            async with gate.turn(ticket):
+                entered.append(ticket.label)
+                queue.depth += 1
+
+        async def main():
+            tasks = [asyncio.create_task(render(Ticket(cost, label=label)))
+                     for label, cost in (("a", 300), ("b", 60), ("c", 120))]
+            await asyncio.sleep(0.05)
+            for _ in tasks:
+                queue.depth -= 1
+                await asyncio.sleep(0.05)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+
+        assert entered == ["b", "c", "a"]
+
+    def test_cancelled_waiter_lets_others_through(self):
+        """Test cancelling the next prompt in line doesn't stall the rest."""
+        queue = FakeQueue(depth=1)
+        gate = QueueDepthGate(queue, max_depth=1, poll_interval=0.01, scheduler=Scheduler("sjf"))
+        entered = []
+
+        async def render(ticket):
+            async with gate.turn(ticket):
+                entered.append(ticket.label)
+
+        async def main():
+            cheap = asyncio.create_task(render(Ticket(10, label="cheap")))
+            costly = asyncio.create_task(render(Ticket(100, label="costly")))
+            await asyncio.sleep(0.05)
+            cheap.cancel()
+            await asyncio.sleep(0.01)
+            queue.depth = 0
+            await asyncio.wait_for(costly, 1)
+
+        asyncio.run(main())
+
+        assert entered == ["costly"]
+
+    def test_resident_models_preferred(self):
+        """Test a prompt for the loaded models overtakes an earlier one and counts as avoided."""
+        queue = FakeQueue(depth=1)
+        residency = ModelResidency()
+        residency.queued("i2v")
+        gate = QueueDepthGate(queue, max_depth=1, poll_interval=0.01,
+                              scheduler=Scheduler("sjf", aging=0, group_bonus=60), residency=residency)
+        entered = []
+
+        async def render(ticket):
+            async with gate.turn(ticket):
+                entered.append(ticket.label)
+                residency.queued(ticket.group)
+
+        async def main():
+            tasks = [asyncio.create_task(render(Ticket(40, "t2v", "t2v"))),
+                     asyncio.create_task(render(Ticket(80, "i2v", "i2v")))]
+            await asyncio.sleep(0.05)
+            queue.depth = 0
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+
+        assert entered == ["i2v", "t2v"]
+        assert residency.counters() == {"model_swaps": 1, "model_swaps_avoided": 1}